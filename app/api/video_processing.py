@@ -1,10 +1,19 @@
 from app.core.config import settings
 from app.utils.logger import get_logger
-from app.dtos.video_processing_dtos import VideoProcessingResponse, GetVideoTasksResponse, TaskList, GetTaskDetailsResponse
-from app.core.video_processing_service import process_video, get_tasks, get_task_details
+from app.dtos.video_processing_dtos import VideoProcessingResponse, GetVideoTasksResponse, GetTaskDetailsResponse, InitiateUploadRequest, InitiateUploadResponse, CompleteUploadRequest, BatchUploadResponse, BatchReferenceUploadRequest, BulkTaskStatusRequest, BulkTaskStatusResponse
+from app.dtos.error_success_code import ErrorAndSuccessCodes
+from app.constants.video_constants import ProcessingProfile, OutputDelivery
+from app.core.video_processing_service import process_video, process_video_batch, register_video_batch, get_tasks, get_tasks_status, get_task_details, get_task_output_key, get_queue_analytics, initiate_direct_upload, complete_direct_upload, delete_task, stream_task_progress
+from app.utils.s3_connect import s3
+from app.utils.redis_connect import redis_connection
+from app.utils.local_cache import LOCAL_CACHE_METRICS_KEY
+from app.utils.multipart_stream import stream_multipart, FIELD, FILE_START, FILE_DATA, FILE_END
+from app.utils.http_cache import build_cached_response
+from app.utils.output_delivery import build_output_response
 
-from fastapi import APIRouter, UploadFile, Form, File, Query, Path
-from typing import List, Optional
+from fastapi import APIRouter, Request, Query, Path
+from fastapi.responses import StreamingResponse, JSONResponse
+from typing import Optional
 import psutil
 
 logger = get_logger("video_processing")
@@ -14,16 +23,48 @@ router = APIRouter(tags=["VideoProcessing"])
 
 @router.post("/upload", response_model=VideoProcessingResponse)
 @router.head("/upload")
-async def video_processing_route(user_id : str = Form(...), video_file : UploadFile = File(...)):
+async def video_processing_route(request : Request):
     """
     Uploads a video file for processing.
+    The multipart body (user_id, profile, encoding_profile, video_file) is parsed while it is received and the file is streamed to S3,
+    user_id, profile and encoding_profile have to be sent before video_file.
     Returns:
         VideoProcessingResponse: task_id to fetch the status
     """
-    logger.info(f"Video Upload requested, User ID: {user_id}, File Name: {video_file.filename}")
+    fields = {}
+    file_event = None
+    events = stream_multipart(request)
+    try:
+        async for event in events:
+            if event[0] == FIELD:
+                fields[event[1]] = event[2]
+            elif event[0] == FILE_START and event[1] == "video_file":
+                file_event = event
+                break
+    except ValueError as e:
+        logger.error(f"Invalid Upload Request : {e}")
+
+    if not fields.get('user_id') or not file_event:
+        return VideoProcessingResponse(
+            status="error",
+            internal_status_code=ErrorAndSuccessCodes.INVALID_INPUT,
+        )
+
+    async def file_chunks():
+        async for event in events:
+            if event[0] == FILE_DATA:
+                yield event[1]
+            elif event[0] == FILE_END:
+                return
+
+    logger.info(f"Video Upload requested, User ID: {fields.get('user_id')}, File Name: {file_event[2]}")
     video_process_input = {
-        'user_id': user_id,
-        'video_file': video_file
+        'user_id': fields.get('user_id'),
+        'profile': fields.get('profile') or ProcessingProfile.MP4.value,
+        'encoding_profile': fields.get('encoding_profile') or settings.DEFAULT_ENCODING_PROFILE,
+        'file_name': file_event[2],
+        'content_type': file_event[3],
+        'file_chunks': file_chunks()
     }
     result = await process_video(video_process_input)
     
@@ -39,38 +80,237 @@ async def video_processing_route(user_id : str = Form(...), video_file : UploadF
             internal_status_code=result.get('status'),
         )
     
+@router.post("/upload/batch", response_model=BatchUploadResponse)
+async def batch_upload_route(request : Request):
+    """
+    Uploads many video files in one request, one rate limit check, one insert and one Celery publish for the whole batch.
+    Multipart body : user_id, file_count, profile, encoding_profile, then one video_file part per file,
+    file_count is the number of files in the request and is consumed from the rate limits up front.
+    Returns:
+        BatchUploadResponse: task_id and status per file, in the order of the files
+    """
+    fields = {}
+    file_event = None
+    events = stream_multipart(request)
+    try:
+        async for event in events:
+            if event[0] == FIELD:
+                fields[event[1]] = event[2]
+            elif event[0] == FILE_START and event[1] == "video_file":
+                file_event = event
+                break
+    except ValueError as e:
+        logger.error(f"Invalid Batch Upload Request : {e}")
+
+    if not fields.get('user_id') or not (fields.get('file_count') or "").isdigit() or not file_event:
+        return BatchUploadResponse(
+            status="error",
+            internal_status_code=ErrorAndSuccessCodes.INVALID_INPUT,
+        )
+
+    async def file_chunks():
+        async for event in events:
+            if event[0] == FILE_DATA:
+                yield event[1]
+            elif event[0] == FILE_END:
+                return
+
+    async def video_files():
+        # Files are read in the order they arrive, the rest of a file the service did not read is skipped
+        event = file_event
+        while event:
+            yield {'file_name' : event[2], 'content_type' : event[3], 'file_chunks' : file_chunks()}
+            event = None
+            async for next_event in events:
+                if next_event[0] == FILE_START and next_event[1] == "video_file":
+                    event = next_event
+                    break
+
+    logger.info(f"Batch Upload requested, User ID: {fields.get('user_id')}, Files: {fields.get('file_count')}")
+    result = await process_video_batch({
+        'user_id': fields.get('user_id'),
+        'profile': fields.get('profile') or ProcessingProfile.MP4.value,
+        'encoding_profile': fields.get('encoding_profile') or settings.DEFAULT_ENCODING_PROFILE,
+        'file_count': int(fields.get('file_count')),
+        'videos': video_files()
+    })
+    return BatchUploadResponse(
+        status="ok" if result.get('status') == ErrorAndSuccessCodes.SUCCESS else "error",
+        tasks=[{**task, 'internal_status_code' : task.get('status')} for task in result.get('tasks')],
+        internal_status_code=result.get('status'),
+    )
+
+@router.post("/upload/batch/references", response_model=BatchUploadResponse)
+async def batch_reference_upload_route(body : BatchReferenceUploadRequest):
+    """
+    Starts processing of many videos already in the upload bucket (S3 keys), without sending the bytes through the API.
+    Returns:
+        BatchUploadResponse: task_id and status per reference, in the order of the request
+    """
+    logger.info(f"Batch Reference Upload requested, User ID: {body.user_id}, Videos: {len(body.videos)}")
+    result = await register_video_batch(body.model_dump())
+    return BatchUploadResponse(
+        status="ok" if result.get('status') == ErrorAndSuccessCodes.SUCCESS else "error",
+        tasks=[{**task, 'internal_status_code' : task.get('status')} for task in result.get('tasks')],
+        internal_status_code=result.get('status'),
+    )
+
+@router.post("/upload/initiate", response_model=InitiateUploadResponse)
+async def initiate_direct_upload_route(body : InitiateUploadRequest):
+    """
+    Direct Upload (Step 1) : Creates the task and returns presigned URLs, one per part.
+    The client PUTs each part to its URL and keeps the ETag response header of every part.
+    Returns:
+        InitiateUploadResponse: task_id, upload_id, part_size and presigned part URLs
+    """
+    logger.info(f"Direct Upload requested, User ID: {body.user_id}, File Name: {body.file_name}, Size: {body.file_size}")
+    result = await initiate_direct_upload(body.model_dump())
+
+    if result.get('task_id') is None:
+        return InitiateUploadResponse(
+            status="error",
+            internal_status_code=result.get('status'),
+        )
+    return InitiateUploadResponse(
+        status="ok",
+        task_id=result.get('task_id'),
+        upload_id=result.get('upload_id'),
+        part_size=result.get('part_size'),
+        parts=result.get('parts'),
+        internal_status_code=result.get('status'),
+    )
+
+@router.post("/upload/complete", response_model=VideoProcessingResponse)
+async def complete_direct_upload_route(body : CompleteUploadRequest):
+    """
+    Direct Upload (Step 2) : Completes the upload, verifies the object and starts processing.
+    Returns:
+        VideoProcessingResponse: task_id to fetch the status
+    """
+    logger.info(f"Direct Upload completion requested, Task ID: {body.task_id}, Parts: {len(body.parts)}")
+    result = await complete_direct_upload(body.model_dump())
+
+    if result.get('task_id') is None:
+        return VideoProcessingResponse(
+            status="error",
+            internal_status_code=result.get('status'),
+        )
+    return VideoProcessingResponse(
+        status="ok",
+        task_id=result.get('task_id'),
+        internal_status_code=result.get('status'),
+    )
+
 @router.get("/tasks", response_model=GetVideoTasksResponse)
-async def get_tasks_list(user_id : str = Query(...), task_id: Optional[str] = Query(None)):
+async def get_tasks_list(request : Request, user_id : str = Query(...), task_id: Optional[str] = Query(None), limit : int = Query(20, ge=1, le=100), after : Optional[str] = Query(None)):
     '''
         Fetches tasks from DB
-        if task_id : then fetch only that task
-        else fetch all tasks for that user
+        if task_id : then fetch only that task (task cache)
+        else fetch the tasks for that user, newest first, one page of `limit` tasks
+        Next page : pass the returned next_cursor as `after`
+        ETag / Cache-Control : see http_cache.py
     '''
-    logger.info(f"Tasks requested, User ID: {user_id}, Task ID: {task_id}")
-    result : List[TaskList] = await get_tasks(user_id, task_id)
-    return GetVideoTasksResponse(
+    logger.info(f"Tasks requested, User ID: {user_id}, Task ID: {task_id}, Limit: {limit}, After: {after}")
+    result = await get_tasks(user_id, task_id, limit, after)
+    if result.get('status') != ErrorAndSuccessCodes.SUCCESS:
+        return GetVideoTasksResponse(
+            status="error",
+            data=[],
+            internal_status_code=result.get('status')
+        )
+    return build_cached_response(request, GetVideoTasksResponse(
         status="ok",
-        data=result
+        data=result.get('tasks'),
+        next_cursor=result.get('next_cursor')
+    ), result.get('terminal'))
+
+@router.post("/tasks/status", response_model=BulkTaskStatusResponse)
+async def get_tasks_status_route(body : BulkTaskStatusRequest):
+    '''
+        Status of many tasks in one request (up to BATCH_MAX_ITEMS task_ids), resolved with a single query
+    '''
+    logger.info(f"Bulk Task Status requested, Tasks: {len(body.task_ids)}")
+    result = await get_tasks_status(body.task_ids)
+    return BulkTaskStatusResponse(
+        status="ok" if result.get('status') == ErrorAndSuccessCodes.SUCCESS else "error",
+        data=result.get('tasks'),
+        internal_status_code=result.get('status'),
     )
 
 @router.get("/task", response_model = GetTaskDetailsResponse)
-async def get_video_details(task_id: str = Query(...), type : str  = Query(...)):
+async def get_video_details(request : Request, task_id: str = Query(...), type : str  = Query(...)):
     '''
-        Fetches Thumbnail for the task
+        Fetches Thumbnail (with the thumbnails and the sprite sheet) or Status for the task (task cache)
+        ETag / Cache-Control : see http_cache.py
     '''
     logger.info(f"Tasks Details requested, Task ID: {task_id}, Type : {type}")
     result = await get_task_details(task_id, type)
-    return GetTaskDetailsResponse(
+    terminal = result.pop('terminal', False)
+    return build_cached_response(request, GetTaskDetailsResponse(
         status = "ok",
-        detail = result
+        **result
+    ), terminal)
+
+@router.get("/task/{task_id}/outputs/{output_path:path}")
+async def get_task_output(request : Request, task_id : str = Path(...), output_path : str = Path(...), delivery : Optional[str] = Query(None)):
+    '''
+        Serves an output of the task from the private bucket : video, thumbnail, thumbnails/<file>, package/<file> (HLS / DASH)
+        delivery : redirect (presigned URL) or proxy (streamed, Range support), defaults to OUTPUT_DELIVERY
+        Relative URIs of a playlist loaded from here resolve to this endpoint, e.g. package/master.m3u8 -> package/720p/index.m3u8
+    '''
+    if delivery not in (None, *[d.value for d in OutputDelivery]):
+        return JSONResponse(status_code=400, content=VideoProcessingResponse(status="error", task_id=task_id, internal_status_code=ErrorAndSuccessCodes.INVALID_INPUT).model_dump(mode="json"))
+
+    result = await get_task_output_key(task_id, output_path)
+    if result.get('status') != ErrorAndSuccessCodes.SUCCESS:
+        status_code = {
+            ErrorAndSuccessCodes.INVALID_INPUT : 400,
+            ErrorAndSuccessCodes.PROCESSING_ERROR : 500,
+        }.get(result.get('status'), 404)
+        return JSONResponse(status_code=status_code, content=VideoProcessingResponse(status="error", task_id=task_id, internal_status_code=result.get('status')).model_dump(mode="json"))
+    return await build_output_response(request, result.get('s3_key'), OutputDelivery(delivery or settings.OUTPUT_DELIVERY))
+
+@router.get("/task/events")
+async def get_video_progress_events(request : Request, task_id : str = Query(...)):
+    '''
+        Streams the task progress as Server-Sent Events (stage + fractional progress), instead of polling type=progress
+        Closes once the task is processed or failed
+    '''
+    logger.info(f"Task Progress Events requested, Task ID: {task_id}")
+    return StreamingResponse(
+        stream_task_progress(task_id, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"   # nginx : do not buffer the stream
+        }
+    )
+
+@router.delete("/task", response_model=VideoProcessingResponse)
+async def delete_video_task(user_id : str = Query(...), task_id : str = Query(...)):
+    '''
+        Deletes a processed / failed task
+        Outputs shared with duplicate uploads are kept until the last task using them is deleted
+    '''
+    logger.info(f"Task Deletion requested, User ID: {user_id}, Task ID: {task_id}")
+    result = await delete_task(user_id, task_id)
+    return VideoProcessingResponse(
+        status="ok" if result == ErrorAndSuccessCodes.SUCCESS else "error",
+        task_id=task_id,
+        internal_status_code=result,
     )
 
 @router.get("/analytics/queue")
 async def get_queue_details():
     '''
-        Returns the local host command and port for running the flower dashboard
+        Returns the queue depths, tasks in processing, capacity of the worker nodes and the estimated wait of new uploads
+        (autoscaling signal : estimate.recommended_encode_slots)
     '''
-    return "Start Flower by running command in a different Terminal : celery -A app.core.worker.celery flower --port=5555\n and the got to http://localhost:5555/ \n\n"
+    result = await get_queue_analytics()
+    status = result.pop('status')
+    if status != ErrorAndSuccessCodes.SUCCESS:
+        return JSONResponse(status_code=500, content=VideoProcessingResponse(status="error", internal_status_code=status).model_dump(mode="json"))
+    return result
 
 @router.get("/analytics/system")
 async def get_system_analytics():
@@ -80,7 +320,7 @@ async def get_system_analytics():
 
     # CPU metrics
     return {
-        "cpu_percent" : psutil.cpu_percent(interval=1),
+        "cpu_percent" : psutil.cpu_percent(interval=None),   # Since the previous call (primed on startup), does not block
         "cpu_count" : psutil.cpu_count(),
         "cpu_times" : psutil.cpu_times(),
         "memory" : psutil.virtual_memory(),
@@ -88,4 +328,27 @@ async def get_system_analytics():
         "disk_usage" : psutil.disk_usage('/'),
         "disk_io_counters" : psutil.disk_io_counters(),
         "net_io_counters" : psutil.net_io_counters()
-    }
\ No newline at end of file
+    }
+
+@router.get("/analytics/s3")
+async def get_s3_analytics():
+    '''
+        Returns S3 Connection Pool Metrics for this process
+    '''
+    return s3.pool_metrics()
+
+@router.get("/analytics/cache")
+async def get_local_cache_analytics():
+    '''
+        Returns the hit / miss / eviction counters of the local S3 object cache, per worker node
+    '''
+    client = await redis_connection.get_client()
+    metrics = {}
+    async for key in client.scan_iter(match=LOCAL_CACHE_METRICS_KEY.format(host="*")):
+        counters = {field : int(value) for field, value in (await client.hgetall(key)).items()}
+        lookups = counters.get('hits', 0) + counters.get('misses', 0)
+        metrics[key.split(":", 1)[1]] = {
+            **counters,
+            'hit_ratio' : round(counters.get('hits', 0) / lookups, 4) if lookups else None
+        }
+    return metrics
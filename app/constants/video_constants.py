@@ -3,4 +3,71 @@ class VideoStatus(Enum):
     SAVED = "saved"
     PROCESSING = "processing"
     PROCESSED = "processed"
-    FAILED = "failed"
\ No newline at end of file
+    FAILED = "failed"
+
+class ProcessingMode(Enum):
+    REMUX = "remux"             # Stream copy, no re-encode
+    TRANSCODE = "transcode"     # Full re-encode via libx264
+    SEGMENTED_TRANSCODE = "segmented_transcode"     # Split -> parallel re-encode -> concat
+    ADAPTIVE_LADDER = "adaptive_ladder"     # Single decode -> multi rendition HLS (/DASH) ladder
+
+class ProcessingProfile(Enum):
+    MP4 = "mp4"             # Single MP4 rendition (default)
+    HLS = "hls"             # HLS ladder (MPEG-TS segments)
+    HLS_DASH = "hls_dash"   # HLS + DASH ladder (shared fMP4 segments)
+
+class ProcessingStage(Enum):
+    QUEUED = "queued"
+    DOWNLOADING = "downloading"
+    PROBING = "probing"
+    ENCODING = "encoding"
+    UPLOADING = "uploading"
+    PROCESSED = "processed"
+    FAILED = "failed"
+
+# Pipeline stages timed by the worker (pipeline_stage_duration_seconds)
+class TimedStage(Enum):
+    DOWNLOAD = "download"
+    PROBE = "probe"
+    ENCODE = "encode"
+    THUMBNAIL = "thumbnail"
+    UPLOAD = "upload"
+    DB_UPDATE = "db_update"
+
+class TaskQueue(Enum):
+    PROBE = "probe"             # Probe, entry point of the pipeline
+    REMUX = "remux"             # Stream copies (remux, split, concat), I/O bound
+    TRANSCODE = "transcode"     # Encodes (transcode, segments, ladder), CPU bound
+    THUMBNAIL = "thumbnail"
+    FINALIZE = "finalize"       # Database updates once the outputs are uploaded
+
+# Task priority by probed duration, (max duration in seconds, priority), Redis broker : 0 is the highest priority
+TASK_PRIORITY_BY_DURATION = [(60, 0), (300, 3), (1800, 6)]
+LOWEST_TASK_PRIORITY = 9
+
+class DispatchState(Enum):
+    PENDING = "pending"         # Written with the processing status, not published yet
+    DISPATCHED = "dispatched"   # Published to the broker by the task dispatcher
+
+class AdmissionDecision(Enum):
+    ADMITTED = "admitted"
+    DEFERRED = "deferred"   # Does not fit the node now, retried after ADMISSION_DEFER_SECONDS
+    REJECTED = "rejected"   # Can never fit the node, the task is failed
+
+class OutputDelivery(Enum):
+    REDIRECT = "redirect"   # 307 to a short-lived presigned GET URL, S3 serves the bytes (and the ranges)
+    PROXY = "proxy"         # Streamed through the API, Range requests forwarded to S3
+
+class ThumbnailSelection(Enum):
+    INTERVAL = "interval"   # Evenly spaced over the duration
+    SCENE = "scene"         # Keyframes starting a new scene
+
+class ProcessingCheckpoint(Enum):
+    PROBED = "probed"
+    DOWNLOADED = "downloaded"           # Local, valid on the host which downloaded the source
+    ENCODED = "encoded"                 # Local, valid on the host which encoded the output
+    VIDEO_UPLOADED = "video_uploaded"
+    THUMBNAIL_UPLOADED = "thumbnail_uploaded"
+    SPLIT = "split"
+    SEGMENTS = "segments"               # One entry per encoded segment
+    FINALIZED = "finalized"
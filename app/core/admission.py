@@ -0,0 +1,225 @@
+from app.core.config import settings
+from app.core.checkpoints import HOST, TASK_ID_PATTERN
+from app.dtos.collection_names import CollectionNames
+from app.utils.db_query import MongoQueryApplicator
+from app.utils.encoding_profiles import get_cpu_allocation
+from app.utils.logger import get_logger
+from app.utils.metrics import record_admission
+from app.utils.redis_connect import redis_connection, get_sync_redis_client
+from app.constants.video_constants import AdmissionDecision, ProcessingMode
+
+from bson import ObjectId
+from datetime import datetime
+from typing import List, Optional, Set, Tuple
+import json
+import os
+import shutil
+import threading
+import time
+import psutil
+import redis
+
+logger = get_logger(__name__)
+
+'''
+    Admission Control of the stages which need the resources of the node they run on (scratch disk, CPU, memory, encode time)
+        Requirement of a stage : scratch bytes   = probed source size * ADMISSION_SCRATCH_FACTOR (none when streamed)
+                                 encode seconds  = probed duration (none for stream copies)
+        The reservations of the stages running on a node are kept in Redis (NODE_RESERVATIONS_KEY, one entry per task),
+        checked and written by one Lua script, the pool processes of a node never over-commit it together
+        Admitted : fits next to the reservations of the node (scratch, encode seconds), the node is not overloaded (CPU, memory)
+        Deferred : does not fit now, the stage is retried after ADMISSION_DEFER_SECONDS
+        Rejected : larger than the whole scratch disk, the task is failed instead of running out of disk mid-encode
+    Every node reports its capacity (NODE_CAPACITY_KEY, expires when the node is gone), read by the queue analytics
+'''
+NODE_RESERVATIONS_KEY = "node_reservations:{host}"
+NODE_CAPACITY_KEY = "node_capacity:{host}"
+
+# Returns 0 when the reservation is written, 1 when the scratch disk is full, 2 when the node has too many encode seconds in flight
+RESERVE_SCRIPT = """
+local reserved_scratch = 0
+local reserved_encode = 0
+local entries = redis.call('HGETALL', KEYS[1])
+for i = 1, #entries, 2 do
+    if entries[i] ~= ARGV[1] then
+        local reservation = cjson.decode(entries[i + 1])
+        reserved_scratch = reserved_scratch + reservation.scratch_bytes
+        reserved_encode = reserved_encode + reservation.encode_seconds
+    end
+end
+if tonumber(ARGV[2]) > 0 and reserved_scratch + tonumber(ARGV[2]) > tonumber(ARGV[4]) then
+    return 1
+end
+local max_encode = tonumber(ARGV[5])
+if max_encode > 0 and reserved_encode > 0 and reserved_encode + tonumber(ARGV[3]) > max_encode then
+    return 2
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[6])
+return 0
+"""
+
+class AdmissionDeferred(Exception):
+    pass
+
+class AdmissionRejected(Exception):
+    pass
+
+'''
+    Resources a stage of the task needs on the node, from the probe (source_metadata, processing_mode)
+'''
+async def get_stage_requirement(task_id : str, encodes : bool, streamed : bool) -> dict:
+    mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+    video_record = await mongo.find_one({"_id" : ObjectId(task_id)}, {'source_metadata' : 1, 'processing_mode' : 1}) or {}
+    source_metadata = video_record.get('source_metadata') or {}
+    is_encode = encodes and video_record.get('processing_mode') != ProcessingMode.REMUX.value
+    return {
+        'scratch_bytes' : 0 if streamed else int((source_metadata.get('size') or 0) * settings.ADMISSION_SCRATCH_FACTOR),
+        'encode_seconds' : round(source_metadata.get('duration') or 0, 3) if is_encode else 0,
+    }
+
+def get_path_size(path : str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for directory, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                total += os.path.getsize(os.path.join(directory, file_name))
+            except OSError:
+                pass
+    return total
+
+'''
+    Bytes already written to the scratch directory by the given tasks, part of their reservation and of the used disk space alike
+'''
+def get_scratch_written(task_ids : Set[str]) -> int:
+    total = 0
+    for name in os.listdir(settings.SCRATCH_DIR):
+        match = TASK_ID_PATTERN.match(name)
+        if match and match.group(0) in task_ids:
+            try:
+                total += get_path_size(os.path.join(settings.SCRATCH_DIR, name))
+            except OSError:
+                pass
+    return total
+
+def get_cpu_load() -> float:
+    return os.getloadavg()[0] / get_cpu_allocation()
+
+'''
+    Admits a stage of the task on this node and reserves its requirement
+    Returns (decision, reason), an admitted stage has to be released once it ends
+'''
+def admit_stage(task_id : str, requirement : dict) -> Tuple[AdmissionDecision, Optional[str]]:
+    decision, reason = check_node_capacity(task_id, requirement)
+    record_admission(decision.value, reason or "capacity")
+    if decision != AdmissionDecision.ADMITTED:
+        logger.info(f"Stage {decision.value.title()} : {task_id}, {reason}, Requirement : {requirement}")
+    return decision, reason
+
+def check_node_capacity(task_id : str, requirement : dict) -> Tuple[AdmissionDecision, Optional[str]]:
+    os.makedirs(settings.SCRATCH_DIR, exist_ok=True)
+    disk = shutil.disk_usage(settings.SCRATCH_DIR)
+    if requirement.get('scratch_bytes') > disk.total - settings.ADMISSION_MIN_FREE_BYTES:
+        return AdmissionDecision.REJECTED, "scratch_disk"
+    if settings.ADMISSION_MAX_CPU_LOAD > 0 and get_cpu_load() > settings.ADMISSION_MAX_CPU_LOAD:
+        return AdmissionDecision.DEFERRED, "cpu_load"
+    if psutil.virtual_memory().available < settings.ADMISSION_MIN_FREE_MEMORY:
+        return AdmissionDecision.DEFERRED, "memory"
+
+    key = NODE_RESERVATIONS_KEY.format(host=HOST)
+    try:
+        client = get_sync_redis_client()
+        reserved_task_ids = set(client.hkeys(key)) | {task_id}
+        # Written bytes of admitted stages are counted once, in their reservation (a retry reuses its own scratch)
+        available = disk.free + get_scratch_written(reserved_task_ids) - settings.ADMISSION_MIN_FREE_BYTES
+        reservation = {**requirement, 'pid' : os.getpid(), 'reserved_at' : time.time()}
+        result = int(client.eval(
+            RESERVE_SCRIPT,
+            1,
+            key,
+            task_id,
+            requirement.get('scratch_bytes'),
+            requirement.get('encode_seconds'),
+            available,
+            settings.ADMISSION_MAX_ENCODE_SECONDS,
+            json.dumps(reservation),
+        ))
+    except redis.RedisError as e:
+        # Without the reservations the node cannot be checked, the stage runs as it did without admission control
+        logger.error(f"Admission Check Failed : {task_id}, {e}")
+        return AdmissionDecision.ADMITTED, "unavailable"
+    if result == 1:
+        return AdmissionDecision.DEFERRED, "scratch_disk"
+    if result == 2:
+        return AdmissionDecision.DEFERRED, "encode_seconds"
+    return AdmissionDecision.ADMITTED, None
+
+def release_stage(task_id : str):
+    try:
+        get_sync_redis_client().hdel(NODE_RESERVATIONS_KEY.format(host=HOST), task_id)
+    except redis.RedisError as e:
+        # Dropped by the capacity reporter once the process is gone
+        logger.error(f"Admission Release Failed : {task_id}, {e}")
+
+'''
+    Drops the reservations of processes which are gone (killed pool process, restarted worker) or older than
+    PROCESSING_STUCK_DEADLINE, returns the remaining ones
+'''
+def prune_reservations(client : redis.Redis) -> List[dict]:
+    key = NODE_RESERVATIONS_KEY.format(host=HOST)
+    reservations = []
+    for task_id, value in client.hgetall(key).items():
+        reservation = json.loads(value)
+        if not psutil.pid_exists(reservation.get('pid')) or time.time() - reservation.get('reserved_at') > settings.PROCESSING_STUCK_DEADLINE:
+            client.hdel(key, task_id)
+            logger.info(f"Stale Reservation Dropped : {task_id}")
+            continue
+        reservations.append(reservation)
+    return reservations
+
+def report_node_capacity(queues : List[str], encode_slots : int):
+    client = get_sync_redis_client()
+    reservations = prune_reservations(client)
+    os.makedirs(settings.SCRATCH_DIR, exist_ok=True)
+    disk = shutil.disk_usage(settings.SCRATCH_DIR)
+    capacity = {
+        'host' : HOST,
+        'queues' : queues,
+        'encode_slots' : encode_slots,
+        'scratch_total_bytes' : disk.total,
+        'scratch_free_bytes' : disk.free,
+        'scratch_reserved_bytes' : sum(reservation.get('scratch_bytes') for reservation in reservations),
+        'cpu_count' : get_cpu_allocation(),
+        'cpu_load' : round(get_cpu_load(), 3),
+        'memory_available_bytes' : psutil.virtual_memory().available,
+        'in_flight_tasks' : len(reservations),
+        'in_flight_encode_seconds' : round(sum(reservation.get('encode_seconds') for reservation in reservations), 3),
+        'reported_at' : datetime.now().isoformat(),
+    }
+    client.set(NODE_CAPACITY_KEY.format(host=HOST), json.dumps(capacity), ex=settings.WORKER_CAPACITY_REPORT_INTERVAL * 3)
+
+'''
+    Background thread of the Celery main process, reports the node capacity every WORKER_CAPACITY_REPORT_INTERVAL
+'''
+def start_capacity_reporter(queues : List[str], encode_slots : int):
+    def report():
+        while True:
+            try:
+                report_node_capacity(queues, encode_slots)
+            except Exception as e:
+                logger.error(f"Capacity Report Failed : {e}")
+            time.sleep(settings.WORKER_CAPACITY_REPORT_INTERVAL)
+
+    threading.Thread(target=report, name="capacity-reporter", daemon=True).start()
+    logger.info(f"Capacity Reporter Started : {HOST}, Queues : {queues}")
+
+'''
+    Latest capacity report of every live node (API side)
+'''
+async def get_node_capacities() -> List[dict]:
+    client = await redis_connection.get_client()
+    keys = [key async for key in client.scan_iter(match=NODE_CAPACITY_KEY.format(host="*"))]
+    if not keys:
+        return []
+    return [json.loads(value) for value in await client.mget(keys) if value is not None]
@@ -1,87 +1,476 @@
 from app.dtos.collection_names import CollectionNames
 from app.utils.db_query import MongoQueryApplicator
-from app.constants.video_constants import VideoStatus
-from app.utils.s3_utils import download_file, upload_file_to_s3_from_path
+from app.constants.video_constants import VideoStatus, ProcessingMode, ProcessingProfile, ProcessingStage, ProcessingCheckpoint, TimedStage
+from app.utils.s3_utils import download_file, upload_file_to_s3_from_path, delete_files_from_s3, upload_stream_to_s3, generate_presigned_get_url, upload_directory_to_s3
 from app.utils.logger import get_logger
-from app.utils.file_processing_utils import convert_to_mp4, extract_thumbnail
+from app.utils.encoding_profiles import select_encoder_settings, build_encoder_args
+from app.utils.file_processing_utils import transcode_video, remux_video, extract_thumbnails, collect_thumbnails, probe_video, summarize_probe, check_web_compatibility, split_into_segments, transcode_segment, concat_segments, build_transcode_command, build_remux_command, stream_ffmpeg_output, FRAGMENTED_MP4_ARGS, select_ladder_rungs, encode_adaptive_ladder
+from app.core.config import settings
+from app.core.content_cache import register_processed_outputs
+from app.core.checkpoints import get_checkpoints, save_checkpoint, with_heartbeat, get_local_artifact, get_scratch_path, remove_scratch_path, remove_task_scratch
+from app.utils.metrics import track_stage
+from app.utils.progress_publisher import publish_progress, publish_segment_encoded, encoding_progress_callback
+from app.utils.task_cache import invalidate_cached_task
 
 from datetime import datetime
 from bson import ObjectId
+from typing import List, Optional, Awaitable, Union
+import asyncio
 import os
 import shutil
 
 logger = get_logger("celery_core")
 
-async def process_video_inside_task_queue(task_id : str):
-    '''
-        1. Fetch Record from DB
-        2. Download video from S3
-        3. Process Video via ffmpeg
-        4. Upload this video and thumbnail to S3
-        5. Store the S3 URLs of the processed video and thumbnail in the database
-        6. Update the task status in the database
-    '''
-    local_path = None
-    try:
-        logger.info(f"Starting Processing Video Task : {task_id}")
-
-        # Fetch Record From DB
-        mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
-        video_record = await mongo.find_one({"_id" : ObjectId(task_id)})
-        logger.info(f"Video Record : {video_record}")
-        if not video_record or not video_record.get("s3_url"):
-            logger.error(f"Video Record Not Found in DB : {task_id}")
-            return
-        
-        # Download File
-        file_name = video_record.get("s3_url").split("/")[-1]
-        local_path = f"{os.getcwd()}/{task_id}"
-        output_file_name = f"output_{task_id}.mp4"
-        thumbnail_file_name = f"thumbnail_{task_id}.jpeg"
-
-        output_path = local_path + f"/{output_file_name}"
-        thumbnail_output_path = local_path + f"/{thumbnail_file_name}"
-        original_file_destination = local_path + f"/{file_name}"
-
-        os.makedirs(local_path, exist_ok=True)
-        logger.info(f"S3 URL : {video_record.get('s3_url')}") 
-        download_file(video_record.get("s3_url"), original_file_destination)
-
-        # Process Video
-        convert_to_mp4(original_file_destination, output_path)
-        converted_file_s3_url = ""
-        if os.path.isfile(output_path):
-            converted_file_s3_url = await upload_file_to_s3_from_path(output_path, output_file_name, "video/mp4")
-            logger.info(f"File Conversion Success : S3 URL : {converted_file_s3_url}")
-
-        # Gets Thumbnails
-        extract_thumbnail(output_path, thumbnail_output_path)
-        thumbnail_s3_url = ""
-        if os.path.isfile(thumbnail_output_path):
-            thumbnail_s3_url = await upload_file_to_s3_from_path(thumbnail_output_path, thumbnail_file_name, "image/jpeg")
-            logger.info(f"Thumbnail Generation Success : S3 URL : {thumbnail_s3_url}")
-
-        logger.info(f"Extracted URls : {thumbnail_s3_url}, {converted_file_s3_url}")
+'''
+    Video Processing Pipeline, one Celery task per stage (see worker.py for the queues and the canvas)
+        probe -> (transcode | remux | ladder) + thumbnail -> finalize
+        probe -> split -> encode segments -> concat -> finalize      (long videos)
+    Stages run on different workers, so every stage reads its input from S3 and uploads what it produced
+    Failed stages are retried by Celery (with backoff) and resume from their last checkpoint (see checkpoints.py)
+'''
+async def probe_video_inside_task_queue(task_id : str) -> Optional[dict]:
+    '''
+        1. Fetch Record from DB, skip messages of a task which is not processing anymore
+           (at least once delivery of the outbox, see task_dispatcher.py)
+        2. Probe Video via ffprobe, straight from S3 through a presigned URL (only the container headers are read)
+        3. Select the encoder settings from the task's encoding profile (content-aware profiles adjust CRF / preset to the probe)
+           Decide between stream copy (remux) and re-encode (transcode), sources are only remuxed for H.264 encoding profiles
+           HLS / DASH profiles are encoded as an adaptive bitrate ladder, long videos are transcoded in segments
+        4. Store the source metadata and the processing mode in the database (checkpoint : probed)
+        5. Return the plan, the worker builds the remaining stages from it
+    '''
+    logger.info(f"Starting Processing Video Task : {task_id}")
+
+    # Fetch Record From DB
+    mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+    video_record = await mongo.find_one({"_id" : ObjectId(task_id)})
+    logger.info(f"Video Record : {video_record}")
+    if not video_record or not video_record.get("s3_url"):
+        logger.error(f"Video Record Not Found in DB : {task_id}")
+        return None
+    if video_record.get('status') != VideoStatus.PROCESSING.value:
+        logger.info(f"Task Not Processing, Message Skipped : {task_id}, {video_record.get('status')}")
+        return None
+
+    probed = (video_record.get('checkpoints') or {}).get(ProcessingCheckpoint.PROBED.value)
+    if probed:
+        logger.info(f"Resuming From Checkpoint : {task_id}, Probed")
+        return probed.get('plan')
+
+    # Probe Video, sources which are already H.264/AAC MP4 are only remuxed
+    await asyncio.to_thread(publish_progress, task_id, ProcessingStage.PROBING)
+    with track_stage(TimedStage.PROBE):
+        probe = await probe_video(generate_presigned_get_url(video_record.get("s3_url")))
+    source_metadata = summarize_probe(probe) if probe else None
+    profile = ProcessingProfile(video_record.get('profile') or ProcessingProfile.MP4.value)
+    encoder_settings = select_encoder_settings(video_record.get('encoding_profile') or settings.DEFAULT_ENCODING_PROFILE, source_metadata)
+    is_web_compatible, processing_reason = check_web_compatibility(probe)
+    processing_mode = ProcessingMode.REMUX if is_web_compatible else ProcessingMode.TRANSCODE
+    if processing_mode == ProcessingMode.REMUX and encoder_settings.get('video_codec') != 'libx264':
+        processing_mode = ProcessingMode.TRANSCODE
+        processing_reason = f"encoding profile {encoder_settings.get('encoding_profile')} encodes to {encoder_settings.get('video_codec')}"
+    if profile != ProcessingProfile.MP4:
+        processing_mode = ProcessingMode.ADAPTIVE_LADDER
+        processing_reason = f"profile {profile.value} requested"
+    elif processing_mode == ProcessingMode.TRANSCODE and source_metadata and source_metadata.get('duration') >= settings.SEGMENTED_TRANSCODE_MIN_DURATION:
+        processing_mode = ProcessingMode.SEGMENTED_TRANSCODE
+        processing_reason = f"{processing_reason}, duration {source_metadata.get('duration')}s >= {settings.SEGMENTED_TRANSCODE_MIN_DURATION}s"
+    logger.info(f"Processing Mode : {processing_mode.value}, Reason : {processing_reason}")
+    await mongo.update_one(
+        {"_id" :ObjectId(task_id)},
+        {
+            'source_metadata' : source_metadata,
+            'encoder_settings' : encoder_settings,
+            'processing_mode' : processing_mode.value,
+            'processing_reason' : processing_reason,
+            'updated_at' : datetime.now()
+        }
+    )
+    plan = {
+        'processing_mode' : processing_mode.value,
+        'duration' : (source_metadata or {}).get('duration')
+    }
+    await save_checkpoint(task_id, ProcessingCheckpoint.PROBED, plan=plan)
+    return plan
+
+'''
+    Downloads the source into the stage's scratch directory, unless a previous attempt on this host already did
+'''
+async def download_source(task_id : str, s3_url : str, checkpoints : dict, local_path : str) -> str:
+    source_path = get_local_artifact(checkpoints, ProcessingCheckpoint.DOWNLOADED)
+    if source_path:
+        return source_path
+
+    source_path = local_path + f"/{s3_url.split('/')[-1]}"
+    await asyncio.to_thread(publish_progress, task_id, ProcessingStage.DOWNLOADING)
+    await download_file(s3_url, source_path)
+    if not os.path.isfile(source_path):
+        raise Exception(f"Source Download Failed : {s3_url}")
+    await save_checkpoint(task_id, ProcessingCheckpoint.DOWNLOADED, path=source_path)
+    return source_path
+
+async def transcode_video_inside_task_queue(task_id : str, processing_mode : str) -> dict:
+    '''
+        1. Download video from S3 (checkpoint : downloaded)
+           In streaming mode (STREAMING_PROCESSING) the source is read by ffmpeg via a presigned URL (HTTP range requests)
+           and the output is written as fragmented MP4 to a pipe, consumed by an S3 multipart upload
+        2. Remux (stream copy) or transcode the video (checkpoint : encoded)
+        3. Upload the output to S3, return its URL (checkpoint : video_uploaded)
+        Steps with a checkpoint are skipped on a retry, the scratch directory is kept until the stage succeeds
+    '''
+    mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+    video_record = await mongo.find_one({"_id" : ObjectId(task_id)}, {'s3_url' : 1, 'source_metadata' : 1, 'encoder_settings' : 1, 'checkpoints' : 1})
+    checkpoints = video_record.get('checkpoints') or {}
+    uploaded = checkpoints.get(ProcessingCheckpoint.VIDEO_UPLOADED.value)
+    if uploaded:
+        logger.info(f"Resuming From Checkpoint : {task_id}, Video Uploaded")
+        return {'output_video' : uploaded.get('output_video')}
+
+    local_path = get_scratch_path(task_id)
+    output_file_name = f"output_{task_id}.mp4"
+    is_remux = ProcessingMode(processing_mode) == ProcessingMode.REMUX
+    encoder_args = build_encoder_args(video_record.get('encoder_settings')) if video_record.get('encoder_settings') else None
+    on_progress = with_heartbeat(task_id, encoding_progress_callback(task_id, (video_record.get('source_metadata') or {}).get('duration')))
+    os.makedirs(local_path, exist_ok=True)
+
+    converted_file_s3_url = ""
+    if settings.STREAMING_PROCESSING:
+        await asyncio.to_thread(publish_progress, task_id, ProcessingStage.ENCODING, 0)
+        source_url = generate_presigned_get_url(video_record.get("s3_url"))
+        if is_remux:
+            command = build_remux_command(source_url, "pipe:1", container_args=FRAGMENTED_MP4_ARGS)
+        else:
+            command = build_transcode_command(source_url, "pipe:1", container_args=FRAGMENTED_MP4_ARGS, encoder_args=encoder_args)
+        file_chunks = stream_ffmpeg_output(command, on_progress=on_progress, is_encode=not is_remux)
+        converted_file_s3_url = await upload_stream_to_s3(file_chunks, f"videos/{output_file_name}", "video/mp4")
+        logger.info(f"File Streaming Conversion Success : S3 URL : {converted_file_s3_url}")
+    else:
+        output_path = get_local_artifact(checkpoints, ProcessingCheckpoint.ENCODED)
+        if not output_path:
+            source_path = await download_source(task_id, video_record.get("s3_url"), checkpoints, local_path)
+            output_path = local_path + f"/{output_file_name}"
+            await asyncio.to_thread(publish_progress, task_id, ProcessingStage.ENCODING, 0)
+            if is_remux:
+                converted = await remux_video(source_path, output_path, on_progress=on_progress)
+            else:
+                converted = await transcode_video(source_path, output_path, on_progress=on_progress, encoder_args=encoder_args)
+            if not converted:
+                raise Exception(f"Video Conversion Failed : {task_id}")
+            await save_checkpoint(task_id, ProcessingCheckpoint.ENCODED, path=output_path)
+
+        await asyncio.to_thread(publish_progress, task_id, ProcessingStage.UPLOADING)
+        converted_file_s3_url = await upload_file_to_s3_from_path(output_path, output_file_name, "video/mp4")
+        logger.info(f"File Conversion Success : S3 URL : {converted_file_s3_url}")
+
+    if not converted_file_s3_url:
+        raise Exception(f"Video Upload Failed : {task_id}")
+    await save_checkpoint(task_id, ProcessingCheckpoint.VIDEO_UPLOADED, output_video=converted_file_s3_url)
+    remove_scratch_path(local_path)
+    return {'output_video' : converted_file_s3_url}
+
+THUMBNAIL_OUTPUT_FIELDS = ['thumbnail', 'thumbnails', 'sprite_sheet']
+
+async def extract_thumbnail_inside_task_queue(task_id : str) -> dict:
+    '''
+        1. Extract the primary Thumbnail, THUMBNAIL_COUNT Thumbnails and the Sprite Sheet in one keyframe only pass,
+           read from S3 through a presigned URL
+        2. Upload them to S3 under thumbnails/<task_id>/, return their URLs (checkpoint : thumbnail_uploaded)
+        A missing thumbnail does not fail the task
+    '''
+    mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+    video_record = await mongo.find_one({"_id" : ObjectId(task_id)}, {'s3_url' : 1, 'source_metadata' : 1, 'checkpoints' : 1})
+    uploaded = (video_record.get('checkpoints') or {}).get(ProcessingCheckpoint.THUMBNAIL_UPLOADED.value)
+    if uploaded:
+        return {field : uploaded.get(field) for field in THUMBNAIL_OUTPUT_FIELDS}
+
+    local_path = get_scratch_path(task_id, "thumbnail")
+    shutil.rmtree(local_path, ignore_errors=True)     # Leftovers of a failed attempt
+    os.makedirs(local_path, exist_ok=True)
+
+    with track_stage(TimedStage.THUMBNAIL):
+        thumbnails = await extract_thumbnails(generate_presigned_get_url(video_record.get("s3_url")), local_path, video_record.get('source_metadata') or {})
+    thumbnail_outputs = await upload_thumbnails(task_id, local_path, thumbnails)
+    await save_checkpoint(task_id, ProcessingCheckpoint.THUMBNAIL_UPLOADED, **thumbnail_outputs)
+    remove_scratch_path(local_path)
+    return thumbnail_outputs
+
+'''
+    Uploads the files of the keyframe pass, local paths are replaced by their S3 URLs
+    Raises when the upload fails (worth a retry), nothing extracted is not an error
+'''
+async def upload_thumbnails(task_id : str, thumbnails_dir : str, thumbnails : dict) -> dict:
+    if not os.listdir(thumbnails_dir):
+        logger.error(f"No Thumbnails Extracted : {task_id}")
+        return {'thumbnail' : "", 'thumbnails' : [], 'sprite_sheet' : None}
+
+    thumbnails_s3_url = await upload_directory_to_s3(thumbnails_dir, f"thumbnails/{task_id}")
+    def get_s3_url(path : Optional[str]) -> str:
+        return f"{thumbnails_s3_url}/{os.path.basename(path)}" if path else ""
+
+    sprite_sheet = thumbnails.get('sprite_sheet')
+    thumbnail_outputs = {
+        'thumbnail' : get_s3_url(thumbnails.get('thumbnail')),
+        'thumbnails' : [get_s3_url(path) for path in thumbnails.get('thumbnails')],
+        'sprite_sheet' : {**sprite_sheet, 'image' : get_s3_url(sprite_sheet.get('image')), 'vtt' : get_s3_url(sprite_sheet.get('vtt'))} if sprite_sheet else None,
+    }
+    logger.info(f"Thumbnail Generation Success : S3 URL : {thumbnail_outputs.get('thumbnail')}, Thumbnails : {len(thumbnail_outputs.get('thumbnails'))}")
+    return thumbnail_outputs
+
+'''
+    Adaptive Bitrate Ladder (HLS / DASH profiles)
+'''
+async def encode_ladder_inside_task_queue(task_id : str) -> dict:
+    '''
+        1. Download video from S3, streaming mode : read via a presigned URL (checkpoint : downloaded)
+        2. Encode every rung of the ladder from a single decode (checkpoint : encoded)
+        3. Upload the package (playlists / manifests + segments) to S3, return the manifest URLs (checkpoint : video_uploaded)
+    '''
+    mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+    video_record = await mongo.find_one({"_id" : ObjectId(task_id)}, {'s3_url' : 1, 'source_metadata' : 1, 'profile' : 1, 'checkpoints' : 1})
+    checkpoints = video_record.get('checkpoints') or {}
+    uploaded = checkpoints.get(ProcessingCheckpoint.VIDEO_UPLOADED.value)
+    if uploaded:
+        logger.info(f"Resuming From Checkpoint : {task_id}, Ladder Uploaded")
+        return {field : uploaded.get(field) for field in ['hls_manifest', 'dash_manifest', 'renditions']}
+
+    source_metadata = video_record.get('source_metadata') or {}
+    profile = ProcessingProfile(video_record.get('profile'))
+    local_path = get_scratch_path(task_id)
+    rungs = select_ladder_rungs(source_metadata.get('height'))
+    with_dash = profile == ProcessingProfile.HLS_DASH
+    os.makedirs(local_path, exist_ok=True)
+
+    ladder_dir = get_local_artifact(checkpoints, ProcessingCheckpoint.ENCODED)
+    if not ladder_dir:
+        if settings.STREAMING_PROCESSING:
+            input_path = generate_presigned_get_url(video_record.get("s3_url"))
+        else:
+            input_path = await download_source(task_id, video_record.get("s3_url"), checkpoints, local_path)
+
+        ladder_dir = local_path + "/ladder"
+        shutil.rmtree(ladder_dir, ignore_errors=True)   # Leftovers of a failed attempt
+        os.makedirs(ladder_dir, exist_ok=True)
+        logger.info(f"Encoding Ladder : {task_id}, Rungs : {[rung['name'] for rung in rungs]}, DASH : {with_dash}")
+        await asyncio.to_thread(publish_progress, task_id, ProcessingStage.ENCODING, 0)
+        if not await encode_adaptive_ladder(input_path, ladder_dir, rungs, bool(source_metadata.get('audio_codec')), with_dash, on_progress=with_heartbeat(task_id, encoding_progress_callback(task_id, source_metadata.get('duration')))):
+            raise Exception(f"Ladder Encode Failed : {task_id}")
+        await save_checkpoint(task_id, ProcessingCheckpoint.ENCODED, path=ladder_dir)
+
+    await asyncio.to_thread(publish_progress, task_id, ProcessingStage.UPLOADING)
+    package_s3_url = await upload_directory_to_s3(ladder_dir, f"videos/{task_id}/{profile.value}")
+    outputs = {
+        'hls_manifest' : f"{package_s3_url}/master.m3u8",
+        'dash_manifest' : f"{package_s3_url}/manifest.mpd" if with_dash else None,
+        'renditions' : [rung['name'] for rung in rungs]
+    }
+    await save_checkpoint(task_id, ProcessingCheckpoint.VIDEO_UPLOADED, **outputs)
+    remove_scratch_path(local_path)
+    return outputs
+
+'''
+    Last stage, receives the outputs of the previous stages (a list for chord callbacks)
+'''
+async def finalize_video_inside_task_queue(task_id : str, stage_outputs : Union[dict, List[dict]]) -> str:
+    '''
+        1. Store the S3 URLs of the outputs in the database, update the task status
+        2. Register the outputs in the content cache (checkpoint : finalized, registration is idempotent per task)
+    '''
+    outputs = {}
+    for stage_output in (stage_outputs if isinstance(stage_outputs, list) else [stage_outputs]):
+        outputs.update(stage_output or {})
+    logger.info(f"Extracted URls : {outputs}")
+
+    if (await get_checkpoints(task_id)).get(ProcessingCheckpoint.FINALIZED.value):
+        return "Complete"
+
+    mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+    with track_stage(TimedStage.DB_UPDATE):
+        # A retry after the content cache pointed the task at the outputs of an identical upload keeps them (its own are deleted)
         await mongo.update_one(
-            {"_id" :ObjectId(task_id)},
+            {"_id" :ObjectId(task_id), "deduplicated_from" : {"$exists" : False}},
             {
                 'status' : VideoStatus.PROCESSED.value,
                 'updated_at' : datetime.now(),
-                'output_video' : converted_file_s3_url,
-                'thumbnail' : thumbnail_s3_url
-            }
-        )
-        return "Complete"
-    except Exception as e:
-        logger.error(f"Error While Processing Video File : {e}")
-        await mongo.update_one(
-            {"_id" :ObjectId(task_id)},
-            {
-                'status' : VideoStatus.FAILED.value,
-                'updated_at' : datetime.now()
+                **outputs
             }
         )
-    finally:
-        if local_path and os.path.isdir(local_path):
-            shutil.rmtree(local_path)
-            logger.info(f"Successfully Deleted The Locally Created Files : {local_path}")
\ No newline at end of file
+        await register_processed_outputs(task_id)
+    await asyncio.to_thread(invalidate_cached_task, task_id)
+    await save_checkpoint(task_id, ProcessingCheckpoint.FINALIZED)
+    await asyncio.to_thread(publish_progress, task_id, ProcessingStage.PROCESSED, 1)
+    return "Complete"
+
+'''
+    Awaits an optional upload, "" when there is nothing to upload (keeps asyncio.gather results positional)
+'''
+async def upload_if_present(upload : Optional[Awaitable[str]]) -> str:
+    return await upload if upload else ""
+
+async def mark_video_task_failed(task_id : str):
+    remove_task_scratch(task_id)
+    mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+    await mongo.update_one(
+        {"_id" :ObjectId(task_id)},
+        {
+            'status' : VideoStatus.FAILED.value,
+            'updated_at' : datetime.now()
+        }
+    )
+    await asyncio.to_thread(invalidate_cached_task, task_id)
+    await asyncio.to_thread(publish_progress, task_id, ProcessingStage.FAILED)
+
+'''
+    Segmented Transcoding (Long Videos)
+    split (this task) -> encode segments (one Celery subtask per segment) -> concat (chord callback) -> finalize
+    Intermediate files are shared between workers via S3 under intermediate/<task_id>/
+'''
+async def split_video_inside_task_queue(task_id : str) -> dict:
+    '''
+        1. Download video from S3, streaming mode : read via a presigned URL (checkpoint : downloaded)
+        2. Split the source at keyframes into segments, extract the audio track, thumbnails and sprite sheet (single ffmpeg run)
+        3. Upload the segments and audio to S3 (intermediate), thumbnails to S3 (checkpoint : split)
+        4. Return the segment URLs, the worker fans these out as a chord
+    '''
+    mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+    video_record = await mongo.find_one({"_id" : ObjectId(task_id)}, {'s3_url' : 1, 'source_metadata' : 1, 'checkpoints' : 1})
+    checkpoints = video_record.get('checkpoints') or {}
+    split = checkpoints.get(ProcessingCheckpoint.SPLIT.value)
+    if split:
+        logger.info(f"Resuming From Checkpoint : {task_id}, Split")
+        return {'segments' : split.get('segments'), 'audio' : split.get('audio')}
+
+    has_audio = bool((video_record.get('source_metadata') or {}).get('audio_codec'))
+    local_path = get_scratch_path(task_id)
+    segments_dir = local_path + "/segments"
+    audio_path = local_path + f"/audio_{task_id}.m4a"
+    thumbnails_dir = local_path + "/thumbnails"
+    intermediate_prefix = f"intermediate/{task_id}"
+
+    # Leftovers of a failed attempt
+    shutil.rmtree(segments_dir, ignore_errors=True)
+    shutil.rmtree(thumbnails_dir, ignore_errors=True)
+    os.makedirs(segments_dir, exist_ok=True)
+    os.makedirs(thumbnails_dir, exist_ok=True)
+    if settings.STREAMING_PROCESSING:
+        input_path = generate_presigned_get_url(video_record.get("s3_url"))
+    else:
+        input_path = await download_source(task_id, video_record.get("s3_url"), checkpoints, local_path)
+
+    source_metadata = video_record.get('source_metadata') or {}
+    segment_paths = await split_into_segments(input_path, segments_dir, audio_path, thumbnails_dir, source_metadata, settings.SEGMENT_DURATION, has_audio)
+    if not segment_paths:
+        raise Exception(f"Video Split Failed : {task_id}")
+    thumbnails = await collect_thumbnails(input_path, thumbnails_dir, source_metadata)
+    await asyncio.to_thread(publish_progress, task_id, ProcessingStage.ENCODING, 0, segments_total=len(segment_paths), segments_done=0)
+    logger.info(f"Video Split into {len(segment_paths)} Segments : {task_id}")
+
+    # Segments, Audio and Thumbnails are uploaded concurrently (bounded by the worker's I/O threads)
+    segment_uploads = [
+        upload_file_to_s3_from_path(segment_path, os.path.basename(segment_path), "video/x-matroska", intermediate_prefix)
+        for segment_path in segment_paths
+    ]
+    audio_upload = upload_file_to_s3_from_path(audio_path, os.path.basename(audio_path), "audio/mp4", intermediate_prefix) if has_audio and os.path.isfile(audio_path) else None
+    *segment_s3_urls, audio_s3_url, thumbnail_outputs = await asyncio.gather(*segment_uploads, upload_if_present(audio_upload), upload_thumbnails(task_id, thumbnails_dir, thumbnails))
+
+    for segment_path, segment_s3_url in zip(segment_paths, segment_s3_urls):
+        if not segment_s3_url:
+            raise Exception(f"Segment Upload Failed : {segment_path}")
+    if has_audio and not audio_s3_url:
+        raise Exception(f"Audio Upload Failed : {audio_path}")
+    audio_s3_url = audio_s3_url or None
+
+    await mongo.update_one(
+        {"_id" :ObjectId(task_id)},
+        {
+            **thumbnail_outputs,
+            'segments_count' : len(segment_s3_urls),
+            'updated_at' : datetime.now()
+        }
+    )
+    await asyncio.to_thread(invalidate_cached_task, task_id)
+    await save_checkpoint(task_id, ProcessingCheckpoint.SPLIT, segments=segment_s3_urls, audio=audio_s3_url)
+    remove_scratch_path(local_path)
+    return {
+        'segments' : segment_s3_urls,
+        'audio' : audio_s3_url
+    }
+
+async def transcode_segment_inside_task_queue(task_id : str, segment_s3_url : str) -> str:
+    '''
+        1. Download the segment from S3
+        2. Encode the segment
+        3. Upload the encoded segment to S3, return its URL (checkpoint : segments.<segment>)
+    '''
+    segment_file_name = segment_s3_url.split("/")[-1]
+    segment_name = segment_file_name.split('.')[0]
+    mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+    video_record = await mongo.find_one({"_id" : ObjectId(task_id)}, {'encoder_settings' : 1, 'checkpoints' : 1}) or {}
+    encoded = ((video_record.get('checkpoints') or {}).get(ProcessingCheckpoint.SEGMENTS.value) or {}).get(segment_name)
+    if encoded:
+        return encoded.get('encoded_s3_url')
+
+    local_path = get_scratch_path(task_id, segment_name)
+    segment_path = local_path + f"/{segment_file_name}"
+    encoded_file_name = f"encoded_{segment_name}.mp4"
+    encoded_path = local_path + f"/{encoded_file_name}"
+
+    os.makedirs(local_path, exist_ok=True)
+    if not os.path.isfile(segment_path):
+        await download_file(segment_s3_url, segment_path)
+    if not os.path.isfile(encoded_path):
+        # Encoded under a temporary name, a file at encoded_path is always complete and can be reused by a retry
+        partial_path = local_path + f"/partial_{encoded_file_name}"
+        encoder_args = build_encoder_args(video_record.get('encoder_settings')) if video_record.get('encoder_settings') else None
+        if not await transcode_segment(segment_path, partial_path, encoder_args):
+            raise Exception(f"Segment Encode Failed : {segment_s3_url}")
+        os.replace(partial_path, encoded_path)
+    encoded_s3_url = await upload_file_to_s3_from_path(encoded_path, encoded_file_name, "video/mp4", f"intermediate/{task_id}")
+    if not encoded_s3_url:
+        raise Exception(f"Segment Upload Failed : {segment_s3_url}")
+    await save_checkpoint(task_id, ProcessingCheckpoint.SEGMENTS, segment_name, encoded_s3_url=encoded_s3_url)
+    await asyncio.to_thread(publish_segment_encoded, task_id)
+    remove_scratch_path(local_path)
+    return encoded_s3_url
+
+async def concat_segments_inside_task_queue(task_id : str, encoded_segment_s3_urls : List[str], segment_s3_urls : List[str], audio_s3_url : Optional[str]) -> dict:
+    '''
+        1. Download the encoded segments and audio (kept in the scratch directory for a retry on this host)
+        2. Concat (stream copy) and mux the audio back in
+        3. Upload the output to S3, return its URL (checkpoint : video_uploaded)
+        4. Delete the intermediate files from S3
+    '''
+    uploaded = (await get_checkpoints(task_id)).get(ProcessingCheckpoint.VIDEO_UPLOADED.value)
+    if uploaded:
+        logger.info(f"Resuming From Checkpoint : {task_id}, Video Uploaded")
+        return {'output_video' : uploaded.get('output_video')}
+
+    local_path = get_scratch_path(task_id, "concat")
+    output_file_name = f"output_{task_id}.mp4"
+    output_path = local_path + f"/{output_file_name}"
+    os.makedirs(local_path, exist_ok=True)
+
+    # Encoded Segments and Audio are downloaded concurrently, files left by a previous attempt are reused
+    encoded_segment_paths = [local_path + f"/{encoded_segment_s3_url.split('/')[-1]}" for encoded_segment_s3_url in encoded_segment_s3_urls]
+    audio_path = local_path + f"/{audio_s3_url.split('/')[-1]}" if audio_s3_url else None
+    downloads = [(s3_url, path) for s3_url, path in zip(encoded_segment_s3_urls, encoded_segment_paths)]
+    if audio_path:
+        downloads.append((audio_s3_url, audio_path))
+    await asyncio.gather(*[download_file(s3_url, path) for s3_url, path in downloads if not os.path.isfile(path)])
+    if not all(os.path.isfile(path) for _, path in downloads):
+        raise Exception(f"Segment Download Failed : {task_id}")
+
+    await asyncio.to_thread(publish_progress, task_id, ProcessingStage.UPLOADING)
+    # Concatenated under a temporary name, a failed concat never leaves a partial output to upload
+    partial_path = local_path + f"/partial_{output_file_name}"
+    if not await concat_segments(encoded_segment_paths, audio_path, partial_path):
+        raise Exception(f"Segment Concat Failed : {task_id}")
+    os.replace(partial_path, output_path)
+    converted_file_s3_url = await upload_file_to_s3_from_path(output_path, output_file_name, "video/mp4")
+    if not converted_file_s3_url:
+        raise Exception(f"Output Upload Failed : {task_id}")
+    logger.info(f"File Conversion Success : S3 URL : {converted_file_s3_url}")
+
+    await save_checkpoint(task_id, ProcessingCheckpoint.VIDEO_UPLOADED, output_video=converted_file_s3_url)
+    await asyncio.to_thread(delete_files_from_s3, encoded_segment_s3_urls + segment_s3_urls + [audio_s3_url])
+    remove_scratch_path(local_path)
+    return {'output_video' : converted_file_s3_url}
@@ -0,0 +1,121 @@
+from app.dtos.collection_names import CollectionNames
+from app.utils.db_query import MongoQueryApplicator
+from app.constants.video_constants import ProcessingCheckpoint
+from app.core.config import settings
+from app.utils.logger import get_logger
+
+from datetime import datetime
+from bson import ObjectId
+from typing import Callable, Optional
+import os
+import re
+import shutil
+import asyncio
+import socket
+import time
+
+logger = get_logger("checkpoints")
+
+'''
+    Stage Checkpoints, stored on the task document under checkpoints.<checkpoint>
+        {completed_at, host, ...output of the step}
+    Outputs uploaded to S3 are valid on every worker, local artifacts (downloaded source, encoded output) only on the host
+    which produced them, as long as its scratch directory still holds them
+    A retried stage skips every step which has a valid checkpoint
+'''
+HOST = socket.gethostname()
+TASK_ID_PATTERN = re.compile(r"^[0-9a-f]{24}")
+
+async def get_checkpoints(task_id : str) -> dict:
+    mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+    video_record = await mongo.find_one({"_id" : ObjectId(task_id)}, {'checkpoints' : 1})
+    return (video_record or {}).get('checkpoints') or {}
+
+async def save_checkpoint(task_id : str, checkpoint : ProcessingCheckpoint, key : Optional[str] = None, **output):
+    field = f"checkpoints.{checkpoint.value}" + (f".{key}" if key else "")
+    mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+    await mongo.update_one(
+        {"_id" : ObjectId(task_id)},
+        {
+            field : {'completed_at' : datetime.now(), 'host' : HOST, **output},
+            'updated_at' : datetime.now()
+        }
+    )
+    logger.info(f"Checkpoint Saved : {task_id}, {field}")
+
+'''
+    Start of a stage : refreshes updated_at (heartbeat) when the message belongs to the current dispatch of the task
+    A message of a superseded dispatch (task re-enqueued by the sweeper, see task_dispatcher.py) does not match, its stage is skipped
+    Messages published without a dispatch_id are always current
+'''
+async def claim_stage(task_id : str, dispatch_id : Optional[str]) -> bool:
+    filters = {"_id" : ObjectId(task_id)}
+    if dispatch_id:
+        filters['dispatch.id'] = dispatch_id
+    mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+    return await mongo.find_one_and_update(filters, {'$set' : {'updated_at' : datetime.now()}}) is not None
+
+'''
+    Wraps an ffmpeg progress callback, refreshes updated_at of the task at most every TASK_HEARTBEAT_INTERVAL
+    so a long encode is never taken for a stuck task (progress itself only goes to Redis)
+    Progress callbacks run on the worker's event loop, the update is scheduled on it
+'''
+heartbeats = set()
+
+def with_heartbeat(task_id : str, on_progress : Callable[[dict], None]) -> Callable[[dict], None]:
+    last_heartbeat = [time.monotonic()]
+    mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+
+    def on_progress_with_heartbeat(ffmpeg_progress : dict):
+        on_progress(ffmpeg_progress)
+        if time.monotonic() - last_heartbeat[0] < settings.TASK_HEARTBEAT_INTERVAL:
+            return
+        last_heartbeat[0] = time.monotonic()
+        heartbeat = asyncio.get_running_loop().create_task(mongo.update_one({"_id" : ObjectId(task_id)}, {'updated_at' : datetime.now()}))
+        # Referenced until done, the loop only keeps weak references to its tasks
+        heartbeats.add(heartbeat)
+        heartbeat.add_done_callback(heartbeats.discard)
+    return on_progress_with_heartbeat
+
+'''
+    Path of a local artifact if it can be reused on this host, None otherwise
+'''
+def get_local_artifact(checkpoints : dict, checkpoint : ProcessingCheckpoint) -> Optional[str]:
+    entry = checkpoints.get(checkpoint.value) or {}
+    if entry.get('host') == HOST and entry.get('path') and os.path.exists(entry.get('path')):
+        logger.info(f"Reusing Local Artifact : {entry.get('path')}")
+        return entry.get('path')
+    return None
+
+'''
+    Scratch Directory of a stage, kept when the stage fails so a retry on the same host can reuse it
+'''
+def get_scratch_path(task_id : str, name : Optional[str] = None) -> str:
+    return os.path.join(settings.SCRATCH_DIR, f"{task_id}_{name}" if name else task_id)
+
+def remove_scratch_path(path : str):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+        logger.info(f"Successfully Deleted The Locally Created Files : {path}")
+
+'''
+    Called once the task has failed for good, drops every scratch directory of the task on this host
+'''
+def remove_task_scratch(task_id : str):
+    if not os.path.isdir(settings.SCRATCH_DIR):
+        return
+    for name in os.listdir(settings.SCRATCH_DIR):
+        if name.startswith(task_id):
+            remove_scratch_path(os.path.join(settings.SCRATCH_DIR, name))
+
+'''
+    Drops scratch directories of abandoned tasks (failed on another host, worker killed), called on worker start
+'''
+def sweep_scratch_dir():
+    if not os.path.isdir(settings.SCRATCH_DIR):
+        return
+    expired_before = time.time() - settings.SCRATCH_RETENTION_SECONDS
+    for name in os.listdir(settings.SCRATCH_DIR):
+        path = os.path.join(settings.SCRATCH_DIR, name)
+        if TASK_ID_PATTERN.match(name) and os.path.getmtime(path) < expired_before:
+            remove_scratch_path(path)
@@ -1,17 +1,44 @@
 from dotenv import load_dotenv, get_key
 from pydantic import BaseModel
+from typing import Optional
+import json
+import os
 
 # Load environment variables from .env file
 load_dotenv()
 
+'''
+    Named Encoding Profiles, selectable per upload (encoding_profile)
+    Overridden / extended without a code deploy through a JSON file (ENCODING_PROFILES_FILE) with the same structure
+        video_codec     : ffmpeg encoder
+        preset, crf     : encoder settings
+        extra_args      : appended to the encoder arguments
+        content_aware   : adjust crf / preset from the probe (see encoding_profiles.py), defaults to CONTENT_AWARE_ENCODING
+'''
+DEFAULT_ENCODING_PROFILES = {
+    "fast-preview" : {"video_codec" : "libx264", "preset" : "veryfast", "crf" : 28},
+    "standard" : {"video_codec" : "libx264", "preset" : "fast", "crf" : 22},
+    "archive-hevc" : {"video_codec" : "libx265", "preset" : "slow", "crf" : 24, "extra_args" : ["-tag:v", "hvc1"]},   # hvc1 tag, playable by Apple devices
+    "av1-svt" : {"video_codec" : "libsvtav1", "preset" : "8", "crf" : 32},
+}
+
+def load_encoding_profiles(profiles_file : Optional[str]) -> dict:
+    profiles = dict(DEFAULT_ENCODING_PROFILES)
+    if profiles_file:
+        with open(profiles_file) as f:
+            profiles.update(json.load(f))
+    return profiles
+
 class Settings(BaseModel):
     """Application settings."""
     APP_NAME: str = "Video Processing"
     APP_VERSION: str = "0.1.0"
     MONGO_URI: str = get_key(".env", "MONGO_URI")
     MONGO_DB:str = get_key(".env", "MONGO_DB")
-    GLOBAL_VIDEO_RATE_LIMITING: int = 100   # Per Day
-    USER_VIDEO_RATE_LIMITING: int = 1 # Per Day
+    GLOBAL_VIDEO_RATE_LIMITING: int = int(get_key(".env", "GLOBAL_VIDEO_RATE_LIMITING") or 100)   # Per Window
+    USER_VIDEO_RATE_LIMITING: int = int(get_key(".env", "USER_VIDEO_RATE_LIMITING") or 1) # Per Window
+    RATE_LIMIT_WINDOW_SECONDS: int = int(get_key(".env", "RATE_LIMIT_WINDOW_SECONDS") or 86400)  # Sliding Window, 1 Day
+    BATCH_MAX_ITEMS : int = int(get_key(".env", "BATCH_MAX_ITEMS") or 1000)  # Files / references per batch upload, task_ids per bulk status request
 
     # S3
     S3_REGION : str = get_key(".env", "S3_REGION")
@@ -19,10 +46,88 @@ class Settings(BaseModel):
     S3_SECRET_ACCESS_KEY : str = get_key(".env", "S3_SECRET_ACCESS_KEY")
     
     VIDEO_UPLOAD_S3_BUCKET : str = get_key(".env", "VIDEO_UPLOAD_S3_BUCKET")
+    S3_MULTIPART_PART_SIZE : int = int(get_key(".env", "S3_MULTIPART_PART_SIZE") or 8 * 1024 * 1024)  # Bytes, S3 minimum is 5 MB
+    S3_MULTIPART_CONCURRENCY : int = int(get_key(".env", "S3_MULTIPART_CONCURRENCY") or 4)  # Parts in flight per upload
+    S3_MULTIPART_THRESHOLD : int = int(get_key(".env", "S3_MULTIPART_THRESHOLD") or 16 * 1024 * 1024)  # Bytes, files above this are transferred in parts
+    S3_TRANSFER_MAX_CONCURRENCY : int = int(get_key(".env", "S3_TRANSFER_MAX_CONCURRENCY") or 10)  # Threads per upload_file / download_file
+    S3_MAX_POOL_CONNECTIONS : int = int(get_key(".env", "S3_MAX_POOL_CONNECTIONS") or 50)  # Shared by all transfers of the process
+    S3_PRESIGNED_URL_EXPIRY : int = int(get_key(".env", "S3_PRESIGNED_URL_EXPIRY") or 3600)  # Seconds
+    S3_ENDPOINT_URL : Optional[str] = get_key(".env", "S3_ENDPOINT_URL") or None  # Local S3 stand-in (moto / MinIO), None for AWS
 
     # Celery
     BROKER_URL : str = get_key(".env", "BROKER_URL")
     BACKEND_URL : str = get_key(".env", "BACKEND_URL") 
+    WORKER_POOL : str = get_key(".env", "WORKER_POOL") or "threads"  # threads : tasks of a worker process share its event loop (see worker_loop.py)
+    WORKER_CONCURRENCY : int = int(get_key(".env", "WORKER_CONCURRENCY") or 4)  # Tasks in flight per worker
+    WORKER_ENCODE_CONCURRENCY : int = int(get_key(".env", "WORKER_ENCODE_CONCURRENCY") or 1)  # ffmpeg encodes running at once per worker process, the other tasks do I/O meanwhile
+    WORKER_IO_THREADS : int = int(get_key(".env", "WORKER_IO_THREADS") or 16)  # Threads for blocking S3 calls per worker process
+    TASK_MAX_RETRIES : int = int(get_key(".env", "TASK_MAX_RETRIES") or 3)  # Per stage, a retried stage resumes from its last checkpoint
+    TASK_RETRY_BACKOFF : int = int(get_key(".env", "TASK_RETRY_BACKOFF") or 30)  # Seconds, doubled on every retry (with jitter)
+    TASK_RETRY_BACKOFF_MAX : int = int(get_key(".env", "TASK_RETRY_BACKOFF_MAX") or 600)  # Seconds
+    SCRATCH_DIR : str = get_key(".env", "SCRATCH_DIR") or os.path.join(os.getcwd(), "scratch")  # Local working files of the worker, kept between retries
+    SCRATCH_RETENTION_SECONDS : int = int(get_key(".env", "SCRATCH_RETENTION_SECONDS") or 24 * 60 * 60)  # Leftovers of abandoned tasks are swept after this
+    LOCAL_CACHE_DIR : str = get_key(".env", "LOCAL_CACHE_DIR") or os.path.join(os.getcwd(), "cache")  # Node-local cache of S3 objects, shared by the worker processes of the node
+    LOCAL_CACHE_MAX_BYTES : int = int(get_key(".env", "LOCAL_CACHE_MAX_BYTES") or 10 * 1024 * 1024 * 1024)  # LRU eviction above this size, 0 disables the cache
+    # Encoding
+    ENCODING_PROFILES : dict = load_encoding_profiles(get_key(".env", "ENCODING_PROFILES_FILE"))
+    DEFAULT_ENCODING_PROFILE : str = get_key(".env", "DEFAULT_ENCODING_PROFILE") or "standard"
+    CONTENT_AWARE_ENCODING : bool = (get_key(".env", "CONTENT_AWARE_ENCODING") or "false").lower() == "true"
+    ENCODER_THREADS : int = int(get_key(".env", "ENCODER_THREADS") or 0)  # 0 : CPUs allocated to the worker / WORKER_ENCODE_CONCURRENCY
+
+    # Thumbnails, extracted from keyframes only (see extract_thumbnails)
+    THUMBNAIL_COUNT : int = int(get_key(".env", "THUMBNAIL_COUNT") or 5)
+    THUMBNAIL_SELECTION : str = get_key(".env", "THUMBNAIL_SELECTION") or "interval"  # interval : evenly spaced, scene : on scene changes
+    THUMBNAIL_SCENE_THRESHOLD : float = float(get_key(".env", "THUMBNAIL_SCENE_THRESHOLD") or 0.3)  # Scene change score (0-1) between two keyframes
+    THUMBNAIL_TIMESTAMP : float = float(get_key(".env", "THUMBNAIL_TIMESTAMP") or 10)  # Seconds, primary thumbnail, clamped to the middle of shorter videos
+    THUMBNAIL_WIDTH : int = int(get_key(".env", "THUMBNAIL_WIDTH") or 320)
+    SPRITE_INTERVAL : int = int(get_key(".env", "SPRITE_INTERVAL") or 10)  # Seconds per sprite tile, raised for long videos to stay within SPRITE_MAX_TILES
+    SPRITE_MAX_TILES : int = int(get_key(".env", "SPRITE_MAX_TILES") or 100)
+    SPRITE_COLUMNS : int = int(get_key(".env", "SPRITE_COLUMNS") or 10)
+    SPRITE_TILE_WIDTH : int = int(get_key(".env", "SPRITE_TILE_WIDTH") or 160)
+
+    WORKER_METRICS_PORT : int = int(get_key(".env", "WORKER_METRICS_PORT") or 9540)  # Prometheus metrics of the Celery worker, 0 disables
+    REDIS_URL : str = get_key(".env", "REDIS_URL") or get_key(".env", "BROKER_URL")  # Rate Limiting, Caching, Pub/Sub
+
+    # Task Cache, read-through cache of the task status / outputs in the API (see task_cache.py)
+    TASK_CACHE_MAX_ENTRIES : int = int(get_key(".env", "TASK_CACHE_MAX_ENTRIES") or 10000)  # Per API worker process, 0 disables the cache
+    TASK_CACHE_TERMINAL_TTL : int = int(get_key(".env", "TASK_CACHE_TERMINAL_TTL") or 24 * 60 * 60)  # Seconds, processed / failed tasks
+    TASK_CACHE_ACTIVE_TTL : int = int(get_key(".env", "TASK_CACHE_ACTIVE_TTL") or 5)  # Seconds, tasks in progress
+    TASK_CACHE_REDIS : bool = (get_key(".env", "TASK_CACHE_REDIS") or "true").lower() == "true"  # Shared level in Redis, behind the in-process level
+    # Output Endpoint (see output_delivery.py)
+    OUTPUT_DELIVERY : str = get_key(".env", "OUTPUT_DELIVERY") or "redirect"  # redirect : presigned GET URL, proxy : streamed through the API (Range support)
+    OUTPUT_URL_EXPIRY : int = int(get_key(".env", "OUTPUT_URL_EXPIRY") or 300)  # Seconds, presigned URLs handed out by the output endpoint
+    OUTPUT_STREAM_CHUNK_SIZE : int = int(get_key(".env", "OUTPUT_STREAM_CHUNK_SIZE") or 1024 * 1024)  # Bytes per read when proxying
+    OUTPUT_LOCAL_ACCEL_PREFIX : str = get_key(".env", "OUTPUT_LOCAL_ACCEL_PREFIX") or ""  # nginx internal location of LOCAL_CACHE_DIR/objects/, locally cached outputs are sent with X-Accel-Redirect (sendfile)
+    TASK_RESPONSE_MAX_AGE : int = int(get_key(".env", "TASK_RESPONSE_MAX_AGE") or 3600)  # Seconds, Cache-Control of processed / failed task responses
+
+    # Task Dispatcher, outbox of the Celery publishes (see task_dispatcher.py)
+    OUTBOX_BATCH_SIZE : int = int(get_key(".env", "OUTBOX_BATCH_SIZE") or 100)  # Tasks per grouped publish
+    OUTBOX_POLL_INTERVAL : float = float(get_key(".env", "OUTBOX_POLL_INTERVAL") or 0.5)  # Seconds between outbox reads when it is empty
+    OUTBOX_SWEEP_INTERVAL : int = int(get_key(".env", "OUTBOX_SWEEP_INTERVAL") or 60)  # Seconds between sweeps for stuck tasks
+    PROCESSING_STUCK_DEADLINE : int = int(get_key(".env", "PROCESSING_STUCK_DEADLINE") or 3 * 60 * 60)  # Seconds without any update of a processing task, above the longest stage
+    TASK_HEARTBEAT_INTERVAL : int = int(get_key(".env", "TASK_HEARTBEAT_INTERVAL") or 60)  # Seconds, updated_at of a task is refreshed this often during an encode
+    OUTBOX_MAX_REDISPATCHES : int = int(get_key(".env", "OUTBOX_MAX_REDISPATCHES") or 2)  # Re-enqueues of a stuck task before it is failed
+
+    # Admission Control of the disk / CPU heavy stages on the worker node (see admission.py)
+    ADMISSION_CONTROL : bool = (get_key(".env", "ADMISSION_CONTROL") or "true").lower() == "true"
+    ADMISSION_SCRATCH_FACTOR : float = float(get_key(".env", "ADMISSION_SCRATCH_FACTOR") or 3)  # Scratch bytes reserved per source byte (source, output, intermediates)
+    ADMISSION_MIN_FREE_BYTES : int = int(get_key(".env", "ADMISSION_MIN_FREE_BYTES") or 1024 * 1024 * 1024)  # Kept free on the scratch disk
+    ADMISSION_MIN_FREE_MEMORY : int = int(get_key(".env", "ADMISSION_MIN_FREE_MEMORY") or 512 * 1024 * 1024)  # Bytes of available memory needed to start a stage
+    ADMISSION_MAX_CPU_LOAD : float = float(get_key(".env", "ADMISSION_MAX_CPU_LOAD") or 3)  # 1 minute load average per CPU above which stages are deferred, 0 disables
+    ADMISSION_MAX_ENCODE_SECONDS : int = int(get_key(".env", "ADMISSION_MAX_ENCODE_SECONDS") or 0)  # Media seconds in flight per node, 0 : no cap
+    ADMISSION_DEFER_SECONDS : int = int(get_key(".env", "ADMISSION_DEFER_SECONDS") or 30)  # Countdown of a deferred stage
+    ADMISSION_MAX_DEFERS : int = int(get_key(".env", "ADMISSION_MAX_DEFERS") or 20)  # Deferrals of a stage before the task is failed
+    WORKER_CAPACITY_REPORT_INTERVAL : int = int(get_key(".env", "WORKER_CAPACITY_REPORT_INTERVAL") or 10)  # Seconds between node capacity reports
+    # Queue Analytics (estimated wait / autoscaling signal)
+    ESTIMATED_ENCODE_SPEED : float = float(get_key(".env", "ESTIMATED_ENCODE_SPEED") or 1)  # Media seconds encoded per second per encode slot (encode_speed_ratio of the benchmark)
+    QUEUE_TARGET_WAIT_SECONDS : int = int(get_key(".env", "QUEUE_TARGET_WAIT_SECONDS") or 600)  # Wait the recommended encode slots are sized for
+
+    # Streaming Processing : ffmpeg reads the source from S3 and writes the output to S3 through a pipe, no full copies on local disk
+    STREAMING_PROCESSING : bool = (get_key(".env", "STREAMING_PROCESSING") or "false").lower() == "true"
+
+    # Segmented Transcoding (Split -> Parallel Encode -> Concat), used for long videos
+    SEGMENTED_TRANSCODE_MIN_DURATION : int = int(get_key(".env", "SEGMENTED_TRANSCODE_MIN_DURATION") or 600)  # Seconds
+    SEGMENT_DURATION : int = int(get_key(".env", "SEGMENT_DURATION") or 60)  # Seconds
 
     class Config:
         env_file = ".env"
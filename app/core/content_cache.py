@@ -0,0 +1,126 @@
+from app.dtos.collection_names import CollectionNames
+from app.utils.db_query import MongoQueryApplicator
+from app.utils.s3_utils import delete_files_from_s3, delete_prefix_from_s3
+from app.utils.logger import get_logger
+
+from datetime import datetime
+from bson import ObjectId
+from typing import AsyncIterator, Optional
+import asyncio
+import hashlib
+
+logger = get_logger("content_cache")
+
+'''
+    Content Addressed Cache of Processed Outputs
+    One document per (content_hash, profile, encoding_profile) in the content_cache collection :
+        {content_hash, profile, encoding_profile, outputs : {output_video, thumbnail, ...}, origin_task_id, ref_count, task_ids}
+    Every task pointing to the outputs holds a reference, the outputs are deleted from S3 when the last reference is released
+    task_ids : the processed tasks which registered their outputs, a task registers (and takes its reference) only once
+'''
+CACHED_OUTPUT_FIELDS = ['output_video', 'thumbnail', 'thumbnails', 'sprite_sheet', 'hls_manifest', 'dash_manifest', 'renditions']
+
+'''
+    Passes the chunks through while hashing them, the digest is available once the stream is consumed
+'''
+async def hash_stream(file_chunks : AsyncIterator[bytes], hasher) -> AsyncIterator[bytes]:
+    async for chunk in file_chunks:
+        hasher.update(chunk)
+        yield chunk
+
+def new_content_hasher():
+    return hashlib.sha256()
+
+'''
+    Cache hit : takes a reference on the outputs and returns them, None on a miss
+'''
+async def acquire_processed_outputs(content_hash : str, profile : str, encoding_profile : Optional[str]) -> Optional[dict]:
+    mongo = MongoQueryApplicator(CollectionNames.CONTENT_CACHE.value)
+    entry = await mongo.find_one_and_update(
+        {"content_hash" : content_hash, "profile" : profile, "encoding_profile" : encoding_profile},
+        {"$inc" : {"ref_count" : 1}, "$set" : {"updated_at" : datetime.now()}}
+    )
+    if not entry:
+        return None
+    logger.info(f"Content Cache Hit : {content_hash}, Profile : {profile}, Encoding Profile : {encoding_profile}, References : {entry.get('ref_count')}")
+    return {
+        'origin_task_id' : entry.get('origin_task_id'),
+        **(entry.get('outputs') or {})
+    }
+
+'''
+    Called by the worker once a task is processed, registers its outputs for later duplicates
+    If an identical upload was processed concurrently the existing entry wins, this task only takes a reference on it
+    Idempotent : the reference is taken together with adding the task to task_ids (one pipeline update), a retried finalize
+    stage registering again does not count it twice
+'''
+async def register_processed_outputs(task_id : str):
+    videos = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+    video_record = await videos.find_one({"_id" : ObjectId(task_id)})
+    if not video_record or not video_record.get('content_hash'):
+        return
+
+    outputs = {field : video_record.get(field) for field in CACHED_OUTPUT_FIELDS if video_record.get(field)}
+    mongo = MongoQueryApplicator(CollectionNames.CONTENT_CACHE.value)
+    task_ids = {"$ifNull" : ["$task_ids", []]}
+    entry = await mongo.find_one_and_update(
+        {"content_hash" : video_record.get('content_hash'), "profile" : video_record.get('profile'), "encoding_profile" : video_record.get('encoding_profile')},
+        [
+            {
+                "$set" : {
+                    "outputs" : {"$ifNull" : ["$outputs", {"$literal" : outputs}]},
+                    "origin_task_id" : {"$ifNull" : ["$origin_task_id", task_id]},
+                    "created_at" : {"$ifNull" : ["$created_at", datetime.now()]},
+                    "ref_count" : {"$cond" : [{"$in" : [task_id, task_ids]}, "$ref_count", {"$add" : [{"$ifNull" : ["$ref_count", 0]}, 1]}]},
+                    "task_ids" : {"$setUnion" : [task_ids, [task_id]]},
+                    "updated_at" : datetime.now()
+                }
+            }
+        ],
+        upsert=True
+    )
+    logger.info(f"Content Cache Registered : {video_record.get('content_hash')}, Origin Task : {entry.get('origin_task_id')}")
+
+    # Lost the race, point the task at the cached outputs and drop its own copy
+    if entry.get('origin_task_id') != task_id:
+        await videos.update_one(
+            {"_id" : ObjectId(task_id)},
+            {
+                **entry.get('outputs'),
+                'deduplicated_from' : entry.get('origin_task_id'),
+                'updated_at' : datetime.now()
+            }
+        )
+        await asyncio.to_thread(delete_outputs_from_s3, outputs)
+
+'''
+    Drops a reference, deletes the outputs from S3 once nothing points to them anymore
+'''
+async def release_processed_outputs(content_hash : str, profile : str, encoding_profile : Optional[str]):
+    mongo = MongoQueryApplicator(CollectionNames.CONTENT_CACHE.value)
+    entry = await mongo.find_one_and_update(
+        {"content_hash" : content_hash, "profile" : profile, "encoding_profile" : encoding_profile},
+        {"$inc" : {"ref_count" : -1}, "$set" : {"updated_at" : datetime.now()}}
+    )
+    if not entry or entry.get('ref_count') > 0:
+        return
+
+    await asyncio.to_thread(delete_outputs_from_s3, entry.get('outputs') or {})
+    await mongo.delete_one({"_id" : entry.get('_id'), "ref_count" : {"$lte" : 0}})
+    logger.info(f"Content Cache Released : {content_hash}, Profile : {profile}, Encoding Profile : {encoding_profile}")
+
+'''
+    Blocking (boto3, paginated listing of HLS / DASH packages), run in a thread from async code
+'''
+def delete_outputs_from_s3(outputs : dict):
+    sprite_sheet = outputs.get('sprite_sheet') or {}
+    delete_files_from_s3([
+        outputs.get('output_video'),
+        outputs.get('thumbnail'),
+        *(outputs.get('thumbnails') or []),
+        sprite_sheet.get('image'),
+        sprite_sheet.get('vtt')
+    ])
+    if outputs.get('hls_manifest'):
+        # HLS / DASH package : every file next to the master playlist
+        delete_prefix_from_s3(outputs.get('hls_manifest').rsplit("/", 1)[0])
@@ -0,0 +1,213 @@
+from app.core.config import settings
+from app.core.worker import process_video_task, processing_failed_task
+from app.dtos.collection_names import CollectionNames
+from app.utils.db_query import MongoQueryApplicator
+from app.utils.logger import get_logger
+from app.utils.redis_connect import redis_connection
+from app.utils.task_cache import task_cache
+from app.utils.progress_publisher import publish_progress
+from app.constants.video_constants import VideoStatus, DispatchState, ProcessingStage
+
+from celery import group
+from datetime import datetime, timedelta
+from pymongo import ASCENDING
+from typing import List, Optional, Tuple
+from uuid import uuid4
+import asyncio
+import time
+
+logger = get_logger(__name__)
+
+'''
+    Transactional Outbox of the Celery publishes, the request path never waits on the broker
+        1. The update which moves a task to processing also writes its dispatch record (dispatch.state = pending) on the
+           same document, a single document write is atomic : a processing task always has a record, published or not
+        2. The dispatcher, a background task of the API workers (one at a time, holder of DISPATCHER_LOCK_KEY), reads the
+           pending records in batches of OUTBOX_BATCH_SIZE, publishes each batch as one Celery group, then marks them dispatched
+        3. The sweeper (same holder, every OUTBOX_SWEEP_INTERVAL) re-enqueues processing tasks without any update for
+           PROCESSING_STUCK_DEADLINE (lost message, killed worker), a task stuck OUTBOX_MAX_REDISPATCHES times is failed
+    Running stages refresh updated_at (stage start, every TASK_HEARTBEAT_INTERVAL of an encode), a task waiting in a busy
+    queue past the deadline may still be re-enqueued : every stage carries the dispatch id and the stages of a superseded
+    dispatch are skipped (see StageTask), only the current dispatch ever works on the task
+    Delivery is at least once : a batch published right before a crash is published again, the probe skips messages of a
+    task which is not processing anymore
+'''
+DISPATCHER_LOCK_KEY = "task_dispatcher:lock"
+DISPATCHER_LOCK_TTL = 30    # Seconds, another API worker takes over after this when the holder dies
+DISPATCH_RETRY_SECONDS = 5
+
+# Takes the lock, or extends it when this process already holds it
+ACQUIRE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+'''
+    Dispatch record of a task, written together with its processing status ($set of the 'dispatch' field or part of the inserted document)
+'''
+def new_dispatch_record(redispatches : int = 0) -> dict:
+    return {
+        'id' : uuid4().hex,
+        'state' : DispatchState.PENDING.value,
+        'queued_at' : datetime.now(),
+        'redispatches' : redispatches,
+    }
+
+'''
+    One grouped publish, the messages of the batch share one broker connection / producer
+    The errback marks the task failed once the probe stage has exhausted its retries
+'''
+def publish_tasks(dispatches : List[Tuple[str, str]]):
+    return group(
+        process_video_task.si(task_id, dispatch_id=dispatch_id).on_error(processing_failed_task.s(task_id, dispatch_id=dispatch_id))
+        for task_id, dispatch_id in dispatches
+    ).apply_async()
+
+class TaskDispatcher:
+    def __init__(self, batch_size : int, poll_interval : float, sweep_interval : int, stuck_deadline : int, max_redispatches : int):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval
+        self.stuck_deadline = stuck_deadline
+        self.max_redispatches = max_redispatches
+        self.token = uuid4().hex
+        # Created by start() on the running loop, the instance is built at import time (bound to another loop on Python 3.9)
+        self.wakeup : Optional[asyncio.Event] = None
+        self.runner : Optional[asyncio.Task] = None
+        self.last_sweep = 0.0
+
+    '''
+        Called after writing dispatch records, the dispatcher of this process (if it holds the lock) publishes them
+        without waiting for the next poll
+    '''
+    def notify(self):
+        if self.wakeup:
+            self.wakeup.set()
+
+    async def acquire_lock(self) -> bool:
+        client = await redis_connection.get_client()
+        return bool(await client.eval(ACQUIRE_LOCK_SCRIPT, 1, DISPATCHER_LOCK_KEY, self.token, DISPATCHER_LOCK_TTL))
+
+    async def release_lock(self):
+        client = await redis_connection.get_client()
+        await client.eval(RELEASE_LOCK_SCRIPT, 1, DISPATCHER_LOCK_KEY, self.token)
+
+    '''
+        Publishes one batch of pending records, oldest first
+        Returns the number of published tasks
+    '''
+    async def dispatch_pending(self) -> int:
+        mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+        tasks = await mongo.find(
+            {'dispatch.state' : DispatchState.PENDING.value},
+            self.batch_size,
+            {'dispatch.id' : 1},
+            [('dispatch.queued_at', ASCENDING)]
+        )
+        if not tasks:
+            return 0
+
+        dispatches = [(str(task.get('_id')), task.get('dispatch').get('id')) for task in tasks]
+        # The publish is a blocking broker round trip, kept off the event loop
+        await asyncio.to_thread(publish_tasks, dispatches)
+
+        # Matched on the dispatch id, a record replaced meanwhile (re-enqueue) stays pending
+        await mongo.bulk_update([
+            (
+                {'_id' : task.get('_id'), 'dispatch.id' : task.get('dispatch').get('id')},
+                {'dispatch.state' : DispatchState.DISPATCHED.value, 'dispatch.dispatched_at' : datetime.now()}
+            )
+            for task in tasks
+        ])
+        logger.info(f"Tasks Dispatched : {len(tasks)}")
+        return len(tasks)
+
+    '''
+        Re-enqueues the tasks processing without any update (stage, checkpoint) for PROCESSING_STUCK_DEADLINE
+        Matched on updated_at, a task updated by a worker meanwhile is left alone
+    '''
+    async def sweep_stuck_tasks(self):
+        mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+        tasks = await mongo.find(
+            {
+                'status' : VideoStatus.PROCESSING.value,
+                'updated_at' : {'$lt' : datetime.now() - timedelta(seconds=self.stuck_deadline)},
+                'dispatch.state' : {'$ne' : DispatchState.PENDING.value},
+            },
+            self.batch_size,
+            {'updated_at' : 1, 'dispatch.redispatches' : 1},
+            [('updated_at', ASCENDING)]
+        )
+
+        updates = []
+        failed_task_ids = []
+        for task in tasks:
+            filters = {'_id' : task.get('_id'), 'status' : VideoStatus.PROCESSING.value, 'updated_at' : task.get('updated_at')}
+            redispatches = (task.get('dispatch') or {}).get('redispatches') or 0
+            if redispatches >= self.max_redispatches:
+                updates.append((filters, {'status' : VideoStatus.FAILED.value, 'updated_at' : datetime.now()}))
+                failed_task_ids.append(str(task.get('_id')))
+                continue
+            updates.append((filters, {'dispatch' : new_dispatch_record(redispatches + 1), 'updated_at' : datetime.now()}))
+
+        await mongo.bulk_update(updates)
+        for task_id in failed_task_ids:
+            await task_cache.invalidate(task_id)
+            await asyncio.to_thread(publish_progress, task_id, ProcessingStage.FAILED)
+        if tasks:
+            logger.info(f"Stuck Tasks : {len(tasks) - len(failed_task_ids)} re-enqueued, {len(failed_task_ids)} failed")
+
+    async def run(self):
+        while True:
+            try:
+                self.wakeup.clear()
+                if await self.acquire_lock():
+                    dispatched = await self.dispatch_pending()
+                    if time.monotonic() - self.last_sweep >= self.sweep_interval:
+                        self.last_sweep = time.monotonic()
+                        await self.sweep_stuck_tasks()
+                    if dispatched == self.batch_size:
+                        # Backlog, next batch right away
+                        continue
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Records stay pending, published by the next attempt (or the next holder of the lock)
+                logger.error(f"Task Dispatcher Failed : {e}")
+                await asyncio.sleep(DISPATCH_RETRY_SECONDS)
+
+    def start(self):
+        if not self.runner:
+            self.wakeup = asyncio.Event()
+            self.runner = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.runner:
+            self.runner.cancel()
+            try:
+                await self.runner
+            except asyncio.CancelledError:
+                pass
+            self.runner = None
+            try:
+                await self.release_lock()
+            except Exception as e:
+                logger.error(f"Task Dispatcher Lock Release Failed : {e}")
+
+task_dispatcher = TaskDispatcher(settings.OUTBOX_BATCH_SIZE, settings.OUTBOX_POLL_INTERVAL, settings.OUTBOX_SWEEP_INTERVAL, settings.PROCESSING_STUCK_DEADLINE, settings.OUTBOX_MAX_REDISPATCHES)
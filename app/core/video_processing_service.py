@@ -1,41 +1,48 @@
-from app.utils.request_validations import validate_rate_limit, validate_file_type
+from app.utils.request_validations import validate_rate_limit, validate_file_type, validate_processing_profile, validate_encoding_profile, validate_batch_size
 from app.dtos.error_success_code import ErrorAndSuccessCodes
 from app.dtos.collection_names import CollectionNames
 from app.utils.db_query import MongoQueryApplicator
-from app.constants.video_constants import VideoStatus
-from app.utils.s3_utils import upload_video_to_s3
-from app.core.worker import process_video_task
+from app.constants.video_constants import VideoStatus, ProcessingStage, ProcessingMode, DispatchState, TaskQueue
+from app.utils.s3_utils import upload_video_to_s3, create_presigned_multipart_upload, list_uploaded_parts, abort_presigned_multipart_upload, complete_presigned_multipart_upload, delete_files_from_s3, head_objects, get_s3_key_from_url
+from app.core.task_dispatcher import task_dispatcher, new_dispatch_record
+from app.core.content_cache import new_content_hasher, hash_stream, acquire_processed_outputs, release_processed_outputs, delete_outputs_from_s3, CACHED_OUTPUT_FIELDS
 from app.utils.logger import get_logger
 from app.dtos.video_processing_dtos import TaskList
+from app.utils.redis_connect import redis_connection
+from app.utils.rate_limiter import refund_rate_limit
+from app.utils.progress_publisher import TASK_PROGRESS_KEY, TERMINAL_STAGES
+from app.utils.task_cache import task_cache, is_terminal
+from app.utils.metrics import get_queue_depths
+from app.core.admission import get_node_capacities
+from app.core.config import settings
 
 from datetime import datetime
 from bson import ObjectId
-from typing import List
+from typing import Dict, List, Optional, AsyncIterator
+import asyncio
+import json
+import math
 
 logger = get_logger("video_processing")
 
-'''
-    Implementation for Celery Task Queue
-'''
-class CeleryTaskQueue:
-    def process_video(self, task_id):
-        return process_video_task.delay(task_id)
-    
+SSE_KEEP_ALIVE_SECONDS = 15
+
 async def process_video(input) -> dict:
     """
     Process the video file and return the task ID.
     
     Args:
-        input ({user_id : str, video_file : UploadFile}): The video processing request containing user ID and video file.
+        input ({user_id : str, profile : str, encoding_profile : str, file_name : str, content_type : str, file_chunks : AsyncIterator[bytes]}): The video processing request containing user ID, processing / encoding profile and the video file stream.
     
     Processing Steps : 
-    1. Validates if there is limit available at the global level to upload the file (Rate Limiting : Check 1)
-    2. Validates if the user has the limits available to upload the file (Rate Limiting : Check 2)
-    4. Validates File (Type, Size etc)
+    1. Validates File (Type, Size etc), Processing Profile (mp4, hls, hls_dash) and Encoding Profile (ENCODING_PROFILES)
+    2. Validates if there is limit available at the global level to upload the file (Rate Limiting : Check 1)
+    3. Validates if the user has the limits available to upload the file (Rate Limiting : Check 2)
     4. Creates as record in the database to store the video file (Gets the task_id) 
-    5. Upload File to S3
-    6. Update the status in task record in the database, return the task_id
-    7. Start Async processing for file
+    5. Upload File to S3, computing the SHA-256 of the content while it streams
+    6. Duplicate of an already processed file (same hash, profile and encoding profile) : reuse the outputs, done
+    7. Update the status in task record in the database together with its dispatch record (outbox), return the task_id
+    8. The task dispatcher publishes the task to Celery in the background
     
     Returns:
         str: The task ID for tracking the processing status.
@@ -44,7 +51,27 @@ async def process_video(input) -> dict:
     task_id = None
 
     try:
-        # Rate Limit Validation
+        # File Type Validation
+        file_type_check = validate_file_type(input.get('content_type'))
+        if file_type_check != ErrorAndSuccessCodes.SUCCESS:
+            return {
+                'status': file_type_check
+            }
+
+        # Processing Profile Validation
+        profile_check = validate_processing_profile(input.get('profile'))
+        if profile_check != ErrorAndSuccessCodes.SUCCESS:
+            return {
+                'status': profile_check
+            }
+
+        encoding_profile_check = validate_encoding_profile(input.get('encoding_profile'))
+        if encoding_profile_check != ErrorAndSuccessCodes.SUCCESS:
+            return {
+                'status': encoding_profile_check
+            }
+
+        # Rate Limit Validation, last check as it consumes the quota
         rate_limit_check = await validate_rate_limit(input.get('user_id'))
         logger.info(f"Rate Limit Check : {rate_limit_check.value}")
         if rate_limit_check != ErrorAndSuccessCodes.SUCCESS:
@@ -52,17 +79,12 @@ async def process_video(input) -> dict:
                 'status': rate_limit_check
             }
         
-        # File Type Validation
-        file_type_check = validate_file_type(input.get('video_file'))
-        if file_type_check != ErrorAndSuccessCodes.SUCCESS:
-            return {
-                'status': file_type_check
-            }
-        
         # Mongo Record Creation
         mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
         task_id = await mongo.insert_one({
             'user_id': input.get('user_id'),
+            'profile': input.get('profile'),
+            'encoding_profile': input.get('encoding_profile'),
             'status': VideoStatus.SAVED.value,
             'created_at': datetime.now(),
             'updated_at': datetime.now(),
@@ -71,24 +93,49 @@ async def process_video(input) -> dict:
         '''
             NOTE : When we have a client, the flow can start as async from here
             Since we are not having a client and only a backend system, we will upload the file in sync, and send the task_id for further processing in async
+            The upload is streamed from the request body to S3 as it is received (no temp file, event loop is not blocked)
         '''
-        # Upload File to S3
-        s3_url = await upload_video_to_s3(input.get('video_file'))
+        # Upload File to S3, hashing the bytes on the way (content addressed cache)
+        content_hasher = new_content_hasher()
+        file_chunks = hash_stream(input.get('file_chunks'), content_hasher)
+        s3_url = await upload_video_to_s3(file_chunks, task_id, input.get('file_name'), input.get('content_type'))
+        content_hash = content_hasher.hexdigest()
+
+        # Identical file already processed with these profiles : reuse its outputs, skip the transcode
+        cached_outputs = await acquire_processed_outputs(content_hash, input.get('profile'), input.get('encoding_profile'))
+        if cached_outputs:
+            await mongo.update_one(
+                {"_id" :ObjectId(task_id)},
+                {
+                    **{field : cached_outputs.get(field) for field in CACHED_OUTPUT_FIELDS},
+                    'content_hash' : content_hash,
+                    'deduplicated_from' : cached_outputs.get('origin_task_id'),
+                    'status' : VideoStatus.PROCESSED.value,
+                    'updated_at' : datetime.now()
+                }
+            )
+            await asyncio.to_thread(delete_files_from_s3, [s3_url])
+            return {
+                'task_id': task_id,
+                'status' : ErrorAndSuccessCodes.SUCCESS
+            }
 
         await mongo.update_one(
             {"_id" :ObjectId(task_id)},
             {
                 's3_url' : s3_url,
+                'content_hash' : content_hash,
                 'status' : VideoStatus.PROCESSING.value,
+                'dispatch' : new_dispatch_record(),
                 'updated_at' : datetime.now()
             }
         )
 
         '''
-            Push to Celery for processing
-            Returns a task_id
+            Published to Celery for processing by the task dispatcher (see task_dispatcher.py)
+            No broker round trip in the request
         '''
-        CeleryTaskQueue().process_video(task_id)
+        task_dispatcher.notify()
         
         return {
             'task_id': task_id,
@@ -108,50 +155,800 @@ async def process_video(input) -> dict:
         }
     
 
-async def get_tasks(user_id, task_id) -> List[TaskList]: 
+async def initiate_direct_upload(input) -> dict:
+    """
+    Step 1 of the Direct (Presigned) Upload, the video bytes go from the client straight to S3.
+    
+    Args:
+        input ({user_id : str, profile : str, encoding_profile : str, file_name : str, content_type : str, file_size : int})
+    
+    Processing Steps : 
+    1. Validates File Type, Processing / Encoding Profile and Rate Limits (same checks as the proxied upload)
+    2. Creates the task record in the database with status SAVED
+    3. Creates the S3 multipart upload, returns one presigned URL per part
+    
+    Returns:
+        dict: task_id, upload_id, part_size, parts
+    """
+    mongo = None
+    task_id = None
+
+    try:
+        file_type_check = validate_file_type(input.get('content_type'))
+        if file_type_check != ErrorAndSuccessCodes.SUCCESS:
+            return {
+                'status': file_type_check
+            }
+
+        # Processing Profile Validation
+        profile_check = validate_processing_profile(input.get('profile'))
+        if profile_check != ErrorAndSuccessCodes.SUCCESS:
+            return {
+                'status': profile_check
+            }
+
+        encoding_profile_check = validate_encoding_profile(input.get('encoding_profile'))
+        if encoding_profile_check != ErrorAndSuccessCodes.SUCCESS:
+            return {
+                'status': encoding_profile_check
+            }
+
+        if not input.get('file_size') or input.get('file_size') <= 0:
+            return {
+                'status': ErrorAndSuccessCodes.INVALID_INPUT
+            }
+
+        rate_limit_check = await validate_rate_limit(input.get('user_id'))
+        logger.info(f"Rate Limit Check : {rate_limit_check.value}")
+        if rate_limit_check != ErrorAndSuccessCodes.SUCCESS:
+            return {
+                'status': rate_limit_check
+            }
+
+        mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+        task_id = await mongo.insert_one({
+            'user_id': input.get('user_id'),
+            'profile': input.get('profile'),
+            'encoding_profile': input.get('encoding_profile'),
+            'status': VideoStatus.SAVED.value,
+            'created_at': datetime.now(),
+            'updated_at': datetime.now(),
+        })
+
+        s3_key = f"videos/{task_id}/{input.get('file_name')}"
+        upload = await create_presigned_multipart_upload(s3_key, input.get('content_type'), input.get('file_size'))
+
+        await mongo.update_one(
+            {"_id" :ObjectId(task_id)},
+            {
+                'direct_upload' : {
+                    's3_key' : s3_key,
+                    'upload_id' : upload.get('upload_id'),
+                    'parts_count' : len(upload.get('parts')),
+                    'file_size' : input.get('file_size'),
+                    'content_type' : input.get('content_type'),
+                },
+                'updated_at' : datetime.now()
+            }
+        )
+        return {
+            'task_id': task_id,
+            'upload_id': upload.get('upload_id'),
+            'part_size': upload.get('part_size'),
+            'parts': upload.get('parts'),
+            'status' : ErrorAndSuccessCodes.SUCCESS
+        }
+    except Exception as e:
+        logger.error(f"Error while initiating Direct Upload : {e}")
+        if mongo and task_id:
+            await mongo.update_one(
+                {"_id" :ObjectId(task_id)},
+                {
+                    'status' : VideoStatus.FAILED.value,
+                }
+        )
+        return {
+            'status' : ErrorAndSuccessCodes.PROCESSING_ERROR
+        }
+
+'''
+    Differences between the parts sent by the client and the parts S3 received ({part_number : etag}, ETags compared without quotes)
+    Every part of the presigned upload has to be sent once, with the ETag S3 returned for it
+'''
+def get_parts_mismatch(parts : List[dict], uploaded_parts : Dict[int, str], parts_count : Optional[int]) -> List[str]:
+    client_parts = {part.get('part_number') : (part.get('etag') or '').strip('"') for part in parts}
+    uploaded_parts = {part_number : etag.strip('"') for part_number, etag in uploaded_parts.items()}
+
+    mismatch = []
+    if len(client_parts) != len(parts):
+        mismatch.append("duplicate part numbers")
+    if parts_count and len(client_parts) != parts_count:
+        mismatch.append(f"parts {len(client_parts)} != {parts_count}")
+    mismatched_parts = sorted(
+        part_number for part_number in client_parts.keys() | uploaded_parts.keys()
+        if client_parts.get(part_number) != uploaded_parts.get(part_number)
+    )
+    if mismatched_parts:
+        mismatch.append(f"etag of parts {mismatched_parts}")
+    return mismatch
+
+async def complete_direct_upload(input) -> dict:
+    """
+    Step 2 of the Direct (Presigned) Upload, called by the client once all parts are uploaded.
+    
+    Args:
+        input ({task_id : str, parts : [{part_number : int, etag : str}]})
+    
+    Processing Steps : 
+    1. Verifies the parts sent by the client against the parts S3 received (part numbers, ETags, part count of step 1)
+    2. Completes the S3 multipart upload, verifies the object against the task record (size, content type)
+    3. Update the status in task record in the database together with its dispatch record (outbox), only while it is still saved
+    4. The task dispatcher publishes the task to Celery in the background
+    
+    Returns:
+        dict: task_id
+    """
+    task_id = input.get('task_id')
+    mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+
+    try:
+        video_record = await mongo.find_one({"_id" : ObjectId(task_id), "status" : VideoStatus.SAVED.value})
+        direct_upload = (video_record or {}).get('direct_upload')
+        if not direct_upload:
+            logger.info(f"No Pending Direct Upload Found Task Id : {task_id}")
+            return {
+                'status': ErrorAndSuccessCodes.TASK_NOT_FOUND
+            }
+
+        verification_errors = get_parts_mismatch(
+            input.get('parts'),
+            await list_uploaded_parts(direct_upload.get('s3_key'), direct_upload.get('upload_id')),
+            direct_upload.get('parts_count')
+        )
+        if verification_errors:
+            logger.error(f"Direct Upload Verification Failed : {task_id}, {verification_errors}")
+            await abort_presigned_multipart_upload(direct_upload.get('s3_key'), direct_upload.get('upload_id'))
+            await mongo.update_one(
+                {"_id" :ObjectId(task_id), "status" : VideoStatus.SAVED.value},
+                {
+                    'status' : VideoStatus.FAILED.value,
+                    'updated_at' : datetime.now()
+                }
+            )
+            return {
+                'status': ErrorAndSuccessCodes.UPLOAD_VERIFICATION_FAILED
+            }
+
+        uploaded_object = await complete_presigned_multipart_upload(direct_upload.get('s3_key'), direct_upload.get('upload_id'), input.get('parts'))
+
+        if uploaded_object.get('size') != direct_upload.get('file_size'):
+            verification_errors.append(f"size {uploaded_object.get('size')} != {direct_upload.get('file_size')}")
+        if uploaded_object.get('content_type') != direct_upload.get('content_type'):
+            verification_errors.append(f"content type {uploaded_object.get('content_type')} != {direct_upload.get('content_type')}")
+
+        if verification_errors:
+            logger.error(f"Direct Upload Verification Failed : {task_id}, {verification_errors}")
+            await asyncio.to_thread(delete_files_from_s3, [uploaded_object.get('s3_url')])
+            await mongo.update_one(
+                {"_id" :ObjectId(task_id), "status" : VideoStatus.SAVED.value},
+                {
+                    'status' : VideoStatus.FAILED.value,
+                    'updated_at' : datetime.now()
+                }
+            )
+            return {
+                'status': ErrorAndSuccessCodes.UPLOAD_VERIFICATION_FAILED
+            }
+
+        # Guarded on the saved status : of concurrent completions of the same upload only one moves the task to processing
+        processing_record = await mongo.find_one_and_update(
+            {"_id" :ObjectId(task_id), "status" : VideoStatus.SAVED.value},
+            {
+                '$set' : {
+                    's3_url' : uploaded_object.get('s3_url'),
+                    'status' : VideoStatus.PROCESSING.value,
+                    'dispatch' : new_dispatch_record(),
+                    'updated_at' : datetime.now()
+                }
+            }
+        )
+        if not processing_record:
+            logger.info(f"Direct Upload Already Completed Task Id : {task_id}")
+            return {
+                'status': ErrorAndSuccessCodes.TASK_NOT_FOUND
+            }
+        # The task_id is known to the client since step 1, it may have been looked up (and cached) as saved
+        await task_cache.invalidate(task_id)
+
+        task_dispatcher.notify()
+
+        return {
+            'task_id': task_id,
+            'status' : ErrorAndSuccessCodes.SUCCESS
+        }
+    except Exception as e:
+        logger.error(f"Error while completing Direct Upload : {e}, TASK ID: {task_id}")
+        return {
+            'status' : ErrorAndSuccessCodes.PROCESSING_ERROR
+        }
+
+async def process_video_batch(input) -> dict:
+    """
+    Batch upload, many video files in one multipart request, the per request overhead is paid once per batch.
+    
+    Args:
+        input ({user_id : str, profile : str, encoding_profile : str, file_count : int, videos : AsyncIterator[{file_name : str, content_type : str, file_chunks : AsyncIterator[bytes]}]})
+    
+    Processing Steps : 
+    1. Validates Processing / Encoding Profile and the declared file count (1 to BATCH_MAX_ITEMS)
+    2. Consumes file_count uploads of the rate limits in one call, the whole batch is accepted or rejected
+    3. Streams every file to S3 under a pre-allocated task_id, computing its SHA-256 on the way
+       Files of an unsupported type and files above file_count are skipped (reported per file)
+    4. Duplicates of already processed files reuse the outputs
+    5. Creates the task records of the batch with one insert_many (already PROCESSING / PROCESSED, no update round trip),
+       the processing ones with their dispatch record (outbox)
+       If the insert fails, the files without a task record are undone (S3 upload, cache reference, quota)
+    6. The task dispatcher publishes the batch to Celery in the background (grouped publishes)
+    
+    Returns:
+        dict: tasks ([{task_id, file_name, status}], task_id is None for skipped files) and status
+    """
+    try:
+        profile_check = validate_processing_profile(input.get('profile'))
+        if profile_check != ErrorAndSuccessCodes.SUCCESS:
+            return {'tasks' : [], 'status': profile_check}
+
+        encoding_profile_check = validate_encoding_profile(input.get('encoding_profile'))
+        if encoding_profile_check != ErrorAndSuccessCodes.SUCCESS:
+            return {'tasks' : [], 'status': encoding_profile_check}
+
+        batch_size_check = validate_batch_size(input.get('file_count'))
+        if batch_size_check != ErrorAndSuccessCodes.SUCCESS:
+            return {'tasks' : [], 'status': batch_size_check}
+
+        rate_limit_check = await validate_rate_limit(input.get('user_id'), input.get('file_count'))
+        logger.info(f"Rate Limit Check : {rate_limit_check.value}, Batch of {input.get('file_count')}")
+        if rate_limit_check != ErrorAndSuccessCodes.SUCCESS:
+            return {'tasks' : [], 'status': rate_limit_check}
+
+        results = []
+        documents = []
+        async for video in input.get('videos'):
+            result = {'task_id' : None, 'file_name' : video.get('file_name')}
+            results.append(result)
+            file_type_check = validate_file_type(video.get('content_type'))
+            if file_type_check != ErrorAndSuccessCodes.SUCCESS or len(results) > input.get('file_count'):
+                # The unread file is drained by the caller before the next one
+                result['status'] = file_type_check if file_type_check != ErrorAndSuccessCodes.SUCCESS else ErrorAndSuccessCodes.BATCH_SIZE_EXCEEDED
+                continue
+
+            task_id = ObjectId()
+            try:
+                content_hasher = new_content_hasher()
+                file_chunks = hash_stream(video.get('file_chunks'), content_hasher)
+                s3_url = await upload_video_to_s3(file_chunks, str(task_id), video.get('file_name'), video.get('content_type'))
+            except Exception as e:
+                logger.error(f"Error while uploading Batch Video : {e}, File Name: {video.get('file_name')}")
+                result['status'] = ErrorAndSuccessCodes.PROCESSING_ERROR
+                continue
+            content_hash = content_hasher.hexdigest()
+
+            document = {
+                '_id' : task_id,
+                'user_id': input.get('user_id'),
+                'profile': input.get('profile'),
+                'encoding_profile': input.get('encoding_profile'),
+                'content_hash' : content_hash,
+                'created_at': datetime.now(),
+                'updated_at': datetime.now(),
+            }
+            cached_outputs = await acquire_processed_outputs(content_hash, input.get('profile'), input.get('encoding_profile'))
+            if cached_outputs:
+                document.update({
+                    **{field : cached_outputs.get(field) for field in CACHED_OUTPUT_FIELDS},
+                    'deduplicated_from' : cached_outputs.get('origin_task_id'),
+                    'status' : VideoStatus.PROCESSED.value,
+                })
+                await asyncio.to_thread(delete_files_from_s3, [s3_url])
+            else:
+                document.update({
+                    's3_url' : s3_url,
+                    'status' : VideoStatus.PROCESSING.value,
+                    'dispatch' : new_dispatch_record(),
+                })
+            documents.append(document)
+            result.update({'task_id' : str(task_id), 'status' : ErrorAndSuccessCodes.SUCCESS})
+
+        if documents:
+            mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+            try:
+                await mongo.insert_many(documents)
+            except Exception as e:
+                logger.error(f"Error while creating Batch Tasks : {e}")
+                documents = await discard_uninserted_batch_uploads(input, documents)
+                task_ids = {str(document.get('_id')) for document in documents}
+                for result in results:
+                    if result.get('task_id') and result.get('task_id') not in task_ids:
+                        result.update({'task_id' : None, 'status' : ErrorAndSuccessCodes.PROCESSING_ERROR})
+            if documents:
+                task_dispatcher.notify()
+
+        queued = len([d for d in documents if d.get('status') == VideoStatus.PROCESSING.value])
+        logger.info(f"Batch Upload : {len(documents)} of {len(results)} files accepted, {queued} queued")
+        return {
+            'tasks' : results,
+            'status' : ErrorAndSuccessCodes.SUCCESS
+        }
+    except Exception as e:
+        logger.error(f"Error while processing Video Batch : {e}")
+        return {
+            'tasks' : [],
+            'status' : ErrorAndSuccessCodes.PROCESSING_ERROR
+        }
+
+'''
+    Insert of the batch failed, an ordered insert may have stopped midway : the inserted tasks stand, the files of the others
+    are undone (upload deleted from S3, content cache reference released, quota given back)
+    Returns the inserted documents
+'''
+async def discard_uninserted_batch_uploads(input, documents : List[dict]) -> List[dict]:
+    mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+    inserted = await mongo.find({'_id' : {'$in' : [document.get('_id') for document in documents]}}, len(documents), {'_id' : 1})
+    inserted_ids = {document.get('_id') for document in inserted}
+    discarded = [document for document in documents if document.get('_id') not in inserted_ids]
+
+    await asyncio.to_thread(delete_files_from_s3, [document.get('s3_url') for document in discarded if document.get('s3_url')])
+    for document in discarded:
+        if document.get('deduplicated_from'):
+            await release_processed_outputs(document.get('content_hash'), input.get('profile'), input.get('encoding_profile'))
+    await refund_rate_limit(input.get('user_id'), len(discarded))
+    logger.info(f"Batch Uploads Discarded : {len(discarded)} of {len(documents)}")
+    return [document for document in documents if document.get('_id') in inserted_ids]
+
+async def register_video_batch(input) -> dict:
+    """
+    Batch upload of videos already in the upload bucket (S3 references), e.g. copied there by an ingestion job.
+    The referenced object becomes the source of its task (deleted with the task, like an uploaded file).
+    
+    Args:
+        input ({user_id : str, profile : str, encoding_profile : str, videos : [{s3_key : str, content_type : str}]})
+    
+    Processing Steps : 
+    1. Validates Processing / Encoding Profile, batch size and the file type of every reference
+    2. Consumes the batch size of the rate limits in one call, the whole batch is accepted or rejected
+    3. Creates the task records with one insert_many (status SAVED)
+    4. Verifies every object with concurrent HEAD requests (exists, content type)
+    5. Updates the status of the batch with one bulk_write (PROCESSING with the dispatch record, FAILED when the verification failed)
+    6. The task dispatcher publishes the verified tasks to Celery in the background (grouped publishes)
+    
+    Returns:
+        dict: tasks ([{task_id, s3_key, status}]) and status
+    """
+    mongo = None
+    task_ids = []
+
+    try:
+        profile_check = validate_processing_profile(input.get('profile'))
+        if profile_check != ErrorAndSuccessCodes.SUCCESS:
+            return {'tasks' : [], 'status': profile_check}
+
+        encoding_profile_check = validate_encoding_profile(input.get('encoding_profile'))
+        if encoding_profile_check != ErrorAndSuccessCodes.SUCCESS:
+            return {'tasks' : [], 'status': encoding_profile_check}
+
+        videos = input.get('videos') or []
+        batch_size_check = validate_batch_size(len(videos))
+        if batch_size_check != ErrorAndSuccessCodes.SUCCESS:
+            return {'tasks' : [], 'status': batch_size_check}
+
+        for video in videos:
+            file_type_check = validate_file_type(video.get('content_type'))
+            if file_type_check != ErrorAndSuccessCodes.SUCCESS:
+                return {'tasks' : [], 'status': file_type_check}
+
+        rate_limit_check = await validate_rate_limit(input.get('user_id'), len(videos))
+        logger.info(f"Rate Limit Check : {rate_limit_check.value}, Batch of {len(videos)}")
+        if rate_limit_check != ErrorAndSuccessCodes.SUCCESS:
+            return {'tasks' : [], 'status': rate_limit_check}
+
+        mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+        task_ids = await mongo.insert_many([
+            {
+                'user_id': input.get('user_id'),
+                'profile': input.get('profile'),
+                'encoding_profile': input.get('encoding_profile'),
+                'status': VideoStatus.SAVED.value,
+                'created_at': datetime.now(),
+                'updated_at': datetime.now(),
+            }
+            for _ in videos
+        ])
+
+        uploaded_objects = await head_objects([video.get('s3_key') for video in videos])
+
+        results = []
+        updates = []
+        verified_task_ids = []
+        for task_id, video in zip(task_ids, videos):
+            uploaded_object = uploaded_objects.get(video.get('s3_key'))
+            if not uploaded_object or uploaded_object.get('content_type') != video.get('content_type'):
+                logger.error(f"Batch Reference Verification Failed : {task_id}, {video.get('s3_key')}, {uploaded_object}")
+                updates.append(({"_id" : ObjectId(task_id)}, {'status' : VideoStatus.FAILED.value, 'updated_at' : datetime.now()}))
+                results.append({'task_id' : task_id, 's3_key' : video.get('s3_key'), 'status' : ErrorAndSuccessCodes.UPLOAD_VERIFICATION_FAILED})
+                continue
+            updates.append((
+                {"_id" : ObjectId(task_id)},
+                {
+                    's3_url' : uploaded_object.get('s3_url'),
+                    'status' : VideoStatus.PROCESSING.value,
+                    'dispatch' : new_dispatch_record(),
+                    'updated_at' : datetime.now()
+                }
+            ))
+            verified_task_ids.append(task_id)
+            results.append({'task_id' : task_id, 's3_key' : video.get('s3_key'), 'status' : ErrorAndSuccessCodes.SUCCESS})
+
+        await mongo.bulk_update(updates)
+        if verified_task_ids:
+            task_dispatcher.notify()
+
+        logger.info(f"Batch Registration : {len(verified_task_ids)} of {len(videos)} references queued")
+        return {
+            'tasks' : results,
+            'status' : ErrorAndSuccessCodes.SUCCESS
+        }
+    except Exception as e:
+        logger.error(f"Error while registering Video Batch : {e}")
+        if mongo and task_ids:
+            await mongo.bulk_update([
+                ({"_id" : ObjectId(task_id)}, {'status' : VideoStatus.FAILED.value, 'updated_at' : datetime.now()})
+                for task_id in task_ids
+            ])
+        return {
+            'tasks' : [],
+            'status' : ErrorAndSuccessCodes.PROCESSING_ERROR
+        }
+
+TASK_LIST_PROJECTION = {
+    'status' : 1,
+    'created_at' : 1,
+    'thumbnail' : 1,
+    'output_video' : 1,
+    'profile' : 1,
+    'encoding_profile' : 1,
+    'hls_manifest' : 1,
+    'dash_manifest' : 1,
+}
+
+TASK_DETAIL_FIELDS = {
+    'thumbnail' : 'thumbnail',
+    'progress' : 'status',
+}
+# Returned next to the detail, per type
+TASK_DETAIL_EXTRA_FIELDS = {
+    'thumbnail' : ['thumbnails', 'sprite_sheet'],
+}
+
+# Task document kept in the task cache, everything the task / detail / status lookups return
+TASK_CACHE_PROJECTION = {
+    **TASK_LIST_PROJECTION,
+    'user_id' : 1,
+    'updated_at' : 1,
+    'thumbnails' : 1,
+    'sprite_sheet' : 1,
+}
+
+'''
+    Loader of the task cache, the misses of a lookup are read with a single $in query
+'''
+async def load_tasks(task_ids : List[str]) -> Dict[str, dict]:
+    object_ids = [ObjectId(task_id) for task_id in task_ids if ObjectId.is_valid(task_id)]
+    if not object_ids:
+        return {}
+    mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+    tasks = await mongo.find({"_id" : {"$in" : object_ids}}, len(object_ids), TASK_CACHE_PROJECTION)
+    return {str(task.get('_id')) : task for task in tasks}
+
+async def get_tasks(user_id, task_id, limit : int = 20, after : Optional[str] = None) -> dict: 
+    """
+    Fetches a page of tasks of a user, newest first.
+    A single task (task_id) is read through the task cache, pages are always read from the database (every upload changes them)
+    
+    Args:
+        after : task_id of the last task of the previous page (returned as next_cursor), INVALID_INPUT when it is not a task of the user
+    
+    Returns:
+        dict: tasks (List[TaskList]), next_cursor (None on the last page), terminal (the single task is processed / failed) and status
+    """
     try:
         query = {"user_id" : user_id}
-        if task_id:
-            query["_id"] = ObjectId(task_id)
         mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
-        tasks = await mongo.find(query)
+        if task_id:
+            task = await task_cache.get(task_id, load_tasks)
+            tasks = [task] if task and task.get('user_id') == user_id else []
+        else:
+            after_task = None
+            if after:
+                if ObjectId.is_valid(after):
+                    after_task = await mongo.find_one({"_id" : ObjectId(after), "user_id" : user_id}, {'created_at' : 1})
+                # A cursor which matches no task would restart from the first page
+                if not after_task:
+                    logger.info(f"Invalid Cursor User Id : {user_id}, After : {after}")
+                    return {'tasks' : [], 'next_cursor' : None, 'terminal' : False, 'status' : ErrorAndSuccessCodes.INVALID_INPUT}
+            # One extra document tells if there is a next page
+            tasks = await mongo.find_page(query, 'created_at', limit + 1, after_task, TASK_LIST_PROJECTION)
 
         if not tasks or len(tasks) == 0:
             logger.info(f"No Tasks Found User Id : {user_id}")
-            return []
+            return {'tasks' : [], 'next_cursor' : None, 'terminal' : False, 'status' : ErrorAndSuccessCodes.SUCCESS}
         
+        next_cursor = None
+        if len(tasks) > limit:
+            tasks = tasks[:limit]
+            next_cursor = str(tasks[-1].get('_id'))
+
         res : List[TaskList] = []
         for v in tasks:
             task : TaskList = {
+                'task_id' : str(v.get('_id')),
                 'status' : v.get('status'),
+                'created_at' : v.get('created_at'),
                 'thumbnail' : v.get('thumbnail'),
                 'output' : v.get('output_video'),
+                'profile' : v.get('profile'),
+                'encoding_profile' : v.get('encoding_profile'),
+                'hls_manifest' : v.get('hls_manifest'),
+                'dash_manifest' : v.get('dash_manifest'),
             }
             res.append(task)
-        return res
+        return {'tasks' : res, 'next_cursor' : next_cursor, 'terminal' : bool(task_id) and is_terminal(tasks[0]), 'status' : ErrorAndSuccessCodes.SUCCESS}
     except Exception as e:
         logger.error(f"Error while fetching task : {e}, USER ID: {user_id}, TASK ID: {task_id}")
-        return []
+        return {'tasks' : [], 'next_cursor' : None, 'terminal' : False, 'status' : ErrorAndSuccessCodes.PROCESSING_ERROR}
     
-async def get_task_details(task_id : str, type : str) -> str: 
+async def get_task_details(task_id : str, type : str) -> dict: 
+    """
+    Read through the task cache.
+    
+    Returns:
+        dict: {detail : str, ...TASK_DETAIL_EXTRA_FIELDS of the type} (thumbnail : thumbnails, sprite_sheet) and terminal (task processed / failed)
+    """
     try:
-        query = {"_id" : ObjectId(task_id)}
-        mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
-        task = await mongo.find_one(query)
+        field = TASK_DETAIL_FIELDS.get(type)
+        if not field:
+            return {'detail' : "", 'terminal' : False}
+
+        extra_fields = TASK_DETAIL_EXTRA_FIELDS.get(type, [])
+        task = await task_cache.get(task_id, load_tasks)
 
         if not task:
             logger.info(f"No Tasks Found Task Id : {task_id}")
-            return ""
+            return {'detail' : "", 'terminal' : False}
         
-        if type == "thumbnail":
-            return task.get('thumbnail') or ""
-        elif type == "progress":
-            return task.get('status') or ""
-        else:
-            return ""
+        return {
+            'detail' : task.get(field) or "",
+            **{f : task.get(f) for f in extra_fields},
+            'terminal' : is_terminal(task)
+        }
     except Exception as e:
         logger.error(f"Error while fetching task details : {e}, TASK ID: {task_id}")
-        return ""
+        return {'detail' : "", 'terminal' : False}
+
+async def get_tasks_status(task_ids : List[str]) -> dict:
+    """
+    Status of many tasks, read through the task cache, the misses with a single $in query on _id.
     
+    Returns:
+        dict: tasks ([{task_id, status, updated_at}] in the requested order, status is None for unknown / invalid task_ids) and status
+    """
+    try:
+        batch_size_check = validate_batch_size(len(task_ids))
+        if batch_size_check != ErrorAndSuccessCodes.SUCCESS:
+            return {'tasks' : [], 'status' : batch_size_check}
+
+        tasks = await task_cache.get_many(task_ids, load_tasks)
+        return {
+            'tasks' : [
+                {
+                    'task_id' : task_id,
+                    'status' : tasks.get(task_id, {}).get('status'),
+                    'updated_at' : tasks.get(task_id, {}).get('updated_at'),
+                }
+                for task_id in task_ids
+            ],
+            'status' : ErrorAndSuccessCodes.SUCCESS
+        }
+    except Exception as e:
+        logger.error(f"Error while fetching tasks status : {e}, TASKS: {len(task_ids)}")
+        return {'tasks' : [], 'status' : ErrorAndSuccessCodes.PROCESSING_ERROR}
+
+'''
+    Outputs served by the output endpoint, first segment of the output path :
+        video               : the mp4 output
+        thumbnail           : the primary thumbnail
+        thumbnails/<file>   : thumbnail set, sprite sheet and its WebVTT index
+        package/<file>      : HLS / DASH package (master.m3u8, manifest.mpd, renditions and segments)
+    Resolved from the URLs stored on the task, so deduplicated tasks serve the outputs they share with the original upload
+'''
+def get_output_prefix(s3_url : Optional[str]) -> Optional[str]:
+    return s3_url.rsplit("/", 1)[0] if s3_url else None
+
+async def get_task_output_key(task_id : str, output_path : str) -> dict:
+    """
+    Returns:
+        dict: s3_key of the output and status (TASK_NOT_FOUND, OUTPUT_NOT_FOUND)
+    """
+    try:
+        task = await task_cache.get(task_id, load_tasks)
+        if not task:
+            return {'status' : ErrorAndSuccessCodes.TASK_NOT_FOUND}
+
+        output, _, file_path = output_path.partition("/")
+        if file_path and any(part in ("", ".", "..") for part in file_path.split("/")):
+            return {'status' : ErrorAndSuccessCodes.INVALID_INPUT}
+
+        s3_url = None
+        if output == "video" and not file_path:
+            s3_url = task.get('output_video')
+        elif output == "thumbnail" and not file_path:
+            s3_url = task.get('thumbnail')
+        elif output == "thumbnails" and file_path:
+            thumbnails_prefix = get_output_prefix((task.get('sprite_sheet') or {}).get('image') or next(iter(task.get('thumbnails') or []), None))
+            s3_url = f"{thumbnails_prefix}/{file_path}" if thumbnails_prefix else None
+        elif output == "package" and file_path:
+            package_prefix = get_output_prefix(task.get('hls_manifest'))
+            s3_url = f"{package_prefix}/{file_path}" if package_prefix else None
+
+        if not s3_url:
+            return {'status' : ErrorAndSuccessCodes.OUTPUT_NOT_FOUND}
+        return {
+            's3_key' : get_s3_key_from_url(s3_url),
+            'status' : ErrorAndSuccessCodes.SUCCESS
+        }
+    except Exception as e:
+        logger.error(f"Error while resolving task output : {e}, TASK ID: {task_id}, OUTPUT: {output_path}")
+        return {'status' : ErrorAndSuccessCodes.PROCESSING_ERROR}
+
+
+async def stream_task_progress(task_id : str, is_disconnected) -> AsyncIterator[str]:
+    """
+    Server-Sent Events of the task progress, published by the worker over Redis pub/sub.
+    
+    1. Subscribes to the task channel (before reading the snapshot, so no update is missed)
+    2. Sends the latest snapshot from Redis, falls back to the task status in the database when there is none
+    3. Forwards every update until the task is processed / failed or the client disconnects
+    """
+    key = TASK_PROGRESS_KEY.format(task_id=task_id)
+    client = await redis_connection.get_client()
+    pubsub = client.pubsub()
+    await pubsub.subscribe(key)
+    try:
+        snapshot = {field : json.loads(value) for field, value in (await client.hgetall(key)).items()}
+        if not snapshot:
+            mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+            task = await mongo.find_one({"_id" : ObjectId(task_id)}, {'status' : 1})
+            if not task:
+                yield format_server_sent_event("error", {'task_id' : task_id, 'error' : 'task not found'})
+                return
+            stage = {
+                VideoStatus.PROCESSED.value : ProcessingStage.PROCESSED.value,
+                VideoStatus.FAILED.value : ProcessingStage.FAILED.value,
+            }.get(task.get('status'), ProcessingStage.QUEUED.value)
+            snapshot = {'task_id' : task_id, 'stage' : stage, 'progress' : None}
+
+        yield format_server_sent_event("progress", snapshot)
+        if snapshot.get('stage') in TERMINAL_STAGES:
+            return
+
+        while not await is_disconnected():
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=SSE_KEEP_ALIVE_SECONDS)
+            if not message:
+                # Comment line, keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+                continue
+            event = json.loads(message.get('data'))
+            yield format_server_sent_event("progress", event)
+            if event.get('stage') in TERMINAL_STAGES:
+                return
+    finally:
+        await pubsub.unsubscribe(key)
+        await pubsub.close()
+
+def format_server_sent_event(event : str, data : dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def delete_task(user_id : str, task_id : str) -> ErrorAndSuccessCodes:
+    """
+    Deletes a task, its source file and its reference on the processed outputs.
+    Shared (deduplicated) outputs are only deleted from S3 with the last reference.
+    """
+    try:
+        mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+        task = await mongo.find_one({"_id" : ObjectId(task_id), "user_id" : user_id})
+        if not task:
+            logger.info(f"No Tasks Found Task Id : {task_id}, USER ID: {user_id}")
+            return ErrorAndSuccessCodes.TASK_NOT_FOUND
+        if task.get('status') in [VideoStatus.SAVED.value, VideoStatus.PROCESSING.value]:
+            return ErrorAndSuccessCodes.FILE_UNDER_PROCESSING
+
+        await mongo.delete_one({"_id" : ObjectId(task_id)})
+        await task_cache.invalidate(task_id)
+        await asyncio.to_thread(delete_files_from_s3, [task.get('s3_url')])
+        if task.get('content_hash') and task.get('status') == VideoStatus.PROCESSED.value:
+            await release_processed_outputs(task.get('content_hash'), task.get('profile'), task.get('encoding_profile'))
+        else:
+            # Not in the content cache (direct uploads, failed tasks), the outputs belong to this task only
+            await asyncio.to_thread(delete_outputs_from_s3, task)
+        return ErrorAndSuccessCodes.SUCCESS
+    except Exception as e:
+        logger.error(f"Error while deleting task : {e}, TASK ID: {task_id}")
+        return ErrorAndSuccessCodes.PROCESSING_ERROR
+
+async def get_queue_analytics() -> dict:
+    """
+    Queue depth and estimated wait of new uploads, the signal an autoscaler of the encode workers scales on.
+    Computed from the broker (messages per queue), MongoDB (tasks in processing) and the capacity reports of the worker nodes.
     
+    Estimate :
+    1. Backlog : media seconds of the processing tasks which need an encode (stream copies excluded),
+       tasks not probed yet count with the average duration of the probed ones
+    2. Throughput : encode slots of the live nodes consuming the transcode queue * ESTIMATED_ENCODE_SPEED
+    3. Estimated wait = backlog / throughput (None without any encode node)
+       Recommended encode slots = slots needed to drain the backlog within QUEUE_TARGET_WAIT_SECONDS
     
+    Returns:
+        dict: queues, tasks, nodes, estimate and status
+    """
+    try:
+        mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
+        # Served by the status_updated_at index
+        totals = await mongo.aggregate([
+            {'$match' : {'status' : VideoStatus.PROCESSING.value}},
+            {'$group' : {
+                '_id' : None,
+                'processing' : {'$sum' : 1},
+                'pending_dispatch' : {'$sum' : {'$cond' : [{'$eq' : ['$dispatch.state', DispatchState.PENDING.value]}, 1, 0]}},
+                'probed' : {'$sum' : {'$cond' : [{'$gt' : ['$source_metadata.duration', 0]}, 1, 0]}},
+                'probed_media_seconds' : {'$sum' : {'$ifNull' : ['$source_metadata.duration', 0]}},
+                'encode_media_seconds' : {'$sum' : {'$cond' : [
+                    {'$ne' : ['$processing_mode', ProcessingMode.REMUX.value]},
+                    {'$ifNull' : ['$source_metadata.duration', 0]},
+                    0
+                ]}},
+            }},
+        ], 1)
+        totals = totals[0] if totals else {}
+
+        queue_depths = await get_queue_depths()
+        nodes = await get_node_capacities()
+
+        processing = totals.get('processing', 0)
+        probed = totals.get('probed', 0)
+        average_duration = totals.get('probed_media_seconds', 0) / probed if probed else 0
+        backlog_media_seconds = totals.get('encode_media_seconds', 0) + (processing - probed) * average_duration
+
+        encode_nodes = [node for node in nodes if TaskQueue.TRANSCODE.value in node.get('queues', [])]
+        encode_slots = sum(node.get('encode_slots', 0) for node in encode_nodes)
+        throughput = encode_slots * settings.ESTIMATED_ENCODE_SPEED
+        return {
+            'queues' : queue_depths,
+            'tasks' : {
+                'processing' : processing,
+                'pending_dispatch' : totals.get('pending_dispatch', 0),
+                'not_probed' : processing - probed,
+            },
+            'nodes' : nodes,
+            'estimate' : {
+                'backlog_media_seconds' : round(backlog_media_seconds, 1),
+                'in_flight_encode_seconds' : round(sum(node.get('in_flight_encode_seconds', 0) for node in encode_nodes), 1),
+                'encode_nodes' : len(encode_nodes),
+                'encode_slots' : encode_slots,
+                'estimated_wait_seconds' : round(backlog_media_seconds / throughput, 1) if throughput else None,
+                'recommended_encode_slots' : math.ceil(backlog_media_seconds / (settings.ESTIMATED_ENCODE_SPEED * settings.QUEUE_TARGET_WAIT_SECONDS)),
+                'scratch_available_bytes' : sum(node.get('scratch_free_bytes', 0) - node.get('scratch_reserved_bytes', 0) for node in encode_nodes),
+            },
+            'status' : ErrorAndSuccessCodes.SUCCESS
+        }
+    except Exception as e:
+        logger.error(f"Error while fetching Queue Analytics : {e}")
+        return {'status' : ErrorAndSuccessCodes.PROCESSING_ERROR}
@@ -1,12 +1,19 @@
 from app.core.config import settings
 from app.utils.logger import get_logger
-from app.utils.db_connect import mongodb
-from app.core.celery_core import process_video_inside_task_queue
+from app.core.worker_loop import worker_loop
+from app.core.checkpoints import sweep_scratch_dir, claim_stage
+from app.core.admission import get_stage_requirement, admit_stage, release_stage, start_capacity_reporter, AdmissionDeferred, AdmissionRejected
+from app.utils.metrics import reset_multiprocess_dir, start_worker_metrics_server, mark_process_dead
+from app.constants.video_constants import ProcessingMode, TaskQueue, AdmissionDecision, TASK_PRIORITY_BY_DURATION, LOWEST_TASK_PRIORITY
+from app.core.celery_core import probe_video_inside_task_queue, transcode_video_inside_task_queue, extract_thumbnail_inside_task_queue, encode_ladder_inside_task_queue, finalize_video_inside_task_queue, split_video_inside_task_queue, transcode_segment_inside_task_queue, concat_segments_inside_task_queue, mark_video_task_failed
 
-from celery import Celery
+from celery import Celery, Task, chord
+from celery.exceptions import Ignore
 from celery.result import AsyncResult
-from celery.signals import worker_process_init
-import asyncio
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown, worker_shutdown, worker_ready
+from kombu import Queue
+from typing import Optional
+import os
 
 logger = get_logger("worker")
 
@@ -16,39 +23,252 @@ celery = Celery(
     backend=settings.BACKEND_URL
 )
 
-logger.info("Starting DB Connection in Celery Tasks")
+celery.conf.update(
+    worker_pool=settings.WORKER_POOL,
+    worker_concurrency=settings.WORKER_CONCURRENCY,
+    worker_prefetch_multiplier=1,    # Long running tasks, do not reserve tasks an idle worker could pick up
+
+    # One queue per kind of work, so a short remux never waits behind long encodes
+    # Workers are started per queue with their own concurrency / prefetch (see docker-compose.yml), a worker started without -Q consumes every queue
+    task_queues=[Queue(queue.value) for queue in TaskQueue],
+    task_default_queue=TaskQueue.PROBE.value,
+    task_routes={
+        'app.core.worker.process_video_task': {'queue': TaskQueue.PROBE.value},
+        'app.core.worker.transcode_video_task': {'queue': TaskQueue.TRANSCODE.value},   # remux is re-routed to the remux queue on dispatch
+        'app.core.worker.encode_ladder_task': {'queue': TaskQueue.TRANSCODE.value},
+        'app.core.worker.transcode_segment_task': {'queue': TaskQueue.TRANSCODE.value},
+        'app.core.worker.split_video_task': {'queue': TaskQueue.REMUX.value},
+        'app.core.worker.concat_segments_task': {'queue': TaskQueue.REMUX.value},
+        'app.core.worker.extract_thumbnail_task': {'queue': TaskQueue.THUMBNAIL.value},
+        'app.core.worker.finalize_video_task': {'queue': TaskQueue.FINALIZE.value},
+        'app.core.worker.processing_failed_task': {'queue': TaskQueue.FINALIZE.value},
+    },
+
+    # Priorities on the Redis broker : priority_steps splits every queue into priority levels, 0 is consumed first
+    # queue_order_strategy only orders the queues of a worker consuming several of them : round robin, so a worker started
+    # without -Q does not drain the probe queue before it gets to the finalize queue ('priority' would be strict declared order)
+    broker_transport_options={
+        'queue_order_strategy': 'round_robin',
+        'priority_steps': list(range(LOWEST_TASK_PRIORITY + 1)),
+        'sep': ':',
+    },
+    task_default_priority=LOWEST_TASK_PRIORITY
+)
+
 '''
-    Used To Connect Mongo in Celery Tasks
+    Used To Connect Mongo and S3 in Celery Tasks
     Celery is Synchronous by default and therefore has to use asyncio
     In FastAPI the async-await uses asyncio under the hood, but is managed by uvicorn
 
-    Will be called when Celery App is started
+    Every worker process runs a single long-lived event loop (see worker_loop.py), started when the process starts
+    For the thread pool there is no process init, the loop is started by the first task instead
 '''
 @worker_process_init.connect
 def init_worker(**kwargs):
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(mongodb.connect())
-logger.info("DB Connected in Celery Tasks")
+    worker_loop.start()
+
+'''
+    Scratch directories of tasks abandoned by a previous run of this worker (kept for retries)
+'''
+@worker_ready.connect
+def sweep_scratch(**kwargs):
+    sweep_scratch_dir()
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def shutdown_worker(**kwargs):
+    worker_loop.stop()
+
+'''
+    Prometheus Metrics (see metrics.py), samples of the pool processes are merged by the main process' HTTP server
+    The multiprocess directory is cleared before the pool starts
+'''
+@worker_init.connect
+def init_worker_metrics(**kwargs):
+    reset_multiprocess_dir()
+
+@worker_ready.connect
+def serve_worker_metrics(**kwargs):
+    start_worker_metrics_server()
+
+@worker_process_shutdown.connect
+def remove_worker_process_metrics(**kwargs):
+    mark_process_dead(os.getpid())
+
+'''
+    Node capacity (scratch disk, CPU, memory, in-flight encode seconds) reported by the main process (see admission.py)
+    Encode slots : encodes running at once on the node, WORKER_ENCODE_CONCURRENCY per pool process
+'''
+@worker_ready.connect
+def report_worker_capacity(sender=None, **kwargs):
+    queues = sender.app.amqp.queues.consume_from or sender.app.amqp.queues
+    processes = settings.WORKER_CONCURRENCY if settings.WORKER_POOL == "prefork" else 1
+    start_capacity_reporter(sorted(queues), settings.WORKER_ENCODE_CONCURRENCY * processes)
+
+'''
+    Runs a coroutine on the worker's event loop
+'''
+def run_in_event_loop(coroutine_fn, *args):
+    return worker_loop.run(coroutine_fn, *args)
+
+'''
+    Base of every stage task
+    Any error is retried with exponential backoff (+ jitter), the retry resumes from the stage's last checkpoint
+    The errback (processing_failed_task) only runs once the retries are exhausted
+    Every stage carries the dispatch_id of the outbox record it was published for (see task_dispatcher.py) : a stage of a
+    superseded dispatch (task re-enqueued by the sweeper) is ignored before it does any work, so two runs of a task never
+    race on its outputs, a current stage refreshes updated_at of the task (heartbeat)
+    task_id is the first positional argument of a stage, or a keyword argument for chord callbacks
+'''
+class StageTask(Task):
+    autoretry_for = (Exception,)
+    max_retries = settings.TASK_MAX_RETRIES
+    retry_backoff = settings.TASK_RETRY_BACKOFF
+    retry_backoff_max = settings.TASK_RETRY_BACKOFF_MAX
+    retry_jitter = True
+
+    def claim(self, args, kwargs) -> str:
+        task_id = kwargs.get('task_id') or args[0]
+        if not run_in_event_loop(claim_stage, task_id, kwargs.get('dispatch_id')):
+            logger.info(f"Dispatch Superseded, Stage Skipped : {self.name}, {task_id}, {kwargs.get('dispatch_id')}")
+            raise Ignore()
+        return task_id
+
+    def __call__(self, *args, **kwargs):
+        self.claim(args, kwargs)
+        return self.run(*args, **kwargs)
+
+'''
+    Stage which needs the resources of the node it runs on, admitted before it runs (see admission.py)
+        encodes        : holds an encode for the probed duration (stream copies never do)
+        streams_source : reads / writes S3 through pipes in streaming mode, no scratch space
+    Checked in __call__, outside of the autoretry : a rejection fails the task right away, a deferral is a retry with a
+    countdown (the stage keeps its task id, chords still complete), deferrals count against the retries of the stage,
+    ADMISSION_MAX_DEFERS on top of them
+'''
+class AdmittedStageTask(StageTask):
+    encodes = True
+    streams_source = False
 
+    def __call__(self, *args, **kwargs):
+        task_id = self.claim(args, kwargs)
+        if not settings.ADMISSION_CONTROL:
+            return self.run(*args, **kwargs)
+
+        requirement = run_in_event_loop(get_stage_requirement, task_id, self.encodes, self.streams_source and settings.STREAMING_PROCESSING)
+        decision, reason = admit_stage(task_id, requirement)
+        if decision == AdmissionDecision.REJECTED:
+            raise AdmissionRejected(f"Task {task_id} does not fit the node ({reason}) : {requirement}")
+        if decision == AdmissionDecision.DEFERRED:
+            raise self.retry(
+                exc=AdmissionDeferred(f"Task {task_id} deferred ({reason}) : {requirement}"),
+                countdown=settings.ADMISSION_DEFER_SECONDS,
+                max_retries=self.max_retries + settings.ADMISSION_MAX_DEFERS
+            )
+        try:
+            return self.run(*args, **kwargs)
+        finally:
+            release_stage(task_id)
+
+'''
+    Probe stage, entry point of the pipeline
+    Builds the remaining stages from the probe, every stage of the task gets a priority from the probed duration
+    so short videos overtake long encodes waiting in the same queue
+    Published by the task dispatcher (see task_dispatcher.py), dispatch_id identifies the outbox record of the message
+    and is passed on to every stage of the task
+'''
+@celery.task(base=StageTask)
+def process_video_task(task_id : str, dispatch_id : Optional[str] = None):
+    plan = run_in_event_loop(probe_video_inside_task_queue, task_id)
+    if not plan:
+        return None
+
+    processing_mode = ProcessingMode(plan.get('processing_mode'))
+    priority = get_task_priority(plan.get('duration'))
+    on_failure = processing_failed_task.s(task_id, dispatch_id=dispatch_id).set(priority=priority)
+    logger.info(f"Dispatching Stages : {task_id}, Mode : {processing_mode.value}, Priority : {priority}")
+
+    if processing_mode == ProcessingMode.SEGMENTED_TRANSCODE:
+        split_video_task.si(task_id, priority, dispatch_id=dispatch_id).set(priority=priority).on_error(on_failure).delay()
+        return processing_mode.value
+
+    if processing_mode == ProcessingMode.ADAPTIVE_LADDER:
+        video_stage = encode_ladder_task.si(task_id, dispatch_id=dispatch_id)
+    else:
+        # Stream copies go to the remux queue, they never wait behind encodes
+        queue = TaskQueue.REMUX if processing_mode == ProcessingMode.REMUX else TaskQueue.TRANSCODE
+        video_stage = transcode_video_task.si(task_id, processing_mode.value, dispatch_id=dispatch_id).set(queue=queue.value)
+
+    header = [
+        video_stage.set(priority=priority),
+        extract_thumbnail_task.si(task_id, dispatch_id=dispatch_id).set(priority=priority)
+    ]
+    chord(header)(finalize_video_task.s(task_id=task_id, dispatch_id=dispatch_id).set(priority=priority).on_error(on_failure))
+    return processing_mode.value
+
+def get_task_priority(duration : Optional[float]) -> int:
+    for max_duration, priority in TASK_PRIORITY_BY_DURATION:
+        if duration is not None and duration <= max_duration:
+            return priority
+    return LOWEST_TASK_PRIORITY
+
+@celery.task(base=AdmittedStageTask, streams_source=True)
+def transcode_video_task(task_id : str, processing_mode : str, dispatch_id : Optional[str] = None):
+    return run_in_event_loop(transcode_video_inside_task_queue, task_id, processing_mode)
+
+@celery.task(base=StageTask)
+def extract_thumbnail_task(task_id : str, dispatch_id : Optional[str] = None):
+    return run_in_event_loop(extract_thumbnail_inside_task_queue, task_id)
+
+@celery.task(base=AdmittedStageTask)
+def encode_ladder_task(task_id : str, dispatch_id : Optional[str] = None):
+    return run_in_event_loop(encode_ladder_inside_task_queue, task_id)
+
+'''
+    Chord callback, receives the outputs of the video and thumbnail stages
+'''
+@celery.task(base=StageTask)
+def finalize_video_task(stage_outputs, task_id : str, dispatch_id : Optional[str] = None):
+    return run_in_event_loop(finalize_video_inside_task_queue, task_id, stage_outputs)
+
+'''
+    Long videos are split into segments
+    Fan out one subtask per segment, concat once all of them are encoded, then finalize
+'''
+@celery.task(base=AdmittedStageTask, encodes=False)
+def split_video_task(task_id : str, priority : int, dispatch_id : Optional[str] = None):
+    result = run_in_event_loop(split_video_inside_task_queue, task_id)
+    logger.info(f"Dispatching Segmented Transcode : {task_id}, Segments : {len(result.get('segments'))}")
+
+    on_failure = processing_failed_task.s(task_id, dispatch_id=dispatch_id).set(priority=priority)
+    header = [transcode_segment_task.si(task_id, segment_s3_url, dispatch_id=dispatch_id).set(priority=priority) for segment_s3_url in result.get('segments')]
+    callback = concat_segments_task.s(task_id=task_id, segment_s3_urls=result.get('segments'), audio_s3_url=result.get('audio'), dispatch_id=dispatch_id).set(priority=priority)
+    callback.link(finalize_video_task.s(task_id=task_id, dispatch_id=dispatch_id).set(priority=priority).on_error(on_failure))
+    chord(header)(callback.on_error(on_failure))
+    return len(header)
+
+@celery.task(base=StageTask)
+def transcode_segment_task(task_id : str, segment_s3_url : str, dispatch_id : Optional[str] = None):
+    return run_in_event_loop(transcode_segment_inside_task_queue, task_id, segment_s3_url)
+
+'''
+    Chord callback, receives the encoded segment URLs in segment order
+'''
+@celery.task(base=StageTask)
+def concat_segments_task(encoded_segment_s3_urls, task_id : str, segment_s3_urls, audio_s3_url, dispatch_id : Optional[str] = None):
+    return run_in_event_loop(concat_segments_inside_task_queue, task_id, encoded_segment_s3_urls, segment_s3_urls, audio_s3_url)
+
+'''
+    Errback of every stage, any failed stage fails the task
+    A failure of a superseded dispatch leaves the task to its current dispatch
+'''
 @celery.task
-def process_video_task(task_id : str):
-    async def safe_wrapper():
-        return await process_video_inside_task_queue(task_id)
-
-    try:
-        loop = asyncio.get_event_loop()
-        if loop.is_running():
-            # If already running (e.g., inside a thread, Jupyter), create a new one
-            new_loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(new_loop)
-            return new_loop.run_until_complete(safe_wrapper())
-        else:
-            return loop.run_until_complete(safe_wrapper())
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        return loop.run_until_complete(safe_wrapper())
+def processing_failed_task(request, exc, traceback, task_id : str, dispatch_id : Optional[str] = None):
+    logger.error(f"Video Processing Failed : {task_id}, {exc}")
+    if not run_in_event_loop(claim_stage, task_id, dispatch_id):
+        logger.info(f"Dispatch Superseded, Failure Ignored : {task_id}, {dispatch_id}")
+        return None
+    return run_in_event_loop(mark_video_task_failed, task_id)
 
 '''
     Fetch Status of task
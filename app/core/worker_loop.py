@@ -0,0 +1,60 @@
+from app.core.config import settings
+from app.utils.logger import get_logger
+from app.utils.db_connect import mongodb
+from app.utils.s3_connect import s3
+
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+
+logger = get_logger("worker_loop")
+
+'''
+    One long-lived Event Loop per Worker Process
+    The loop runs in a background thread for the lifetime of the process, Celery tasks hand their coroutine over and wait for the result
+    With the thread pool (WORKER_POOL=threads) several tasks share the loop, so one task downloads / uploads while another one encodes :
+        ffmpeg runs as an asyncio subprocess, S3 transfers run in the loop's executor, neither blocks the loop
+    Mongo (Motor) and S3 are connected once, on this loop, instead of per task
+'''
+class WorkerEventLoop:
+    def __init__(self):
+        self.loop : asyncio.AbstractEventLoop | None = None
+        self.thread : threading.Thread | None = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.loop:
+                return
+            loop = asyncio.new_event_loop()
+            # Blocking calls (boto3 transfers) offloaded via asyncio.to_thread run here, shared by every task of the process
+            loop.set_default_executor(ThreadPoolExecutor(max_workers=settings.WORKER_IO_THREADS, thread_name_prefix="worker-io"))
+            self.thread = threading.Thread(target=loop.run_forever, name="worker-event-loop", daemon=True)
+            self.thread.start()
+            asyncio.run_coroutine_threadsafe(mongodb.connect(), loop).result()
+            s3.connect()
+            self.loop = loop
+            logger.info("Worker Event Loop Started, DB Connected in Celery Tasks")
+
+    '''
+        Runs a coroutine on the worker's event loop, blocks the calling (Celery) thread until it completes
+    '''
+    def run(self, coroutine_fn, *args):
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(coroutine_fn(*args), self.loop)
+        return future.result()
+
+    def stop(self):
+        with self.lock:
+            if not self.loop:
+                return
+            asyncio.run_coroutine_threadsafe(mongodb.close(), self.loop).result()
+            s3.close()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            self.loop = None
+            self.thread = None
+            logger.info("Worker Event Loop Stopped")
+
+worker_loop = WorkerEventLoop()
@@ -1,4 +1,5 @@
 from enum import Enum
 
 class CollectionNames(Enum):
-    VIDEOS = "videos"
\ No newline at end of file
+    VIDEOS = "videos"
+    CONTENT_CACHE = "content_cache"
@@ -16,4 +16,10 @@ class ErrorAndSuccessCodes(Enum):
     FILE_PROCESSING_FAILED = 8
 
     #Error
-    PROCESSING_ERROR = 9
\ No newline at end of file
+    PROCESSING_ERROR = 9
+    TASK_NOT_FOUND = 10
+    UPLOAD_VERIFICATION_FAILED = 11
+    NOT_SUPPORTED_PROFILE = 12
+    NOT_SUPPORTED_ENCODING_PROFILE = 13
+    BATCH_SIZE_EXCEEDED = 14
+    OUTPUT_NOT_FOUND = 15
@@ -1,7 +1,10 @@
 from app.dtos.error_success_code import ErrorAndSuccessCodes
+from app.constants.video_constants import ProcessingProfile
+from app.core.config import settings
 
 from pydantic import BaseModel
 from typing import Optional, List
+from datetime import datetime
 
 
 class VideoProcessingResponse(BaseModel):
@@ -10,17 +13,104 @@ class VideoProcessingResponse(BaseModel):
     task_id: Optional[str] = None
     internal_status_code : Optional[ErrorAndSuccessCodes] = None
 
+class BatchUploadItem(BaseModel):
+    """Result of one file / reference of a batch upload"""
+    task_id : Optional[str] = None
+    file_name : Optional[str] = None
+    s3_key : Optional[str] = None
+    internal_status_code : Optional[ErrorAndSuccessCodes] = None
+
+class BatchUploadResponse(BaseModel):
+    status : str
+    tasks : List[BatchUploadItem] = []
+    internal_status_code : Optional[ErrorAndSuccessCodes] = None
+
+class S3VideoReference(BaseModel):
+    s3_key : str
+    content_type : str
+
+class BatchReferenceUploadRequest(BaseModel):
+    """Batch upload of videos already in the upload bucket"""
+    user_id : str
+    videos : List[S3VideoReference]
+    profile : str = ProcessingProfile.MP4.value
+    encoding_profile : str = settings.DEFAULT_ENCODING_PROFILE
+
 class TaskList(BaseModel):
     """Get Video Tasks"""
+    task_id : Optional[str] = None
     status : str
+    created_at : Optional[datetime] = None
     output: Optional[str] = None
     thumbnail : Optional[str] = None
+    profile : Optional[str] = None
+    encoding_profile : Optional[str] = None
+    hls_manifest : Optional[str] = None
+    dash_manifest : Optional[str] = None
 
 class GetVideoTasksResponse(BaseModel): 
     status : str
     data : List[TaskList]
+    next_cursor : Optional[str] = None
+    internal_status_code : Optional[ErrorAndSuccessCodes] = None
+
+class BulkTaskStatusRequest(BaseModel):
+    task_ids : List[str]
+
+class TaskStatus(BaseModel):
+    """status is None for unknown task_ids"""
+    task_id : str
+    status : Optional[str] = None
+    updated_at : Optional[datetime] = None
+
+class BulkTaskStatusResponse(BaseModel):
+    status : str
+    data : List[TaskStatus] = []
+    internal_status_code : Optional[ErrorAndSuccessCodes] = None
+
+class SpriteSheet(BaseModel):
+    """Scrubbing previews, tiles indexed by a WebVTT file (#xywh media fragments)"""
+    image : str
+    vtt : str
+    interval : int
+    tiles : int
+    columns : int
+    rows : int
+    tile_width : int
+    tile_height : int
 
 class GetTaskDetailsResponse(BaseModel):
     status : str
     detail : Optional[str] = None
+    thumbnails : Optional[List[str]] = None
+    sprite_sheet : Optional[SpriteSheet] = None
+
+class InitiateUploadRequest(BaseModel):
+    """Direct Upload : Step 1"""
+    user_id : str
+    file_name : str
+    content_type : str
+    file_size : int
+    profile : str = ProcessingProfile.MP4.value
+    encoding_profile : str = settings.DEFAULT_ENCODING_PROFILE
+
+class PresignedPart(BaseModel):
+    part_number : int
+    url : str
+
+class InitiateUploadResponse(BaseModel):
+    status : str
+    task_id : Optional[str] = None
+    upload_id : Optional[str] = None
+    part_size : Optional[int] = None
+    parts : List[PresignedPart] = []
+    internal_status_code : Optional[ErrorAndSuccessCodes] = None
+
+class CompletedPart(BaseModel):
+    part_number : int
+    etag : str
 
+class CompleteUploadRequest(BaseModel):
+    """Direct Upload : Step 2"""
+    task_id : str
+    parts : List[CompletedPart]
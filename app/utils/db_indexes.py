@@ -0,0 +1,43 @@
+from app.dtos.collection_names import CollectionNames
+from app.utils.db_query import MongoQueryApplicator
+from app.utils.logger import get_logger
+from app.constants.video_constants import DispatchState
+
+from pymongo import ASCENDING, DESCENDING
+
+logger = get_logger(__name__)
+
+'''
+    Indexes per Collection, created on application start (create_index is a no-op when the index already exists)
+'''
+INDEXES = {
+    CollectionNames.VIDEOS.value : [
+        # Task list of a user, newest first (keyset pagination on created_at, _id)
+        {"keys" : [("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], "name" : "user_id_created_at"},
+        # Tasks by status (e.g. stuck in processing), oldest update first
+        {"keys" : [("status", ASCENDING), ("updated_at", ASCENDING)], "name" : "status_updated_at"},
+        # Outbox of the task dispatcher, oldest first, only the pending records are indexed
+        {"keys" : [("dispatch.state", ASCENDING), ("dispatch.queued_at", ASCENDING)], "name" : "dispatch_pending", "partialFilterExpression" : {"dispatch.state" : DispatchState.PENDING.value}},
+    ],
+    CollectionNames.CONTENT_CACHE.value : [
+        {"keys" : [("content_hash", ASCENDING), ("profile", ASCENDING), ("encoding_profile", ASCENDING)], "name" : "content_hash_profile_encoding_profile", "unique" : True},
+    ],
+}
+
+# Replaced indexes, dropped on application start (a stale unique index would reject valid documents)
+DROPPED_INDEXES = {
+    CollectionNames.CONTENT_CACHE.value : ["content_hash_profile"],
+}
+
+async def create_indexes():
+    for collection_name, index_names in DROPPED_INDEXES.items():
+        mongo = MongoQueryApplicator(collection_name)
+        for index_name in index_names:
+            if await mongo.drop_index(index_name):
+                logger.info(f"Index Dropped : {collection_name}.{index_name}")
+    for collection_name, indexes in INDEXES.items():
+        mongo = MongoQueryApplicator(collection_name)
+        for index in indexes:
+            options = {key : value for key, value in index.items() if key != "keys"}
+            await mongo.create_index(index.get("keys"), **options)
+            logger.info(f"Index Ready : {collection_name}.{index.get('name')}")
@@ -1,31 +1,81 @@
 # services/query_applicator.py
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple, Union
 from app.utils.db_connect import mongodb
 
+from pymongo import ReturnDocument, UpdateOne, DESCENDING
+
 class MongoQueryApplicator:
     def __init__(self, collection_name: str):
         self.collection = mongodb.db[collection_name]
 
-    async def find(self, filters: Optional[Dict[str, Any]] = None, limit: int = 10) -> List[Dict]:
+    async def find(self, filters: Optional[Dict[str, Any]] = None, limit: int = 10, projection: Optional[Dict[str, Any]] = None, sort: Optional[List[Tuple[str, int]]] = None) -> List[Dict]:
         filters = filters or {}
-        cursor = self.collection.find(filters).limit(limit)
+        cursor = self.collection.find(filters, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        cursor = cursor.limit(limit)
         return await cursor.to_list(length=limit)
 
-    async def find_one(self, filters: Dict[str, Any]) -> Optional[Dict]:
-        return await self.collection.find_one(filters)
+    async def find_page(self, filters: Dict[str, Any], sort_field: str, limit: int, after: Optional[Dict] = None, projection: Optional[Dict[str, Any]] = None) -> List[Dict]:
+        '''
+            Keyset (cursor) pagination, newest first on (sort_field, _id)
+            after : last document of the previous page (needs sort_field and _id), no skip / offset scans
+            Backed by an index on (<filters>, sort_field desc, _id desc)
+        '''
+        filters = dict(filters)
+        if after:
+            filters["$or"] = [
+                {sort_field : {"$lt" : after.get(sort_field)}},
+                {sort_field : after.get(sort_field), "_id" : {"$lt" : after.get("_id")}},
+            ]
+        return await self.find(filters, limit, projection, [(sort_field, DESCENDING), ("_id", DESCENDING)])
+
+    async def find_one(self, filters: Dict[str, Any], projection: Optional[Dict[str, Any]] = None) -> Optional[Dict]:
+        return await self.collection.find_one(filters, projection)
 
     async def insert_one(self, document: Dict[str, Any]) -> str:
         result = await self.collection.insert_one(document)
         return str(result.inserted_id)
 
+    async def insert_many(self, documents: List[Dict[str, Any]]) -> List[str]:
+        result = await self.collection.insert_many(documents)
+        return [str(inserted_id) for inserted_id in result.inserted_ids]
+
     async def update_one(self, filters: Dict[str, Any], update_data: Dict[str, Any]) -> int:
         result = await self.collection.update_one(filters, {'$set': update_data})
         return result.modified_count
 
+    async def bulk_update(self, updates: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> int:
+        '''
+            Many update_one in one round trip, one (filters, update_data) per update, unordered (a failed update does not stop the others)
+        '''
+        if not updates:
+            return 0
+        result = await self.collection.bulk_write([UpdateOne(filters, {'$set': update_data}) for filters, update_data in updates], ordered=False)
+        return result.modified_count
+
+    async def find_one_and_update(self, filters: Dict[str, Any], update: Union[Dict[str, Any], List[Dict[str, Any]]], upsert: bool = False) -> Optional[Dict]:
+        '''
+            Atomic update with raw update operators ($inc, $setOnInsert ...) or an update pipeline, returns the document after the update
+        '''
+        return await self.collection.find_one_and_update(filters, update, upsert=upsert, return_document=ReturnDocument.AFTER)
+
     async def delete_one(self, filters: Dict[str, Any]) -> int:
         result = await self.collection.delete_one(filters)
         return result.deleted_count
     
+    async def aggregate(self, pipeline: List[Dict[str, Any]], limit: Optional[int] = None) -> List[Dict]:
+        return await self.collection.aggregate(pipeline).to_list(length=limit)
+
     async def count(self, filters: Optional[Dict[str, Any]] = None) -> int:
         filters = filters or {}
-        return await self.collection.count_documents(filters)
\ No newline at end of file
+        return await self.collection.count_documents(filters)
+
+    async def create_index(self, keys: List[Tuple[str, int]], **kwargs) -> str:
+        return await self.collection.create_index(keys, **kwargs)
+
+    async def drop_index(self, name: str) -> bool:
+        if name not in await self.collection.index_information():
+            return False
+        await self.collection.drop_index(name)
+        return True
\ No newline at end of file
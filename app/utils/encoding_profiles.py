@@ -0,0 +1,118 @@
+from app.core.config import settings
+from app.utils.logger import get_logger
+
+from typing import List, Optional
+import os
+
+logger = get_logger("encoding_profiles")
+
+'''
+    Encoder Presets per codec, slowest first, content-aware selection moves along this list
+    a step moves one preset towards the faster end, libsvtav1 presets are numbers (higher is faster)
+'''
+X26X_PRESETS = ["placebo", "veryslow", "slower", "slow", "medium", "fast", "faster", "veryfast", "superfast", "ultrafast"]
+ENCODER_PRESETS = {
+    "libx264" : X26X_PRESETS,
+    "libx265" : X26X_PRESETS,
+    "libsvtav1" : [str(preset) for preset in range(0, 14)],
+}
+ENCODER_MAX_CRF = {"libx264" : 51, "libx265" : 51, "libsvtav1" : 63}
+
+# Content-aware thresholds, bits per pixel per frame of the source video stream
+LOW_COMPLEXITY_BITS_PER_PIXEL = 0.05
+HIGH_COMPLEXITY_BITS_PER_PIXEL = 0.2
+SMALL_SOURCE_HEIGHT = 480
+LONG_SOURCE_DURATION = 1800  # Seconds
+
+'''
+    CPUs this process may run on : affinity mask, capped by the cgroup v2 CPU quota (containers)
+'''
+def get_cpu_allocation() -> int:
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+'''
+    Encoder threads of one ffmpeg process, the CPU allocation is split between the encodes running at once on the worker
+'''
+def get_encoder_threads() -> int:
+    if settings.ENCODER_THREADS > 0:
+        return settings.ENCODER_THREADS
+    return max(1, get_cpu_allocation() // max(1, settings.WORKER_ENCODE_CONCURRENCY))
+
+def get_bits_per_pixel(source_metadata : dict) -> Optional[float]:
+    width, height = source_metadata.get('width'), source_metadata.get('height')
+    frame_rate, bit_rate = source_metadata.get('frame_rate'), source_metadata.get('video_bit_rate')
+    if not (width and height and frame_rate and bit_rate):
+        return None
+    return bit_rate / (width * height * frame_rate)
+
+'''
+    Encoder Settings of a task, from its encoding profile and (content-aware profiles) the probe of the source
+        {encoding_profile, video_codec, preset, crf, extra_args, reason}
+    Stored on the task document by the probe stage, so every stage (and retry) encodes with the same settings
+'''
+def select_encoder_settings(encoding_profile : str, source_metadata : Optional[dict] = None) -> dict:
+    profile = settings.ENCODING_PROFILES[encoding_profile]
+    encoder_settings = {
+        'encoding_profile' : encoding_profile,
+        'video_codec' : profile['video_codec'],
+        'preset' : str(profile['preset']),
+        'crf' : int(profile['crf']),
+        'extra_args' : list(profile.get('extra_args') or []),
+        'reason' : "profile defaults",
+    }
+    if not profile.get('content_aware', settings.CONTENT_AWARE_ENCODING) or not source_metadata:
+        return encoder_settings
+
+    preset_steps, crf_offset, reasons = 0, 0, []
+    height = source_metadata.get('height') or 0
+    if height and height <= SMALL_SOURCE_HEIGHT:
+        preset_steps += 1
+        reasons.append(f"{height}p source")
+
+    bits_per_pixel = get_bits_per_pixel(source_metadata)
+    if bits_per_pixel is not None and bits_per_pixel < LOW_COMPLEXITY_BITS_PER_PIXEL:
+        # Little detail / motion, a faster preset and a higher CRF lose next to nothing
+        preset_steps += 1
+        crf_offset += 2
+        reasons.append(f"low complexity ({bits_per_pixel:.3f} bpp)")
+    elif bits_per_pixel is not None and bits_per_pixel > HIGH_COMPLEXITY_BITS_PER_PIXEL:
+        crf_offset -= 2
+        reasons.append(f"high complexity ({bits_per_pixel:.3f} bpp)")
+
+    if (source_metadata.get('duration') or 0) >= LONG_SOURCE_DURATION:
+        preset_steps += 1
+        reasons.append("long source")
+
+    presets = ENCODER_PRESETS.get(encoder_settings['video_codec']) or []
+    if preset_steps and encoder_settings['preset'] in presets:
+        preset_index = presets.index(encoder_settings['preset'])
+        encoder_settings['preset'] = presets[min(preset_index + preset_steps, len(presets) - 1)]
+    max_crf = ENCODER_MAX_CRF.get(encoder_settings['video_codec'], 51)
+    encoder_settings['crf'] = min(max(encoder_settings['crf'] + crf_offset, 0), max_crf)
+    if reasons:
+        encoder_settings['reason'] = ", ".join(reasons)
+    logger.info(f"Encoder Settings Selected : {encoder_settings}")
+    return encoder_settings
+
+'''
+    ffmpeg video encoder arguments, threads are resolved on the worker running the encode
+'''
+def build_encoder_args(encoder_settings : dict) -> List[str]:
+    return [
+        '-c:v', encoder_settings['video_codec'],
+        '-preset', str(encoder_settings['preset']),
+        '-crf', str(encoder_settings['crf']),
+        '-threads', str(get_encoder_threads()),
+        *encoder_settings.get('extra_args', []),
+    ]
@@ -1,42 +1,676 @@
+from app.core.config import settings
 from app.utils.logger import get_logger
+from app.utils.encoding_profiles import select_encoder_settings, build_encoder_args, get_encoder_threads
+from app.constants.video_constants import ThumbnailSelection, TimedStage
+from app.utils.metrics import track_stage, record_encode_speed, STAGE_DURATION
 
 import subprocess
+import time
+import asyncio
+import json
+import math
+import os
+import re
+from typing import Tuple, List, Optional, AsyncIterator, Callable
 logger = get_logger(__name__)
 
+# Codecs / Containers which browsers can play without a re-encode
+WEB_COMPATIBLE_VIDEO_CODECS = ["h264"]
+WEB_COMPATIBLE_AUDIO_CODECS = ["aac"]
+WEB_COMPATIBLE_PIXEL_FORMATS = ["yuv420p", "yuvj420p"]
+WEB_INCOMPATIBLE_MP4_BRANDS = ["qt"]    # QuickTime (.mov) shares the demuxer with mp4
+
+FASTSTART_MP4_ARGS = ['-movflags', '+faststart']   # moov atom at the start for progressive playback
+# Fragmented MP4, can be written to a non seekable pipe and is still playable progressively
+FRAGMENTED_MP4_ARGS = ['-movflags', 'frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4']
+
+# Adaptive Bitrate Ladder, rungs above the source height are skipped
+ABR_LADDER = [
+    {'name': '1080p', 'height': 1080, 'video_bitrate': '5000k', 'max_rate': '5350k', 'buffer_size': '7500k'},
+    {'name': '720p', 'height': 720, 'video_bitrate': '2800k', 'max_rate': '2996k', 'buffer_size': '4200k'},
+    {'name': '480p', 'height': 480, 'video_bitrate': '1400k', 'max_rate': '1498k', 'buffer_size': '2100k'},
+    {'name': '360p', 'height': 360, 'video_bitrate': '800k', 'max_rate': '856k', 'buffer_size': '1200k'},
+]
+ABR_AUDIO_BITRATE = '128k'
+ABR_SEGMENT_DURATION = 6    # Seconds, every rung gets a keyframe at each segment boundary
+
+# CPU bound encodes running at once in this process, tasks waiting for a slot keep doing their I/O (downloads / uploads)
+encode_slots : Optional[asyncio.Semaphore] = None
+encode_slots_loop : Optional[asyncio.AbstractEventLoop] = None
+
 '''
-    Converts a File to MP4 Format
+    Encode slots of the running loop (the worker loop), created on first use
+    An asyncio primitive created at import time is bound to the importing thread's loop on Python 3.9
 '''
-def convert_to_mp4(input_path: str, output_path: str):
+def get_encode_slots() -> asyncio.Semaphore:
+    global encode_slots, encode_slots_loop
+    loop = asyncio.get_running_loop()
+    if encode_slots is None or encode_slots_loop is not loop:
+        encode_slots = asyncio.Semaphore(settings.WORKER_ENCODE_CONCURRENCY)
+        encode_slots_loop = loop
+    return encode_slots
+
+'''
+    Probes a Video File via ffprobe
+    Returns the parsed ffprobe JSON (format + streams), empty dict on failure
+'''
+async def probe_video(input_path: str) -> dict:
     command = [
+        'ffprobe',
+        '-v', 'error',
+        '-print_format', 'json',
+        '-show_format',
+        '-show_streams',
+        input_path
+    ]
+
+    try:
+        process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+        return json.loads(stdout or "{}")
+    except (subprocess.CalledProcessError, json.JSONDecodeError) as e:
+        logger.error(f"File Probe Failure : {e}")
+        return {}
+
+'''
+    Summary of the probe output, stored on the task document
+'''
+def summarize_probe(probe: dict) -> dict:
+    probe_format = probe.get('format') or {}
+    streams = probe.get('streams') or []
+    video_stream = next((s for s in streams if s.get('codec_type') == 'video'), {})
+    audio_stream = next((s for s in streams if s.get('codec_type') == 'audio'), {})
+    return {
+        'format_name' : probe_format.get('format_name'),
+        'major_brand' : (probe_format.get('tags') or {}).get('major_brand'),
+        'duration' : float(probe_format.get('duration') or 0),
+        'size' : int(probe_format.get('size') or 0),
+        'bit_rate' : int(probe_format.get('bit_rate') or 0),
+        'video_codec' : video_stream.get('codec_name'),
+        'video_bit_rate' : int(video_stream.get('bit_rate') or 0) or int(probe_format.get('bit_rate') or 0),
+        'pix_fmt' : video_stream.get('pix_fmt'),
+        'width' : video_stream.get('width'),
+        'height' : video_stream.get('height'),
+        'frame_rate' : parse_frame_rate(video_stream.get('avg_frame_rate') or video_stream.get('r_frame_rate')),
+        'audio_codec' : audio_stream.get('codec_name'),
+    }
+
+def parse_frame_rate(frame_rate: Optional[str]) -> Optional[float]:
+    try:
+        numerator, _, denominator = (frame_rate or "").partition('/')
+        return float(numerator) / float(denominator or 1) or None
+    except (ValueError, ZeroDivisionError):
+        return None
+
+'''
+    Checks if the source can be served as is (H.264/AAC inside an MP4 container)
+    Returns (is_compatible, reason)
+'''
+def check_web_compatibility(probe: dict) -> Tuple[bool, str]:
+    if not probe:
+        return False, "probe failed"
+
+    summary = summarize_probe(probe)
+    streams = probe.get('streams') or []
+    video_streams = [s for s in streams if s.get('codec_type') == 'video']
+    audio_streams = [s for s in streams if s.get('codec_type') == 'audio']
+
+    if 'mp4' not in (summary.get('format_name') or '').split(','):
+        return False, f"container {summary.get('format_name')} is not mp4"
+    if (summary.get('major_brand') or '').strip() in WEB_INCOMPATIBLE_MP4_BRANDS:
+        return False, f"container brand {summary.get('major_brand')} is not mp4"
+    if len(video_streams) != 1:
+        return False, f"expected 1 video stream, found {len(video_streams)}"
+    if summary.get('video_codec') not in WEB_COMPATIBLE_VIDEO_CODECS:
+        return False, f"video codec {summary.get('video_codec')} is not h264"
+    if summary.get('pix_fmt') not in WEB_COMPATIBLE_PIXEL_FORMATS:
+        return False, f"pixel format {summary.get('pix_fmt')} is not yuv420p"
+    if len(audio_streams) > 1:
+        return False, f"expected at most 1 audio stream, found {len(audio_streams)}"
+    if audio_streams and summary.get('audio_codec') not in WEB_COMPATIBLE_AUDIO_CODECS:
+        return False, f"audio codec {summary.get('audio_codec')} is not aac"
+
+    return True, "source is h264/aac mp4"
+
+'''
+    Encoder arguments of the default encoding profile, for tasks created before encoding profiles were stored on the task
+'''
+def get_default_encoder_args() -> List[str]:
+    return build_encoder_args(select_encoder_settings(settings.DEFAULT_ENCODING_PROFILE))
+
+'''
+    Converts a File to MP4 Format (re-encode with the task's encoder settings, audio kept if present)
+    Returns False on failure, ffmpeg may leave a partial output behind
+'''
+async def transcode_video(input_path: str, output_path: str, on_progress: Optional[Callable[[dict], None]] = None, encoder_args: Optional[List[str]] = None) -> bool:
+    command = build_transcode_command(input_path, output_path, encoder_args=encoder_args)
+
+    try:
+        await run_ffmpeg(command, on_progress)
+        logger.info(f"File Conversion Success : {output_path}")
+        return True
+    except subprocess.CalledProcessError as e:
+        logger.error(f"File Conversions Failure : {e}")
+        return False
+
+def build_transcode_command(input_path: str, output_path: str, container_args: Optional[List[str]] = None, encoder_args: Optional[List[str]] = None) -> List[str]:
+    return [
         'ffmpeg',
         '-i', input_path,  # input file
-        '-c:v', 'libx264',  # video codec
-        '-preset', 'fast',  # encoding speed
-        '-crf', '22',       # quality (lower is better, range: 0-51)
+        '-map', '0:v:0',
+        '-map', '0:a?',     # audio is optional
+        *(encoder_args or get_default_encoder_args()),
+        *(container_args or []),
         output_path
     ]
 
+'''
+    Remuxes an already web compatible MP4 (stream copy + faststart), no decode / encode
+    Returns False on failure
+'''
+async def remux_video(input_path: str, output_path: str, on_progress: Optional[Callable[[dict], None]] = None) -> bool:
+    command = build_remux_command(input_path, output_path)
+
     try:
-        subprocess.run(command, check=True)
-        logger.info("File Conversion Success")
+        await run_ffmpeg(command, on_progress, is_encode=False)
+        logger.info(f"File Remux Success : {output_path}")
+        return True
     except subprocess.CalledProcessError as e:
-        logger.error(f"File Conversions Failure : {e}", e)
+        logger.error(f"File Remux Failure : {e}")
+        return False
+
+def build_remux_command(input_path: str, output_path: str, container_args: Optional[List[str]] = None) -> List[str]:
+    return [
+        'ffmpeg',
+        '-i', input_path,
+        '-map', '0:v',
+        '-map', '0:a?',
+        '-c', 'copy',
+        *(container_args or FASTSTART_MP4_ARGS),
+        output_path
+    ]
+
+# Thumbnail files, written to the thumbnails directory of the task and uploaded as is
+PRIMARY_THUMBNAIL_FILE = 'thumbnail.jpg'
+THUMBNAIL_FILE_PATTERN = 'thumbnail_%03d.jpg'
+SPRITE_FILE = 'sprite.jpg'
+SPRITE_VTT_FILE = 'sprite.vtt'
 
 '''
-    Gets a Thumbnail from a Video File
+    Extracts a single Thumbnail, the input seek (-ss before -i) jumps to the keyframe before the timestamp
+    so only a few frames are decoded (and only a few byte ranges are read when the input is a presigned URL)
+    Fallback of the keyframe pass, when no keyframe follows the timestamp (short clips)
 '''
-def extract_thumbnail(input_path: str, output_path: str, timestamp: str = "00:00:10"):
+async def extract_thumbnail(input_path: str, thumbnail_path: str, timestamp: float = 10, thumbnail_width: int = 320):
     command = [
         'ffmpeg',
+        '-ss', str(timestamp),
         '-i', input_path,
-        '-ss', timestamp,
-        '-vf', 'scale=320:-1',
+        '-map', '0:v:0',
+        '-vf', f'scale={thumbnail_width}:-2',
         '-frames:v', '1',
+        thumbnail_path
+    ]
+
+    try:
+        await run_ffmpeg(command, is_encode=False)
+        logger.info(f"Thumbnail saved to {thumbnail_path}")
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Thumbnail Extraction Failure : {e}")
+
+'''
+    Timestamp of the primary thumbnail, clamped to the middle of videos shorter than twice THUMBNAIL_TIMESTAMP
+'''
+def get_thumbnail_timestamp(duration: Optional[float]) -> float:
+    if not duration:
+        return 0
+    return round(min(settings.THUMBNAIL_TIMESTAMP, duration / 2), 3)
+
+'''
+    Sprite Sheet geometry, one tile every interval seconds in a grid of SPRITE_COLUMNS columns
+    None when the duration or the frame size is unknown
+'''
+def get_sprite_layout(source_metadata: dict) -> Optional[dict]:
+    duration, width, height = source_metadata.get('duration'), source_metadata.get('width'), source_metadata.get('height')
+    if not duration or not width or not height:
+        return None
+    interval = max(settings.SPRITE_INTERVAL, math.ceil(duration / settings.SPRITE_MAX_TILES))
+    tiles = max(1, math.ceil(duration / interval))
+    columns = min(settings.SPRITE_COLUMNS, tiles)
+    return {
+        'interval' : interval,
+        'tiles' : tiles,
+        'columns' : columns,
+        'rows' : math.ceil(tiles / columns),
+        'tile_width' : settings.SPRITE_TILE_WIDTH,
+        'tile_height' : max(2, round(settings.SPRITE_TILE_WIDTH * height / width / 2) * 2),
+    }
+
+'''
+    Output arguments of the keyframe pass, appended to a command which reads the source as input_index with -skip_frame nokey
+        [primary]    first keyframe from the (clamped) thumbnail timestamp
+        [thumbnails] THUMBNAIL_COUNT keyframes, evenly spaced or on scene changes
+        [sprite]     one keyframe per sprite interval (fps duplicates the last keyframe over gaps), tiled into a single image
+    A single decode of the keyframes feeds every output
+'''
+def build_thumbnail_outputs(input_index: int, thumbnails_dir: str, source_metadata: dict) -> List[str]:
+    duration = source_metadata.get('duration') or 0
+    width = settings.THUMBNAIL_WIDTH
+    outputs = [(
+        'primary',
+        f"select='isnan(prev_selected_t)*gte(t,{get_thumbnail_timestamp(duration)})',scale={width}:-2",
+        ['-frames:v', '1'],
+        PRIMARY_THUMBNAIL_FILE
+    )]
+    if duration and settings.THUMBNAIL_COUNT > 0:
+        interval = duration / settings.THUMBNAIL_COUNT
+        if settings.THUMBNAIL_SELECTION == ThumbnailSelection.SCENE.value:
+            select = f"isnan(prev_selected_t)+gt(scene,{settings.THUMBNAIL_SCENE_THRESHOLD})*gte(t-prev_selected_t,{interval / 2:.3f})"
+        else:
+            select = f"isnan(prev_selected_t)*gte(t,{interval / 2:.3f})+gte(t-prev_selected_t,{interval:.3f})"
+        outputs.append((
+            'thumbnails',
+            f"select='{select}',scale={width}:-2",
+            ['-frames:v', str(settings.THUMBNAIL_COUNT), '-vsync', 'vfr'],
+            THUMBNAIL_FILE_PATTERN
+        ))
+    sprite_layout = get_sprite_layout(source_metadata)
+    if sprite_layout:
+        outputs.append((
+            'sprite',
+            f"fps=1/{sprite_layout['interval']},scale={sprite_layout['tile_width']}:{sprite_layout['tile_height']},"
+            f"tile={sprite_layout['columns']}x{sprite_layout['rows']}",
+            ['-frames:v', '1'],
+            SPRITE_FILE
+        ))
+
+    split_labels = "".join(f"[{name}_in]" for name, _, _, _ in outputs)
+    filter_graph = ";".join(
+        [f"[{input_index}:v:0]split={len(outputs)}{split_labels}"]
+        + [f"[{name}_in]{filters}[{name}]" for name, filters, _, _ in outputs]
+    )
+    args = ['-filter_complex', filter_graph]
+    for name, _, output_args, file_name in outputs:
+        args += ['-map', f'[{name}]', *output_args, '-q:v', '3', os.path.join(thumbnails_dir, file_name)]
+    return args
+
+'''
+    Thumbnails, Sprite Sheet and primary Thumbnail in one pass, only keyframes are decoded (-skip_frame nokey)
+    Returns the local files, see collect_thumbnails
+'''
+async def extract_thumbnails(input_path: str, thumbnails_dir: str, source_metadata: dict) -> dict:
+    command = [
+        'ffmpeg',
+        '-skip_frame', 'nokey',
+        '-i', input_path,
+        *build_thumbnail_outputs(0, thumbnails_dir, source_metadata)
+    ]
+
+    try:
+        await run_ffmpeg(command, is_encode=False)
+        logger.info(f"Thumbnails saved to {thumbnails_dir}")
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Thumbnails Extraction Failure : {e}")
+    return await collect_thumbnails(input_path, thumbnails_dir, source_metadata)
+
+'''
+    Files written by the keyframe pass, writes the WebVTT index of the sprite sheet
+    The primary thumbnail falls back to an accurate seek when no keyframe followed its timestamp
+        {thumbnail : path, thumbnails : [paths], sprite_sheet : {image, vtt, ...layout}}, missing outputs are None / []
+'''
+async def collect_thumbnails(input_path: str, thumbnails_dir: str, source_metadata: dict) -> dict:
+    primary_path = os.path.join(thumbnails_dir, PRIMARY_THUMBNAIL_FILE)
+    if not os.path.isfile(primary_path):
+        await extract_thumbnail(input_path, primary_path, get_thumbnail_timestamp(source_metadata.get('duration')), settings.THUMBNAIL_WIDTH)
+
+    sprite_path = os.path.join(thumbnails_dir, SPRITE_FILE)
+    sprite_layout = get_sprite_layout(source_metadata)
+    sprite_sheet = None
+    if sprite_layout and os.path.isfile(sprite_path):
+        vtt_path = os.path.join(thumbnails_dir, SPRITE_VTT_FILE)
+        write_sprite_vtt(vtt_path, SPRITE_FILE, sprite_layout, source_metadata.get('duration'))
+        sprite_sheet = {'image' : sprite_path, 'vtt' : vtt_path, **sprite_layout}
+
+    return {
+        'thumbnail' : primary_path if os.path.isfile(primary_path) else None,
+        'thumbnails' : sorted(
+            os.path.join(thumbnails_dir, f) for f in os.listdir(thumbnails_dir) if re.fullmatch(r'thumbnail_\d+\.jpg', f)
+        ),
+        'sprite_sheet' : sprite_sheet,
+    }
+
+'''
+    WebVTT index of the sprite sheet, one cue per tile pointing at its region (media fragment #xywh=x,y,w,h)
+    The image is referenced relative to the VTT file, both are uploaded next to each other
+'''
+def write_sprite_vtt(vtt_path: str, sprite_file_name: str, sprite_layout: dict, duration: float):
+    width, height = sprite_layout['tile_width'], sprite_layout['tile_height']
+    cues = ["WEBVTT", ""]
+    for i in range(sprite_layout['tiles']):
+        start = i * sprite_layout['interval']
+        end = min(start + sprite_layout['interval'], duration)
+        x, y = (i % sprite_layout['columns']) * width, (i // sprite_layout['columns']) * height
+        cues += [
+            f"{format_vtt_timestamp(start)} --> {format_vtt_timestamp(end)}",
+            f"{sprite_file_name}#xywh={x},{y},{width},{height}",
+            ""
+        ]
+    with open(vtt_path, 'w') as f:
+        f.write("\n".join(cues))
+
+def format_vtt_timestamp(seconds: float) -> str:
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600 * 1000)
+    minutes, milliseconds = divmod(milliseconds, 60 * 1000)
+    return f"{hours:02d}:{minutes:02d}:{milliseconds // 1000:02d}.{milliseconds % 1000:03d}"
+
+'''
+    Runs ffmpeg with the video output written to stdout (output path "pipe:1"), yields the output chunk by chunk
+    The pipe applies backpressure : ffmpeg blocks while the consumer (S3 multipart upload) is busy, so nothing is buffered on disk
+    Raises CalledProcessError if ffmpeg fails
+'''
+async def stream_ffmpeg_output(command: List[str], chunk_size: int = 1024 * 1024, on_progress: Optional[Callable[[dict], None]] = None, is_encode: bool = True) -> AsyncIterator[bytes]:
+    command = with_progress_output(command) if on_progress else command
+    slots = get_encode_slots() if is_encode else None
+    if slots:
+        await slots.acquire()
+    process = None
+    progress_reader = None
+    progress = {}
+    start_time = time.perf_counter()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE if on_progress else None
+        )
+
+        async def read_progress():
+            async for line in process.stderr:
+                parse_progress_line(line.decode(errors="replace"), progress, on_progress)
+
+        progress_reader = asyncio.create_task(read_progress()) if on_progress else None
+        while True:
+            chunk = await process.stdout.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+        return_code = await process.wait()
+        if progress_reader:
+            await progress_reader
+        if return_code != 0:
+            raise subprocess.CalledProcessError(return_code, command)
+        logger.info("File Streaming Conversion Success")
+        if is_encode:
+            record_encode_speed(get_video_encoder(command), progress.get('speed'))
+    finally:
+        if process and process.returncode is None:
+            process.kill()
+            await process.wait()
+        if progress_reader and not progress_reader.done():
+            progress_reader.cancel()
+        if is_encode:
+            # Includes the time the consumer (S3 upload) applied backpressure
+            STAGE_DURATION.labels(stage=TimedStage.ENCODE.value).observe(time.perf_counter() - start_time)
+            slots.release()
+
+'''
+    Runs ffmpeg as an asyncio subprocess, the event loop keeps serving the other tasks of the worker meanwhile
+    Encodes wait for one of the encode_slots, stream copies (is_encode=False) are I/O bound and start right away
+    With on_progress : ffmpeg's -progress output is read from stderr and on_progress is called
+    once per progress block with {'out_time' : seconds encoded, 'speed' : encode speed / realtime}
+    Encodes are timed once they hold a slot (pipeline_stage_duration_seconds, stage encode)
+    Raises CalledProcessError if ffmpeg fails
+'''
+async def run_ffmpeg(command: List[str], on_progress: Optional[Callable[[dict], None]] = None, is_encode: bool = True):
+    if is_encode:
+        async with get_encode_slots():
+            with track_stage(TimedStage.ENCODE):
+                progress = await run_ffmpeg_process(command, on_progress)
+            record_encode_speed(get_video_encoder(command), progress.get('speed'))
+            return
+    await run_ffmpeg_process(command, on_progress)
+
+'''
+    Returns the last progress block ({} without on_progress)
+'''
+async def run_ffmpeg_process(command: List[str], on_progress: Optional[Callable[[dict], None]]) -> dict:
+    # Outputs left behind by a failed attempt are overwritten instead of prompting on stdin
+    command = [command[0], '-y', *command[1:]]
+    command = with_progress_output(command) if on_progress else command
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stderr=asyncio.subprocess.PIPE if on_progress else None
+    )
+    progress = {}
+    try:
+        if on_progress:
+            async for line in process.stderr:
+                parse_progress_line(line.decode(errors="replace"), progress, on_progress)
+        return_code = await process.wait()
+    finally:
+        # Task cancelled / failed while ffmpeg is still running, do not leave it behind
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    if return_code != 0:
+        raise subprocess.CalledProcessError(return_code, command)
+    return progress
+
+def get_video_encoder(command: List[str]) -> Optional[str]:
+    return command[command.index('-c:v') + 1] if '-c:v' in command else None
+
+def with_progress_output(command: List[str]) -> List[str]:
+    # Machine readable progress on stderr, regular logs reduced to errors
+    return [command[0], '-progress', 'pipe:2', '-nostats', '-loglevel', 'error', *command[1:]]
+
+'''
+    ffmpeg -progress writes blocks of key=value lines, each block ends with progress=continue|end
+    Any other line on stderr is an ffmpeg error message
+'''
+def parse_progress_line(line: str, progress: dict, on_progress: Callable[[dict], None]):
+    line = line.strip()
+    key, separator, value = line.partition("=")
+    if not separator or not key.replace("_", "").isalnum():
+        if line:
+            logger.error(f"ffmpeg : {line}")
+        return
+
+    if key in ("out_time_us", "out_time_ms") and value.isdigit():
+        # Both are in microseconds
+        progress['out_time'] = int(value) / 1000000
+    elif key == "speed" and value.endswith("x"):
+        try:
+            progress['speed'] = float(value[:-1])
+        except ValueError:
+            pass
+    elif key == "progress":
+        try:
+            on_progress(dict(progress))
+        except Exception as e:
+            logger.error(f"Progress Callback Failure : {e}")
+
+'''
+    Splits a Video into keyframe aligned segments for the segmented transcode, in a single ffmpeg run
+        Video   -> stream copied into segments of ~segment_duration seconds (cut at the next keyframe)
+        Audio   -> encoded once to AAC, muxed back after the segments are concatenated
+        Thumbnails -> keyframe pass over a second (keyframe only) input, see build_thumbnail_outputs
+    Returns the sorted list of segment paths
+'''
+async def split_into_segments(input_path: str, segments_dir: str, audio_path: str, thumbnails_dir: str, source_metadata: dict, segment_duration: int, has_audio: bool = True) -> List[str]:
+    command = [
+        'ffmpeg',
+        '-i', input_path,
+        '-skip_frame', 'nokey',
+        '-i', input_path,
+
+        # Output 1 : Video Segments (matroska accepts any source codec for the stream copy)
+        '-map', '0:v:0',
+        '-c', 'copy',
+        '-f', 'segment',
+        '-segment_time', str(segment_duration),
+        '-segment_format', 'matroska',
+        '-reset_timestamps', '1',
+        os.path.join(segments_dir, 'segment_%05d.mkv'),
+    ]
+    if has_audio:
+        command += [
+            # Output 2 : Audio
+            '-map', '0:a:0',
+            '-c:a', 'aac',
+            audio_path,
+        ]
+    # Output 3 : Thumbnails and Sprite Sheet, from the keyframes of the second input
+    command += build_thumbnail_outputs(1, thumbnails_dir, source_metadata)
+
+    try:
+        await run_ffmpeg(command, is_encode=False)
+        logger.info(f"File Split Success : {segments_dir}")
+    except subprocess.CalledProcessError as e:
+        logger.error(f"File Split Failure : {e}")
+        return []
+
+    return sorted(
+        os.path.join(segments_dir, f) for f in os.listdir(segments_dir) if f.startswith('segment_')
+    )
+
+'''
+    Encodes a single (video only) segment with the same encoder settings as the single pass transcode
+    Returns False on failure
+'''
+async def transcode_segment(input_path: str, output_path: str, encoder_args: Optional[List[str]] = None) -> bool:
+    command = [
+        'ffmpeg',
+        '-i', input_path,
+        '-map', '0:v:0',
+        *(encoder_args or get_default_encoder_args()),
+        output_path
+    ]
+
+    try:
+        await run_ffmpeg(command)
+        logger.info(f"Segment Conversion Success : {output_path}")
+        return True
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Segment Conversion Failure : {e}")
+        return False
+
+'''
+    Concatenates encoded segments (stream copy, no re-encode) and muxes the audio back in
+    Paths in the concat list are single quoted, a quote inside a path is written as '\''
+'''
+async def concat_segments(segment_paths: List[str], audio_path: Optional[str], output_path: str) -> bool:
+    concat_list_path = os.path.join(os.path.dirname(output_path), 'concat_list.txt')
+    with open(concat_list_path, 'w') as f:
+        for segment_path in segment_paths:
+            escaped_path = segment_path.replace("'", "'\\''")
+            f.write(f"file '{escaped_path}'\n")
+
+    command = [
+        'ffmpeg',
+        '-f', 'concat',
+        '-safe', '0',
+        '-i', concat_list_path,
+    ]
+    if audio_path:
+        command += ['-i', audio_path]
+    command += ['-map', '0:v']
+    if audio_path:
+        command += ['-map', '1:a']
+    command += [
+        '-c', 'copy',
+        *FASTSTART_MP4_ARGS,
         output_path
     ]
-    
+
     try:
-        subprocess.run(command, check=True)
-        logger.info(f"Thumbnail saved to {output_path}")
+        await run_ffmpeg(command, is_encode=False)
+        logger.info(f"Segment Concat Success : {output_path}")
+        return True
     except subprocess.CalledProcessError as e:
-        logger.error("Error extracting thumbnail:", e)
\ No newline at end of file
+        logger.error(f"Segment Concat Failure : {e}")
+        return False
+
+'''
+    Rungs of the ladder for a source, no upscaling (sources below the lowest rung get the lowest rung only)
+'''
+def select_ladder_rungs(source_height: Optional[int]) -> List[dict]:
+    rungs = [rung for rung in ABR_LADDER if source_height and rung['height'] <= source_height]
+    return rungs or ABR_LADDER[-1:]
+
+'''
+    Encodes an Adaptive Bitrate Ladder (HLS, optionally DASH) in a single ffmpeg run
+    The source is decoded once, the split filter feeds one scaler + encoder per rung :
+        [v0..vN] -> scale -> libx264 at the rung bitrate -> segments + variant playlists in output_dir
+    HLS      : MPEG-TS segments, output_dir/master.m3u8
+    HLS_DASH : fMP4 segments shared by output_dir/manifest.mpd and output_dir/master.m3u8
+'''
+async def encode_adaptive_ladder(input_path: str, output_dir: str, rungs: List[dict], has_audio: bool = True, with_dash: bool = False, on_progress: Optional[Callable[[dict], None]] = None) -> bool:
+    command = build_ladder_command(input_path, output_dir, rungs, has_audio, with_dash)
+
+    try:
+        await run_ffmpeg(command, on_progress)
+        logger.info(f"Ladder Encode Success : {output_dir}")
+        return True
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Ladder Encode Failure : {e}")
+        return False
+
+def build_ladder_command(input_path: str, output_dir: str, rungs: List[dict], has_audio: bool = True, with_dash: bool = False) -> List[str]:
+    split_outputs = "".join(f"[v{i}]" for i in range(len(rungs)))
+    filter_graph = ";".join(
+        [f"[0:v]split={len(rungs)}{split_outputs}"]
+        + [f"[v{i}]scale=-2:{rung['height']}[v{i}out]" for i, rung in enumerate(rungs)]
+    )
+    command = [
+        'ffmpeg',
+        '-i', input_path,
+        '-filter_complex', filter_graph,
+    ]
+
+    for i, rung in enumerate(rungs):
+        command += [
+            '-map', f'[v{i}out]',
+            f'-b:v:{i}', rung['video_bitrate'],
+            f'-maxrate:v:{i}', rung['max_rate'],
+            f'-bufsize:v:{i}', rung['buffer_size'],
+        ]
+    command += [
+        '-c:v', 'libx264',
+        '-preset', 'fast',
+        '-threads', str(get_encoder_threads()),
+        '-pix_fmt', 'yuv420p',
+        '-sc_threshold', '0',   # keyframes only on segment boundaries, aligned across rungs
+        '-force_key_frames', f'expr:gte(t,n_forced*{ABR_SEGMENT_DURATION})',
+    ]
+    if has_audio:
+        command += ['-map', '0:a:0', '-c:a', 'aac', '-b:a', ABR_AUDIO_BITRATE, '-ac', '2']
+
+    if with_dash:
+        adaptation_sets = "id=0,streams=v id=1,streams=a" if has_audio else "id=0,streams=v"
+        command += [
+            '-f', 'dash',
+            '-seg_duration', str(ABR_SEGMENT_DURATION),
+            '-use_template', '1',
+            '-use_timeline', '1',
+            '-hls_playlist', '1',   # master.m3u8 next to the MPD, over the same fMP4 segments
+            '-adaptation_sets', adaptation_sets,
+            os.path.join(output_dir, 'manifest.mpd'),
+        ]
+    else:
+        variants = [f"v:{i},name:{rung['name']}" + (",agroup:audio" if has_audio else "") for i, rung in enumerate(rungs)]
+        if has_audio:
+            variants.append("a:0,agroup:audio,name:audio")
+        command += [
+            '-f', 'hls',
+            '-hls_time', str(ABR_SEGMENT_DURATION),
+            '-hls_playlist_type', 'vod',
+            '-hls_segment_filename', os.path.join(output_dir, '%v', 'segment_%05d.ts'),
+            '-master_pl_name', 'master.m3u8',
+            '-var_stream_map', " ".join(variants),
+            os.path.join(output_dir, '%v', 'index.m3u8'),
+        ]
+    return command
@@ -0,0 +1,34 @@
+from app.core.config import settings
+
+from fastapi import Request
+from fastapi.responses import Response
+from pydantic import BaseModel
+import hashlib
+
+'''
+    HTTP Caching of GET responses (ETag / Cache-Control)
+        ETag          : hash of the response body, a client sending it back in If-None-Match gets an empty 304
+        Cache-Control : processed / failed tasks do not change anymore, clients and CDNs keep them for TASK_RESPONSE_MAX_AGE,
+                        anything else is revalidated on every request (no-cache, cheap with the ETag)
+'''
+def get_etag(body : bytes) -> str:
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+def etag_matches(request : Request, etag : str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    # Weak comparison (RFC 9110), W/ is ignored
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+def build_cached_response(request : Request, payload : BaseModel, terminal : bool) -> Response:
+    body = payload.model_dump_json().encode()
+    etag = get_etag(body)
+    headers = {
+        "ETag" : etag,
+        "Cache-Control" : f"public, max-age={settings.TASK_RESPONSE_MAX_AGE}" if terminal else "no-cache",
+    }
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,166 @@
+from app.core.config import settings
+from app.utils.logger import get_logger
+from app.utils.redis_connect import get_sync_redis_client
+
+from contextlib import contextmanager
+from typing import Callable, List
+import fcntl
+import hashlib
+import os
+import shutil
+import socket
+import redis
+
+logger = get_logger(__name__)
+
+'''
+    Node-local Cache of S3 Objects (downloaded sources, intermediate segments, uploaded outputs)
+    Sits behind download_file, so retries and reprocessing on the same node skip the S3 download
+        objects/<sha256 of the S3 key>  : cached object, its mtime is the last access (LRU)
+        locks/<2 hex chars>.lock        : striped file locks, shared by every worker process of the node (prefork children)
+    Files are handed out as hard links (read only for the caller), an evicted object stays valid for the task which still links it
+    S3 keys written by the pipeline are never overwritten with different content, so entries are not revalidated
+'''
+LOCAL_CACHE_METRICS_KEY = "local_cache_metrics:{host}"
+HOST = socket.gethostname()
+
+class LocalCache:
+    def __init__(self, cache_dir : str, max_bytes : int):
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.locks_dir = os.path.join(cache_dir, "locks")
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def object_path(self, s3_key : str) -> str:
+        return os.path.join(self.objects_dir, hashlib.sha256(s3_key.encode()).hexdigest())
+
+    @contextmanager
+    def lock(self, name : str, blocking : bool = True):
+        os.makedirs(self.locks_dir, exist_ok=True)
+        with open(os.path.join(self.locks_dir, f"{name}.lock"), "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def entry_lock(self, cache_path : str, blocking : bool = True):
+        return self.lock(os.path.basename(cache_path)[:2], blocking)
+
+    '''
+        Places the object at local_path, downloading it into the cache first on a miss
+        Concurrent fetches of the same object wait for the first download instead of downloading it again
+        download(path) is called on a miss, it must write the complete object to path
+    '''
+    def fetch(self, s3_key : str, local_path : str, download : Callable[[str], None]):
+        if not self.enabled:
+            download(local_path)
+            return
+
+        cache_path = self.object_path(s3_key)
+        with self.entry_lock(cache_path):
+            if os.path.isfile(cache_path):
+                os.utime(cache_path)
+                link_or_copy(cache_path, local_path)
+                self.record("hits", os.path.getsize(cache_path))
+                logger.info(f"Local Cache Hit : {s3_key}")
+                return
+
+            os.makedirs(self.objects_dir, exist_ok=True)
+            partial_path = f"{cache_path}.partial-{os.getpid()}"
+            try:
+                download(partial_path)
+                os.replace(partial_path, cache_path)
+            finally:
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+            link_or_copy(cache_path, local_path)
+            self.record("misses", os.path.getsize(cache_path))
+            logger.info(f"Local Cache Miss : {s3_key}")
+        self.evict()
+
+    '''
+        Adds a file which was just uploaded to S3, a later stage on this node downloading it gets a hit
+        Only hard linked (no copy), files on another filesystem are skipped
+    '''
+    def put(self, s3_key : str, file_path : str):
+        if not self.enabled:
+            return
+        cache_path = self.object_path(s3_key)
+        os.makedirs(self.objects_dir, exist_ok=True)
+        with self.entry_lock(cache_path):
+            if os.path.isfile(cache_path):
+                return
+            try:
+                os.link(file_path, cache_path)
+            except OSError:
+                return
+        self.evict()
+
+    def discard(self, s3_keys : List[str]):
+        if not self.enabled:
+            return
+        for s3_key in s3_keys:
+            cache_path = self.object_path(s3_key)
+            with self.entry_lock(cache_path):
+                if os.path.isfile(cache_path):
+                    os.remove(cache_path)
+
+    '''
+        Least recently used objects are deleted until the cache fits into max_bytes
+        A single process evicts at a time, objects locked by a fetch in progress are skipped
+    '''
+    def evict(self):
+        with self.lock("evict", blocking=False) as acquired:
+            if not acquired or not os.path.isdir(self.objects_dir):
+                return
+            entries = []
+            for entry in os.scandir(self.objects_dir):
+                if entry.is_file() and ".partial-" not in entry.name:
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_bytes = sum(size for _, size, _ in entries)
+
+            for _, size, path in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                with self.entry_lock(path, blocking=False) as locked:
+                    if not locked:
+                        continue
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                total_bytes -= size
+                self.record("evictions", size)
+
+    '''
+        Hit / Miss / Eviction counters of this node, in Redis so every worker process adds to the same numbers
+    '''
+    def record(self, event : str, size : int):
+        try:
+            pipeline = get_sync_redis_client().pipeline()
+            key = LOCAL_CACHE_METRICS_KEY.format(host=HOST)
+            pipeline.hincrby(key, event, 1)
+            pipeline.hincrby(key, f"{event}_bytes", size)
+            pipeline.execute()
+        except redis.RedisError as e:
+            logger.error(f"Local Cache Metrics Failed : {e}")
+
+def link_or_copy(source_path : str, destination_path : str):
+    if os.path.exists(destination_path):
+        os.remove(destination_path)
+    try:
+        os.link(source_path, destination_path)
+    except OSError:
+        # Cache on another filesystem than the scratch directory
+        shutil.copyfile(source_path, destination_path)
+
+local_cache = LocalCache(settings.LOCAL_CACHE_DIR, settings.LOCAL_CACHE_MAX_BYTES)
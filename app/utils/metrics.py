@@ -0,0 +1,163 @@
+from app.core.config import settings
+from app.constants.video_constants import TaskQueue, TimedStage, LOWEST_TASK_PRIORITY
+from app.utils.logger import get_logger
+
+from contextlib import contextmanager
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, start_http_server
+from prometheus_client import multiprocess
+from redis.asyncio import Redis
+from typing import Dict, Optional
+import os
+import shutil
+import time
+
+logger = get_logger("metrics")
+
+'''
+    Prometheus Metrics, shared by the API and the Celery workers
+    Multiprocess mode (PROMETHEUS_MULTIPROC_DIR, read by prometheus_client from the environment, .env is loaded by config.py) :
+    every process (gunicorn worker, Celery pool process) writes its samples to files in the directory, a scrape merges them
+        API     : /metrics, served by any gunicorn worker
+        Workers : HTTP server of the Celery main process on WORKER_METRICS_PORT (workers run on other hosts than the API)
+    One directory per service and host, cleared when the service starts
+'''
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency per route",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+STAGE_DURATION = Histogram(
+    "pipeline_stage_duration_seconds",
+    "Time spent per pipeline stage (download, probe, encode, thumbnail, upload, db_update)",
+    ["stage"],
+    buckets=STAGE_BUCKETS
+)
+BYTES_TRANSFERRED = Counter(
+    "s3_bytes_transferred_total",
+    "Bytes transferred from / to S3",
+    ["direction"]
+)
+ENCODE_SPEED_RATIO = Histogram(
+    "encode_speed_ratio",
+    "Media duration / encode wall time as reported by ffmpeg (> 1 : faster than real time)",
+    ["video_codec"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+)
+RATE_LIMIT_REJECTIONS = Counter(
+    "rate_limit_rejections_total",
+    "Uploads rejected by the rate limiter",
+    ["scope"]
+)
+ADMISSION_DECISIONS = Counter(
+    "admission_decisions_total",
+    "Admission decisions of the disk / CPU heavy stages on the worker nodes",
+    ["decision", "reason"]
+)
+QUEUE_DEPTH = Gauge(
+    "celery_queue_depth",
+    "Messages waiting per Celery queue (every priority level)",
+    ["queue"],
+    multiprocess_mode="livemostrecent"
+)
+
+def is_multiprocess() -> bool:
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+def get_registry() -> CollectorRegistry:
+    if not is_multiprocess():
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+def generate_metrics() -> bytes:
+    return generate_latest(get_registry())
+
+'''
+    Clears the samples of the previous run, called once by the parent process (gunicorn master, Celery main process)
+    Its children inherit MULTIPROC_DIR_OWNER_ENV, they never clear the directory again
+'''
+MULTIPROC_DIR_OWNER_ENV = "PROMETHEUS_MULTIPROC_DIR_OWNER"
+
+def reset_multiprocess_dir():
+    multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not multiproc_dir:
+        return
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir, exist_ok=True)
+    os.environ[MULTIPROC_DIR_OWNER_ENV] = str(os.getpid())
+
+'''
+    API startup : a process without a parent hook (uvicorn main:app) clears the directory itself,
+    workers of a parent which already did (gunicorn.conf.py) only make sure it exists
+'''
+def prepare_multiprocess_dir():
+    multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not multiproc_dir:
+        return
+    if os.environ.get(MULTIPROC_DIR_OWNER_ENV):
+        os.makedirs(multiproc_dir, exist_ok=True)
+    else:
+        reset_multiprocess_dir()
+
+'''
+    Drops the live gauges of an exited child process (gunicorn child_exit, Celery worker_process_shutdown)
+'''
+def mark_process_dead(pid : int):
+    if is_multiprocess():
+        multiprocess.mark_process_dead(pid)
+
+def start_worker_metrics_server():
+    if settings.WORKER_METRICS_PORT <= 0:
+        return
+    start_http_server(settings.WORKER_METRICS_PORT, registry=get_registry())
+    logger.info(f"Worker Metrics Served on Port {settings.WORKER_METRICS_PORT}")
+
+@contextmanager
+def track_stage(stage : TimedStage):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.labels(stage=stage.value).observe(time.perf_counter() - start_time)
+
+def record_bytes_transferred(direction : str, size : int):
+    if size:
+        BYTES_TRANSFERRED.labels(direction=direction).inc(size)
+
+def record_admission(decision : str, reason : str):
+    ADMISSION_DECISIONS.labels(decision=decision, reason=reason).inc()
+
+def record_encode_speed(video_codec : Optional[str], speed : Optional[float]):
+    if speed:
+        ENCODE_SPEED_RATIO.labels(video_codec=video_codec or "unknown").observe(speed)
+
+'''
+    Messages waiting per queue on the Redis broker
+    With priorities every queue is a list per priority level : <queue> (priority 0) and <queue>:<priority>
+'''
+broker_client : Optional[Redis] = None
+
+async def get_queue_depths() -> Dict[str, int]:
+    global broker_client
+    if broker_client is None:
+        broker_client = Redis.from_url(settings.BROKER_URL, decode_responses=True)
+    pipeline = broker_client.pipeline()
+    for queue in TaskQueue:
+        for priority in range(LOWEST_TASK_PRIORITY + 1):
+            pipeline.llen(f"{queue.value}:{priority}" if priority else queue.value)
+    lengths = await pipeline.execute()
+
+    levels = LOWEST_TASK_PRIORITY + 1
+    return {
+        queue.value : sum(lengths[i * levels:(i + 1) * levels])
+        for i, queue in enumerate(TaskQueue)
+    }
+
+async def update_queue_depth():
+    for queue, depth in (await get_queue_depths()).items():
+        QUEUE_DEPTH.labels(queue=queue).set(depth)
@@ -0,0 +1,85 @@
+from app.utils.logger import get_logger
+
+from fastapi import Request
+from python_multipart.multipart import MultipartParser, parse_options_header
+from typing import AsyncIterator, Tuple
+
+logger = get_logger(__name__)
+
+'''
+    Multipart Events yielded by stream_multipart
+'''
+FIELD = "field"             # (FIELD, name, value)
+FILE_START = "file_start"   # (FILE_START, name, filename, content_type)
+FILE_DATA = "file_data"     # (FILE_DATA, bytes)
+FILE_END = "file_end"       # (FILE_END,)
+
+'''
+    Parses a multipart/form-data request body while it is being received
+    Unlike UploadFile, nothing is spooled to disk : file parts are yielded chunk by chunk as they arrive from the client
+'''
+async def stream_multipart(request: Request) -> AsyncIterator[Tuple]:
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise ValueError("Expected a multipart/form-data request")
+
+    events = []
+    part = {}
+
+    def on_part_begin():
+        part.clear()
+        part.update({"headers": {}, "header_field": b"", "header_value": b"", "is_file": False, "data": bytearray()})
+
+    def on_header_field(data: bytes, start: int, end: int):
+        part["header_field"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int):
+        part["header_value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["header_field"].lower()] = part["header_value"]
+        part["header_field"] = b""
+        part["header_value"] = b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["name"] = disposition.get(b"name", b"").decode()
+        if b"filename" in disposition:
+            part["is_file"] = True
+            events.append((
+                FILE_START,
+                part["name"],
+                disposition.get(b"filename").decode(),
+                part["headers"].get(b"content-type", b"application/octet-stream").decode()
+            ))
+
+    def on_part_data(data: bytes, start: int, end: int):
+        if part["is_file"]:
+            events.append((FILE_DATA, data[start:end]))
+        else:
+            part["data"] += data[start:end]
+
+    def on_part_end():
+        if part["is_file"]:
+            events.append((FILE_END,))
+        else:
+            events.append((FIELD, part["name"], part["data"].decode()))
+
+    parser = MultipartParser(params.get(b"boundary"), {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    async for chunk in request.stream():
+        parser.write(chunk)
+        # Hand the parsed events over before reading the next chunk, keeps memory bounded to one network chunk
+        while events:
+            yield events.pop(0)
+    parser.finalize()
+    while events:
+        yield events.pop(0)
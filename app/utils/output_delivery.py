@@ -0,0 +1,126 @@
+from app.core.config import settings
+from app.utils.logger import get_logger
+from app.utils.local_cache import local_cache
+from app.utils.s3_utils import open_object_stream, generate_presigned_key_url, STREAMING_CONTENT_TYPES
+from app.constants.video_constants import OutputDelivery
+
+from fastapi import Request
+from fastapi.responses import Response, RedirectResponse, StreamingResponse
+from datetime import timezone
+from email.utils import format_datetime
+from typing import AsyncIterator, BinaryIO, Optional, Tuple
+import asyncio
+import os
+
+logger = get_logger(__name__)
+
+'''
+    Serving Processed Outputs from the private bucket
+        redirect : 307 to a presigned GET URL valid for OUTPUT_URL_EXPIRY seconds, S3 serves the bytes and the ranges
+        proxy    : streamed through the API chunk by chunk, the Range header is forwarded to S3 (206, players can seek)
+    Playlists, manifests and WebVTT files are always proxied : players resolve the relative URIs inside them against the URL
+    they were loaded from, so every segment / tile request comes back to the API (and is redirected or proxied itself)
+    Outputs in the node-local cache (LOCAL_CACHE_DIR shared with a worker of the node) never go to S3 :
+        OUTPUT_LOCAL_ACCEL_PREFIX set : X-Accel-Redirect, nginx sends the file with sendfile (zero copy, ranges done by nginx)
+        otherwise                     : read from disk in chunks, Range handled here
+'''
+PROXIED_EXTENSIONS = [".m3u8", ".mpd", ".vtt"]
+
+def get_content_type(s3_key : str) -> str:
+    return STREAMING_CONTENT_TYPES.get(os.path.splitext(s3_key)[1], "application/octet-stream")
+
+'''
+    Single byte range of a Range header (bytes=start-end, bytes=start-, bytes=-suffix) -> (start, end) inclusive
+    None : no range, or a form served as the full file (multiple ranges, other units)
+    Raises ValueError when the range is not satisfiable (416)
+'''
+def parse_byte_range(range_header : Optional[str], size : int) -> Optional[Tuple[int, int]]:
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start, _, end = range_header[len("bytes="):].strip().partition("-")
+    if not (start.isdigit() or end.isdigit()):
+        return None
+    if not start:
+        suffix = int(end)
+        if suffix == 0 or size == 0:
+            raise ValueError(f"Unsatisfiable Range : {range_header}")
+        return max(size - suffix, 0), size - 1
+    first = int(start)
+    last = min(int(end), size - 1) if end.isdigit() else size - 1
+    if first >= size or first > last:
+        raise ValueError(f"Unsatisfiable Range : {range_header}")
+    return first, last
+
+async def stream_file(file : BinaryIO, start : int, length : int) -> AsyncIterator[bytes]:
+    try:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = await asyncio.to_thread(file.read, min(settings.OUTPUT_STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+def build_local_file_response(request : Request, cache_path : str, s3_key : str, headers : dict) -> Response:
+    content_type = get_content_type(s3_key)
+    if settings.OUTPUT_LOCAL_ACCEL_PREFIX:
+        return Response(media_type=content_type, headers={
+            **headers,
+            "X-Accel-Redirect": f"{settings.OUTPUT_LOCAL_ACCEL_PREFIX.rstrip('/')}/{os.path.basename(cache_path)}",
+        })
+
+    # Opened before the response starts, an eviction meanwhile does not cut the transfer
+    file = open(cache_path, "rb")
+    size = os.fstat(file.fileno()).st_size
+    try:
+        byte_range = parse_byte_range(request.headers.get("range"), size)
+    except ValueError:
+        file.close()
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    start, end = byte_range or (0, size - 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(stream_file(file, start, end - start + 1), status_code=206 if byte_range else 200, media_type=content_type, headers=headers)
+
+async def build_output_response(request : Request, s3_key : str, delivery : OutputDelivery) -> Response:
+    if delivery == OutputDelivery.REDIRECT and os.path.splitext(s3_key)[1] not in PROXIED_EXTENSIONS:
+        # Reused by the client for half of the URL lifetime at most
+        return RedirectResponse(
+            generate_presigned_key_url(s3_key, settings.OUTPUT_URL_EXPIRY),
+            status_code=307,
+            headers={"Cache-Control": f"private, max-age={settings.OUTPUT_URL_EXPIRY // 2}"}
+        )
+
+    # Output keys are never overwritten with different content
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": f"public, max-age={settings.TASK_RESPONSE_MAX_AGE}",
+    }
+
+    cache_path = local_cache.object_path(s3_key) if local_cache.enabled else None
+    if cache_path and os.path.isfile(cache_path):
+        try:
+            return build_local_file_response(request, cache_path, s3_key, headers)
+        except FileNotFoundError:
+            logger.info(f"Local Output Evicted, Streaming from S3 : {s3_key}")
+
+    stream = await open_object_stream(s3_key, request.headers.get("range"))
+    if stream is None:
+        return Response(status_code=404)
+    if stream.get("status") == 416:
+        return Response(status_code=416, headers=headers)
+
+    if stream.get("content_length") is not None:
+        headers["Content-Length"] = str(stream.get("content_length"))
+    if stream.get("content_range"):
+        headers["Content-Range"] = stream.get("content_range")
+    if stream.get("etag"):
+        headers["ETag"] = stream.get("etag")
+    if stream.get("last_modified"):
+        headers["Last-Modified"] = format_datetime(stream.get("last_modified").astimezone(timezone.utc), usegmt=True)
+    return StreamingResponse(stream.get("body"), status_code=stream.get("status"), media_type=stream.get("content_type") or get_content_type(s3_key), headers=headers)
@@ -0,0 +1,99 @@
+from app.constants.video_constants import ProcessingStage
+from app.utils.logger import get_logger
+from app.utils.redis_connect import get_sync_redis_client
+
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+import asyncio
+import json
+import redis
+
+logger = get_logger(__name__)
+
+'''
+    Task Progress over Redis
+        Channel task_progress:<task_id> : every stage change / progress update is published here (fanned out by the SSE endpoint)
+        Hash    task_progress:<task_id> : latest snapshot, so new subscribers get the current state without hitting Mongo
+    Publishing happens inside the Celery worker with a sync client, never on the worker loop itself : coroutines hand it to
+    asyncio.to_thread, a slow or unreachable Redis does not stall the other tasks (downloads, ffmpeg pipes) sharing the loop
+'''
+TASK_PROGRESS_KEY = "task_progress:{task_id}"
+TASK_PROGRESS_TTL = 24 * 60 * 60    # Seconds
+TERMINAL_STAGES = [ProcessingStage.PROCESSED.value, ProcessingStage.FAILED.value]
+MIN_PROGRESS_STEP = 0.01    # Updates smaller than 1% within a stage are not published
+MAX_TRACKED_TASKS = 1024    # Tasks of this process whose last update is kept, least recently published dropped first
+
+# Stages of a task run on different workers, a worker may never publish its terminal stage : bounded LRU, task_id : (stage, progress)
+last_published : "OrderedDict[str, tuple]" = OrderedDict()
+
+'''
+    Blocking (sync Redis client) : called from a Celery / executor thread, coroutines of the worker loop use asyncio.to_thread
+'''
+def publish_progress(task_id : str, stage : ProcessingStage, progress : Optional[float] = None, **details):
+    event = build_progress_event(task_id, stage, progress, **details)
+    if event:
+        write_progress_event(event)
+
+'''
+    Event of an update, None when it is throttled (less than MIN_PROGRESS_STEP since the last update of the same stage)
+'''
+def build_progress_event(task_id : str, stage : ProcessingStage, progress : Optional[float] = None, **details) -> Optional[dict]:
+    previous = last_published.get(task_id)
+    if previous and previous[0] == stage and progress is not None and previous[1] is not None and progress - previous[1] < MIN_PROGRESS_STEP:
+        return None
+    # Re-inserted at the end (most recently published), safe against a concurrent pop of the same task
+    last_published.pop(task_id, None)
+    if stage.value not in TERMINAL_STAGES:
+        last_published[task_id] = (stage, progress)
+    while len(last_published) > MAX_TRACKED_TASKS:
+        last_published.popitem(last=False)
+
+    return {
+        'task_id' : task_id,
+        'stage' : stage.value,
+        'progress' : round(min(progress, 1.0), 4) if progress is not None else None,
+        'updated_at' : datetime.now().isoformat(),
+        **details
+    }
+
+def write_progress_event(event : dict):
+    task_id = event.get('task_id')
+    key = TASK_PROGRESS_KEY.format(task_id=task_id)
+    try:
+        client = get_sync_redis_client()
+        pipeline = client.pipeline()
+        pipeline.hset(key, mapping={field : json.dumps(value) for field, value in event.items()})
+        pipeline.expire(key, TASK_PROGRESS_TTL)
+        pipeline.publish(key, json.dumps(event))
+        pipeline.execute()
+    except redis.RedisError as e:
+        # Progress is best effort, never fail the task because of it
+        logger.error(f"Progress Publish Failed : {task_id}, {e}")
+
+'''
+    Segmented transcode : segments are encoded by different workers, progress = encoded segments / total segments
+'''
+def publish_segment_encoded(task_id : str):
+    key = TASK_PROGRESS_KEY.format(task_id=task_id)
+    try:
+        client = get_sync_redis_client()
+        segments_done = client.hincrby(key, 'segments_done', 1)
+        segments_total = json.loads(client.hget(key, 'segments_total') or "0")
+        if segments_total:
+            publish_progress(task_id, ProcessingStage.ENCODING, segments_done / segments_total, segments_total=segments_total)
+    except redis.RedisError as e:
+        logger.error(f"Progress Publish Failed : {task_id}, {e}")
+
+'''
+    ffmpeg progress callback for an encode of a source of `duration` seconds
+    Called on the worker loop (ffmpeg progress reader) : throttled there, the Redis round trip runs in the loop's executor
+'''
+def encoding_progress_callback(task_id : str, duration : Optional[float]):
+    def on_progress(ffmpeg_progress : dict):
+        if not duration:
+            return
+        event = build_progress_event(task_id, ProcessingStage.ENCODING, ffmpeg_progress.get('out_time', 0) / duration, speed=ffmpeg_progress.get('speed'))
+        if event:
+            asyncio.get_running_loop().run_in_executor(None, write_progress_event, event)
+    return on_progress
@@ -0,0 +1,91 @@
+from app.core.config import settings
+from app.utils.redis_connect import redis_connection
+from app.utils.logger import get_logger
+
+import time
+
+logger = get_logger(__name__)
+
+'''
+    Sliding Window Rate Limiter on Redis
+    Each window is a counter key, the sliding count is estimated from the current and previous window :
+        count = current + previous * (time left in the current window / window size)
+    Check and increment of the global and user counters happen in one Lua script, so the limiter is
+    atomic across gunicorn workers and constant time per request (a batch is checked and counted in one call)
+'''
+RATE_LIMIT_SCRIPT = """
+local function sliding_count(current_key, previous_key)
+    local current = tonumber(redis.call('GET', current_key) or '0')
+    local previous = tonumber(redis.call('GET', previous_key) or '0')
+    return current + previous * tonumber(ARGV[3])
+end
+
+local extra = tonumber(ARGV[5]) - 1
+if sliding_count(KEYS[1], KEYS[2]) + extra >= tonumber(ARGV[1]) then
+    return 1
+end
+if sliding_count(KEYS[3], KEYS[4]) + extra >= tonumber(ARGV[2]) then
+    return 2
+end
+
+redis.call('INCRBY', KEYS[1], ARGV[5])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('INCRBY', KEYS[3], ARGV[5])
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+return 0
+"""
+
+# Gives count units back to the current window of every key, never below zero
+REFUND_SCRIPT = """
+for i = 1, #KEYS do
+    local current = tonumber(redis.call('GET', KEYS[i]) or '0')
+    if current > 0 then
+        redis.call('DECRBY', KEYS[i], math.min(current, tonumber(ARGV[1])))
+    end
+end
+return 0
+"""
+
+ALLOWED = 0
+GLOBAL_LIMIT_EXHAUSTED = 1
+USER_LIMIT_EXHAUSTED = 2
+
+'''
+    Consumes count units (one per upload) of the global and the user quota, nothing is consumed when the count does not fit in either
+    Returns ALLOWED, GLOBAL_LIMIT_EXHAUSTED or USER_LIMIT_EXHAUSTED
+'''
+async def consume_rate_limit(user_id : str, count : int = 1) -> int:
+    window = settings.RATE_LIMIT_WINDOW_SECONDS
+    now = time.time()
+    current_window = int(now // window)
+    previous_window_weight = 1 - (now % window) / window
+
+    client = await redis_connection.get_client()
+    return int(await client.eval(
+        RATE_LIMIT_SCRIPT,
+        4,
+        f"rate_limit:global:{current_window}",
+        f"rate_limit:global:{current_window - 1}",
+        f"rate_limit:user:{user_id}:{current_window}",
+        f"rate_limit:user:{user_id}:{current_window - 1}",
+        settings.GLOBAL_VIDEO_RATE_LIMITING,
+        settings.USER_VIDEO_RATE_LIMITING,
+        previous_window_weight,
+        window * 2,     # previous window has to outlive the current one
+        count,
+    ))
+
+'''
+    Gives back count units of the global and the user quota, for uploads consumed but not turned into tasks
+    Taken from the current window (the consumed one, unless the window rolled over meanwhile)
+'''
+async def refund_rate_limit(user_id : str, count : int):
+    current_window = int(time.time() // settings.RATE_LIMIT_WINDOW_SECONDS)
+    client = await redis_connection.get_client()
+    await client.eval(
+        REFUND_SCRIPT,
+        2,
+        f"rate_limit:global:{current_window}",
+        f"rate_limit:user:{user_id}:{current_window}",
+        count,
+    )
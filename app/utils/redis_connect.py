@@ -0,0 +1,38 @@
+from app.core.config import settings
+
+from redis.asyncio import Redis
+import redis
+
+class RedisConnection:
+    '''
+        Async Redis client (rate limiting, caching, pub/sub), same Redis as the Celery broker unless REDIS_URL is set
+    '''
+    def __init__(self):
+        self.client: Redis | None = None
+
+    async def connect(self):
+        if not self.client:
+            self.client = Redis.from_url(settings.REDIS_URL, decode_responses=True)
+
+    async def get_client(self) -> Redis:
+        if not self.client:
+            await self.connect()
+        return self.client
+
+    async def close(self):
+        if self.client:
+            await self.client.close()
+            self.client = None
+
+redis_connection = RedisConnection()
+
+'''
+    Sync Redis client, for the worker code paths which run outside the event loop (ffmpeg progress callbacks, transfer threads)
+'''
+sync_redis_client = None
+
+def get_sync_redis_client() -> redis.Redis:
+    global sync_redis_client
+    if sync_redis_client is None:
+        sync_redis_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return sync_redis_client
@@ -1,43 +1,28 @@
-from fastapi import File, UploadFile
 from app.dtos.error_success_code import ErrorAndSuccessCodes
-from app.dtos.collection_names import CollectionNames
-from datetime import datetime
-from app.utils.db_query import MongoQueryApplicator
+from app.utils.rate_limiter import consume_rate_limit, GLOBAL_LIMIT_EXHAUSTED, USER_LIMIT_EXHAUSTED
+from app.constants.video_constants import ProcessingProfile
 from app.core.config import settings
+from app.utils.metrics import RATE_LIMIT_REJECTIONS
 
 
-async def validate_rate_limit(user_id : str) -> ErrorAndSuccessCodes:
+async def validate_rate_limit(user_id : str, count : int = 1) -> ErrorAndSuccessCodes:
     """
         Validate the rate limit for the incoming request.
-        This function checks if the request exceeds the allowed rate limit.
-        To save DB calls we are fetching all the records and filtering for that user
-    """
-    # Placeholder for actual rate limiting logic
-    # For example, check if the request is within the allowed number of requests per minute
-    # If it exceeds, raise an exception or return an error response
-    start_of_day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    end_of_date = datetime.now().replace(hour=23, minute=59, second=59, microsecond=999999)
-
-    # Check the number of files created today, if it exceeds the limit, return error
-    mongo = MongoQueryApplicator(CollectionNames.VIDEOS.value)
-    
-    # Build your query dict dynamically
-    videos = await mongo.find({"created_at" : {"$gte" : start_of_day, "$lte" : end_of_date}})
-    if videos and len(videos) >= settings.GLOBAL_VIDEO_RATE_LIMITING:
+        This function checks if the request exceeds the allowed rate limit (global and per user),
+        and consumes one upload (count uploads for a batch, all or nothing) from both quotas when it does not.
+        Backed by atomic Redis counters over a sliding window of RATE_LIMIT_WINDOW_SECONDS (see rate_limiter.py)
+    """
+    result = await consume_rate_limit(user_id, count)
+    if result == GLOBAL_LIMIT_EXHAUSTED:
+        RATE_LIMIT_REJECTIONS.labels(scope="global").inc()
         return ErrorAndSuccessCodes.GLOBAL_RATE_LIMIT_EXHAUSTED
-    
-    user_videos = []
-    for video in videos:
-        if video.get('user_id') == user_id:  # Not using video['user_id'] to avoid KeyError
-            user_videos.append(video)
-    
-    if len(user_videos) >= settings.USER_VIDEO_RATE_LIMITING:
+    if result == USER_LIMIT_EXHAUSTED:
+        RATE_LIMIT_REJECTIONS.labels(scope="user").inc()
         return ErrorAndSuccessCodes.USER_RATE_LIMIT_EXHAUSTED
-
     return ErrorAndSuccessCodes.SUCCESS
     
 
-def validate_file_type(video_file:UploadFile = File(...)) -> ErrorAndSuccessCodes:
+def validate_file_type(content_type : str) -> ErrorAndSuccessCodes:
     """
     Validate the file type of the uploaded video.
     This function checks if the file type is allowed.
@@ -49,6 +34,32 @@ def validate_file_type(video_file:UploadFile = File(...)) -> ErrorAndSuccessCode
         "video/x-ms-wmv",   # WMV
         "video/x-flv"       # FLV
         ]
-    if video_file.content_type not in allowed_types:
+    if content_type not in allowed_types:
         return ErrorAndSuccessCodes.NOT_SUPPORTED_FILE_TYPE
-    return ErrorAndSuccessCodes.SUCCESS
\ No newline at end of file
+    return ErrorAndSuccessCodes.SUCCESS
+
+def validate_batch_size(size : int) -> ErrorAndSuccessCodes:
+    """
+    Validate the number of items of a batch request (uploads, task_ids), 1 to BATCH_MAX_ITEMS.
+    """
+    if size < 1:
+        return ErrorAndSuccessCodes.INVALID_INPUT
+    if size > settings.BATCH_MAX_ITEMS:
+        return ErrorAndSuccessCodes.BATCH_SIZE_EXCEEDED
+    return ErrorAndSuccessCodes.SUCCESS
+
+def validate_processing_profile(profile : str) -> ErrorAndSuccessCodes:
+    """
+    Validate the processing profile requested for the upload.
+    """
+    if profile not in [p.value for p in ProcessingProfile]:
+        return ErrorAndSuccessCodes.NOT_SUPPORTED_PROFILE
+    return ErrorAndSuccessCodes.SUCCESS
+
+def validate_encoding_profile(encoding_profile : str) -> ErrorAndSuccessCodes:
+    """
+    Validate the encoding profile requested for the upload (named profiles from ENCODING_PROFILES).
+    """
+    if encoding_profile not in settings.ENCODING_PROFILES:
+        return ErrorAndSuccessCodes.NOT_SUPPORTED_ENCODING_PROFILE
+    return ErrorAndSuccessCodes.SUCCESS
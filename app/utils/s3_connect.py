@@ -0,0 +1,79 @@
+from app.core.config import settings
+from app.utils.logger import get_logger
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+logger = get_logger(__name__)
+
+class S3Connection:
+    '''
+        One S3 client per process (FastAPI app / Celery worker process), created on startup
+        boto3 clients are thread safe, so the client and its connection pool are shared by every request, task and transfer thread
+    '''
+    def __init__(self):
+        self.client = None
+        self.transfer_config: TransferConfig | None = None
+
+    def connect(self):
+        if not self.client:
+            self.client = boto3.client(
+                "s3",
+                region_name=settings.S3_REGION,
+                endpoint_url=settings.S3_ENDPOINT_URL,
+                config=Config(
+                    max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+                    retries={"max_attempts": 5, "mode": "adaptive"},
+                    tcp_keepalive=True
+                )
+            )
+            self.transfer_config = TransferConfig(
+                multipart_threshold=settings.S3_MULTIPART_THRESHOLD,
+                multipart_chunksize=settings.S3_MULTIPART_PART_SIZE,
+                max_concurrency=settings.S3_TRANSFER_MAX_CONCURRENCY,
+                use_threads=True
+            )
+            logger.info(f"S3 Client Created, Pool Size : {settings.S3_MAX_POOL_CONNECTIONS}")
+
+    def get_client(self):
+        # Lazy connect, for scripts / processes which skip the startup hooks
+        if not self.client:
+            self.connect()
+        return self.client
+
+    def close(self):
+        if self.client:
+            self.client.close()
+            self.client = None
+            self.transfer_config = None
+
+    def pool_metrics(self) -> dict:
+        '''
+            Connection pool metrics, read from the urllib3 pools inside botocore
+        '''
+        metrics = {
+            "connected": self.client is not None,
+            "max_pool_connections": settings.S3_MAX_POOL_CONNECTIONS,
+            "pools": []
+        }
+        if not self.client:
+            return metrics
+
+        try:
+            pool_manager = self.client._endpoint.http_session._manager
+            for pool_key in list(pool_manager.pools.keys()):
+                pool = pool_manager.pools.get(pool_key)
+                if pool is None:
+                    continue
+                metrics["pools"].append({
+                    "host": pool.host,
+                    "connections_created": pool.num_connections,
+                    "requests": pool.num_requests,
+                    "idle_connections": pool.pool.qsize() if pool.pool else 0,
+                })
+        except AttributeError as e:
+            logger.error(f"S3 Pool Metrics Unavailable : {e}")
+        return metrics
+
+s3 = S3Connection()
@@ -1,82 +1,417 @@
-from fastapi import File, UploadFile
 from app.dtos.error_success_code import ErrorAndSuccessCodes
 from app.core.config import settings
 from app.utils.logger import get_logger
+from app.utils.s3_connect import s3
+from app.utils.local_cache import local_cache
+from app.utils.metrics import track_stage, record_bytes_transferred
+from app.constants.video_constants import TimedStage
 
-import boto3
+from typing import Dict, List, Optional, AsyncIterator
+import asyncio
+import math
+import os
 from botocore.exceptions import BotoCoreError, ClientError
 logger = get_logger(__name__)
 
 '''
     Uploading File to S3
+    The file is consumed as an async stream of chunks (request body, ffmpeg stdout) and pushed as a multipart upload
+        1. Chunks are buffered until S3_MULTIPART_PART_SIZE, then the part is uploaded in a thread (boto3 is blocking)
+        2. At most S3_MULTIPART_CONCURRENCY parts are in flight, reading from the client pauses until a slot frees up
+           In-flight memory is bounded to roughly part size * (concurrency + 1)
+        3. The event loop is never blocked by S3 calls, and the file never touches the local disk
 '''
-async def upload_video_to_s3(file : UploadFile = File(...)) -> str:
-    s3_client = boto3.client(
-        "s3",
-        region_name = settings.S3_REGION
+async def upload_video_to_s3(file_chunks : AsyncIterator[bytes], task_id : str, file_name : str, content_type : str) -> str:
+    # Keyed by task_id, two uploads with the same file name never overwrite each other
+    return await upload_stream_to_s3(file_chunks, f"videos/{task_id}/{file_name}", content_type)
+
+async def upload_stream_to_s3(file_chunks : AsyncIterator[bytes], s3_key : str, content_type : str) -> str:
+    s3_client = s3.get_client()
+    bucket = settings.VIDEO_UPLOAD_S3_BUCKET
+
+    multipart_upload = await asyncio.to_thread(
+        s3_client.create_multipart_upload,
+        Bucket=bucket,
+        Key=s3_key,
+        ContentType=content_type
     )
-    s3_key = f"videos/{file.filename}"
+    upload_id = multipart_upload["UploadId"]
+    in_flight = asyncio.Semaphore(settings.S3_MULTIPART_CONCURRENCY)
+    part_uploads = []
+
+    async def upload_part(part_number : int, body : bytes) -> dict:
+        try:
+            response = await asyncio.to_thread(
+                s3_client.upload_part,
+                Bucket=bucket,
+                Key=s3_key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=body
+            )
+            return {"PartNumber": part_number, "ETag": response["ETag"]}
+        finally:
+            in_flight.release()
+
+    async def submit_part(body : bytes):
+        await in_flight.acquire()
+        part_uploads.append(asyncio.create_task(upload_part(len(part_uploads) + 1, body)))
 
-    '''
-        Avoiding writing the video file to disk and directly uploading to S3
-        This prevents the need for temporary storage and speeds up the process
-        UploadFile.file supports directly streaming the file file to S3
-    '''
     try:
-        s3_client.upload_fileobj(
-            file.file,
-            settings.VIDEO_UPLOAD_S3_BUCKET,
-            s3_key,
-            ExtraArgs={
-                "ContentType": file.content_type
-            }
+        buffer = bytearray()
+        async for chunk in file_chunks:
+            buffer += chunk
+            record_bytes_transferred("upload", len(chunk))
+            while len(buffer) >= settings.S3_MULTIPART_PART_SIZE:
+                await submit_part(bytes(buffer[:settings.S3_MULTIPART_PART_SIZE]))
+                del buffer[:settings.S3_MULTIPART_PART_SIZE]
+
+        # Last part may be smaller than the part size (an empty file is uploaded as a single empty part)
+        if buffer or not part_uploads:
+            await submit_part(bytes(buffer))
+
+        parts = await asyncio.gather(*part_uploads)
+        await asyncio.to_thread(
+            s3_client.complete_multipart_upload,
+            Bucket=bucket,
+            Key=s3_key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": list(parts)}
         )
         s3_url = f"https://{settings.VIDEO_UPLOAD_S3_BUCKET}.s3.{settings.S3_REGION}.amazonaws.com/{s3_key}"
         return s3_url
 
-    except (BotoCoreError, ClientError) as e:
+    except Exception as e:
+        # Abort, otherwise S3 keeps (and bills) the uploaded parts
+        for part_upload in part_uploads:
+            part_upload.cancel()
+        await asyncio.gather(*part_uploads, return_exceptions=True)
+        try:
+            await asyncio.to_thread(
+                s3_client.abort_multipart_upload,
+                Bucket=bucket,
+                Key=s3_key,
+                UploadId=upload_id
+            )
+        except (ClientError, BotoCoreError) as abort_error:
+            # The upload error is the one reported, a failed abort leaves the parts in S3 until they are aborted or expire
+            logger.error(f"S3 Multipart Abort Failed : {s3_key}, {abort_error}")
         raise Exception(f"S3 upload failed: {str(e)}")
     
+'''
+    Presigned GET URL for an uploaded file, lets ffmpeg / ffprobe read the source with HTTP range requests instead of downloading it
+'''
+def generate_presigned_get_url(s3_file_path: str) -> str:
+    return generate_presigned_key_url(get_s3_key_from_url(s3_file_path), settings.S3_PRESIGNED_URL_EXPIRY)
+
+def generate_presigned_key_url(s3_key: str, expiry: int) -> str:
+    return s3.get_client().generate_presigned_url(
+        "get_object",
+        Params={
+            "Bucket": settings.VIDEO_UPLOAD_S3_BUCKET,
+            "Key": s3_key
+        },
+        ExpiresIn=expiry
+    )
+
+def get_s3_key_from_url(s3_file_path: str) -> str:
+    return s3_file_path.split(f"https://{settings.VIDEO_UPLOAD_S3_BUCKET}.s3.{settings.S3_REGION}.amazonaws.com/")[-1]
+
 '''
     Downloading File to a Local File in Python
+    boto3 is blocking, the transfer runs in a thread so the worker's event loop keeps serving other tasks
+    Objects already in the node-local cache (retries, reprocessing, intermediate files of this node) are not downloaded again
 '''
-def download_file(s3_file_path: str, local_path: str):
+async def download_file(s3_file_path: str, local_path: str):
     if not s3_file_path:
         logger.error(f"Missing S3 Path for File Download : {s3_file_path}")
         raise ValueError("S3 file path cannot be empty")
 
-    s3_client = boto3.client(
-        "s3",
-        region_name=settings.S3_REGION
-        # aws_access_key_id="your-access-key",
-        # aws_secret_access_key="your-secret-key"
-    )
+    s3_client = s3.get_client()
     
-    s3_key = s3_file_path.split(f"https://{settings.VIDEO_UPLOAD_S3_BUCKET}.s3.ap-south-1.amazonaws.com/")[-1]
+    s3_key = get_s3_key_from_url(s3_file_path)
+    def download(path : str):
+        s3_client.download_file(settings.VIDEO_UPLOAD_S3_BUCKET, s3_key, path, Config=s3.transfer_config)
+        record_bytes_transferred("download", os.path.getsize(path))
+
     try:
-        s3_client.download_file(settings.VIDEO_UPLOAD_S3_BUCKET, s3_key, local_path)
+        with track_stage(TimedStage.DOWNLOAD):
+            await asyncio.to_thread(local_cache.fetch, s3_key, local_path, download)
         logger.info(f"File downloaded to {local_path}")
     except Exception as e:
         logger.info(f"Download failed: {e}")
 
-async def upload_file_to_s3_from_path(file_path: str, file_name: str, content_type : str) -> str:
+async def upload_file_to_s3_from_path(file_path: str, file_name: str, content_type : str, s3_prefix : str = "videos") -> str:
     try:
         logger.info(f"Request Received to Upload File to S3 : {file_name}")
-        s3_client = boto3.client(
-            "s3",
-            region_name = settings.S3_REGION
-        )
-        s3_key = f"videos/{file_name}"
-        s3_client.upload_file(
-            file_path,
-            settings.VIDEO_UPLOAD_S3_BUCKET, 
-            s3_key, 
-            ExtraArgs={
-                "ContentType": content_type
-            }
-        )
+        s3_client = s3.get_client()
+        s3_key = f"{s3_prefix}/{file_name}"
+        with track_stage(TimedStage.UPLOAD):
+            await asyncio.to_thread(
+                s3_client.upload_file,
+                file_path,
+                settings.VIDEO_UPLOAD_S3_BUCKET, 
+                s3_key, 
+                ExtraArgs={
+                    "ContentType": content_type
+                },
+                Config=s3.transfer_config
+            )
+        record_bytes_transferred("upload", os.path.getsize(file_path))
+        await asyncio.to_thread(local_cache.put, s3_key, file_path)
         s3_url = f"https://{settings.VIDEO_UPLOAD_S3_BUCKET}.s3.{settings.S3_REGION}.amazonaws.com/{s3_key}"
         return s3_url
     except Exception as e:
         logger.error(f"Upload to S3 failed: {e}")
-        return ""
\ No newline at end of file
+        return ""
+
+'''
+    Streaming an Object (or a byte range of it) from S3, for the output endpoint
+    The body is read in chunks of OUTPUT_STREAM_CHUNK_SIZE in a thread and handed out as they arrive, the object is never held in memory
+    byte_range : HTTP Range header value, passed to S3 as is (S3 answers 206 with the Content-Range)
+    Returns None when the object does not exist, {'status' : 416} when the range is not satisfiable
+'''
+async def open_object_stream(s3_key : str, byte_range : Optional[str] = None) -> Optional[dict]:
+    s3_client = s3.get_client()
+    params = {"Bucket": settings.VIDEO_UPLOAD_S3_BUCKET, "Key": s3_key}
+    if byte_range:
+        params["Range"] = byte_range
+    try:
+        response = await asyncio.to_thread(s3_client.get_object, **params)
+    except ClientError as e:
+        error_code = e.response.get("Error", {}).get("Code")
+        if error_code in ("404", "NoSuchKey", "NotFound"):
+            return None
+        if error_code == "InvalidRange":
+            return {"status": 416}
+        raise
+
+    body = response["Body"]
+    async def chunks() -> AsyncIterator[bytes]:
+        try:
+            while True:
+                chunk = await asyncio.to_thread(body.read, settings.OUTPUT_STREAM_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            body.close()
+
+    return {
+        "status": 206 if response.get("ContentRange") else 200,
+        "body": chunks(),
+        "content_length": response.get("ContentLength"),
+        "content_range": response.get("ContentRange"),
+        "content_type": response.get("ContentType"),
+        "etag": response.get("ETag"),
+        "last_modified": response.get("LastModified"),
+    }
+
+'''
+    Deleting Files from S3 (Used for cleaning up intermediate files)
+'''
+def delete_files_from_s3(s3_file_paths: List[str]):
+    s3_keys = [
+        get_s3_key_from_url(s3_file_path)
+        for s3_file_path in s3_file_paths if s3_file_path
+    ]
+    if not s3_keys:
+        return
+
+    s3_client = s3.get_client()
+    try:
+        # delete_objects accepts at most 1000 keys per call
+        for i in range(0, len(s3_keys), 1000):
+            s3_client.delete_objects(
+                Bucket=settings.VIDEO_UPLOAD_S3_BUCKET,
+                Delete={"Objects": [{"Key": key} for key in s3_keys[i:i + 1000]]}
+            )
+        local_cache.discard(s3_keys)
+        logger.info(f"Deleted {len(s3_keys)} Files from S3")
+    except Exception as e:
+        logger.error(f"Delete from S3 failed: {e}")
+
+'''
+    Direct (Presigned) Upload to S3
+    The client uploads the parts straight to S3, no video bytes pass through the API
+'''
+async def create_presigned_multipart_upload(s3_key : str, content_type : str, file_size : int) -> dict:
+    s3_client = s3.get_client()
+    # S3 allows at most 10000 parts per upload
+    part_size = max(settings.S3_MULTIPART_PART_SIZE, math.ceil(file_size / 10000))
+    parts_count = max(1, math.ceil(file_size / part_size))
+
+    multipart_upload = await asyncio.to_thread(
+        s3_client.create_multipart_upload,
+        Bucket=settings.VIDEO_UPLOAD_S3_BUCKET,
+        Key=s3_key,
+        ContentType=content_type
+    )
+    upload_id = multipart_upload["UploadId"]
+
+    # Presigning is a local signature computation, no network calls
+    parts = [
+        {
+            "part_number": part_number,
+            "url": s3_client.generate_presigned_url(
+                "upload_part",
+                Params={
+                    "Bucket": settings.VIDEO_UPLOAD_S3_BUCKET,
+                    "Key": s3_key,
+                    "UploadId": upload_id,
+                    "PartNumber": part_number
+                },
+                ExpiresIn=settings.S3_PRESIGNED_URL_EXPIRY
+            )
+        }
+        for part_number in range(1, parts_count + 1)
+    ]
+    return {
+        "upload_id": upload_id,
+        "part_size": part_size,
+        "parts": parts
+    }
+
+'''
+    Parts S3 received for a Direct Upload, {part_number : etag} (listed 1000 parts per page)
+'''
+async def list_uploaded_parts(s3_key : str, upload_id : str) -> Dict[int, str]:
+    s3_client = s3.get_client()
+    uploaded_parts = {}
+    part_number_marker = 0
+    while True:
+        response = await asyncio.to_thread(
+            s3_client.list_parts,
+            Bucket=settings.VIDEO_UPLOAD_S3_BUCKET,
+            Key=s3_key,
+            UploadId=upload_id,
+            PartNumberMarker=part_number_marker
+        )
+        for part in response.get("Parts", []):
+            uploaded_parts[part["PartNumber"]] = part["ETag"]
+        if not response.get("IsTruncated"):
+            return uploaded_parts
+        part_number_marker = response["NextPartNumberMarker"]
+
+'''
+    Drops a Direct Upload which is not completed, otherwise S3 keeps (and bills) the uploaded parts
+'''
+async def abort_presigned_multipart_upload(s3_key : str, upload_id : str):
+    await asyncio.to_thread(
+        s3.get_client().abort_multipart_upload,
+        Bucket=settings.VIDEO_UPLOAD_S3_BUCKET,
+        Key=s3_key,
+        UploadId=upload_id
+    )
+
+'''
+    Completes a Direct Upload and returns the object metadata (size, ETag, content type) for verification
+'''
+async def complete_presigned_multipart_upload(s3_key : str, upload_id : str, parts : List[dict]) -> dict:
+    s3_client = s3.get_client()
+    await asyncio.to_thread(
+        s3_client.complete_multipart_upload,
+        Bucket=settings.VIDEO_UPLOAD_S3_BUCKET,
+        Key=s3_key,
+        UploadId=upload_id,
+        MultipartUpload={
+            "Parts": [
+                {"PartNumber": part.get("part_number"), "ETag": part.get("etag")}
+                for part in sorted(parts, key=lambda part: part.get("part_number"))
+            ]
+        }
+    )
+    head = await asyncio.to_thread(
+        s3_client.head_object,
+        Bucket=settings.VIDEO_UPLOAD_S3_BUCKET,
+        Key=s3_key
+    )
+    return {
+        "s3_url": f"https://{settings.VIDEO_UPLOAD_S3_BUCKET}.s3.{settings.S3_REGION}.amazonaws.com/{s3_key}",
+        "etag": head.get("ETag"),
+        "size": head.get("ContentLength"),
+        "content_type": head.get("ContentType")
+    }
+
+'''
+    Metadata of many objects (size, ETag, content type), HEAD requests run concurrently in threads
+    Returns {s3_key : metadata}, None for objects which do not exist
+'''
+async def head_objects(s3_keys : List[str]) -> Dict[str, Optional[dict]]:
+    s3_client = s3.get_client()
+    slots = asyncio.Semaphore(settings.S3_MAX_POOL_CONNECTIONS)
+
+    async def head(s3_key : str) -> Optional[dict]:
+        async with slots:
+            try:
+                head = await asyncio.to_thread(s3_client.head_object, Bucket=settings.VIDEO_UPLOAD_S3_BUCKET, Key=s3_key)
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                    return None
+                raise
+        return {
+            "s3_url": f"https://{settings.VIDEO_UPLOAD_S3_BUCKET}.s3.{settings.S3_REGION}.amazonaws.com/{s3_key}",
+            "etag": head.get("ETag"),
+            "size": head.get("ContentLength"),
+            "content_type": head.get("ContentType")
+        }
+
+    results = await asyncio.gather(*[head(s3_key) for s3_key in s3_keys])
+    return dict(zip(s3_keys, results))
+
+'''
+    Uploading a Directory to S3 (HLS / DASH packages), files are uploaded concurrently
+    Returns the S3 URL of the prefix, files keep their path relative to local_dir
+'''
+STREAMING_CONTENT_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".mpd": "application/dash+xml",
+    ".ts": "video/mp2t",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+    ".m4a": "audio/mp4",
+    ".jpg": "image/jpeg",
+    ".vtt": "text/vtt",
+}
+
+async def upload_directory_to_s3(local_dir: str, s3_prefix: str) -> str:
+    s3_client = s3.get_client()
+    in_flight = asyncio.Semaphore(settings.S3_TRANSFER_MAX_CONCURRENCY)
+
+    async def upload(file_path: str):
+        s3_key = f"{s3_prefix}/{os.path.relpath(file_path, local_dir)}"
+        content_type = STREAMING_CONTENT_TYPES.get(os.path.splitext(file_path)[1], "application/octet-stream")
+        async with in_flight:
+            await asyncio.to_thread(
+                s3_client.upload_file,
+                file_path,
+                settings.VIDEO_UPLOAD_S3_BUCKET,
+                s3_key,
+                ExtraArgs={
+                    "ContentType": content_type
+                },
+                Config=s3.transfer_config
+            )
+            record_bytes_transferred("upload", os.path.getsize(file_path))
+
+    file_paths = [os.path.join(root, file_name) for root, _, file_names in os.walk(local_dir) for file_name in file_names]
+    with track_stage(TimedStage.UPLOAD):
+        await asyncio.gather(*[upload(file_path) for file_path in file_paths])
+    logger.info(f"Uploaded {len(file_paths)} Files to S3 : {s3_prefix}")
+    return f"https://{settings.VIDEO_UPLOAD_S3_BUCKET}.s3.{settings.S3_REGION}.amazonaws.com/{s3_prefix}"
+
+'''
+    Deleting every File under a Prefix from S3 (HLS / DASH packages)
+'''
+def delete_prefix_from_s3(s3_prefix_path: str):
+    s3_prefix = get_s3_key_from_url(s3_prefix_path).rstrip("/") + "/"
+    s3_client = s3.get_client()
+    try:
+        paginator = s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=settings.VIDEO_UPLOAD_S3_BUCKET, Prefix=s3_prefix):
+            objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+            if objects:
+                s3_client.delete_objects(Bucket=settings.VIDEO_UPLOAD_S3_BUCKET, Delete={"Objects": objects})
+        logger.info(f"Deleted Prefix from S3 : {s3_prefix}")
+    except Exception as e:
+        logger.error(f"Delete Prefix from S3 failed: {e}")
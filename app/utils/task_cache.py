@@ -0,0 +1,184 @@
+from app.core.config import settings
+from app.utils.logger import get_logger
+from app.utils.redis_connect import redis_connection, get_sync_redis_client
+from app.constants.video_constants import VideoStatus
+
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+import asyncio
+import json
+import time
+import redis
+
+logger = get_logger(__name__)
+
+'''
+    Read-through Cache of Task Documents (status, output URLs, thumbnails), in front of the status / detail lookups
+        Level 1 : in-process LRU with TTL, per API worker, no network hop
+        Level 2 : Redis (TASK_CACHE_REDIS), shared by the API workers, a task loaded by one worker is a hit for the others
+    Terminal tasks (processed / failed) do not change anymore and are kept for TASK_CACHE_TERMINAL_TTL,
+    tasks still in progress only for TASK_CACHE_ACTIVE_TTL (a missed invalidation is stale for that long at most)
+    Writers invalidate the task (worker on status writes, API on delete) : the Redis entry is deleted and the
+    task_id is published on TASK_CACHE_INVALIDATION_CHANNEL, every API worker drops its in-process entry
+'''
+TASK_CACHE_KEY = "task_cache:{task_id}"
+TASK_CACHE_INVALIDATION_CHANNEL = "task_cache_invalidations"
+TERMINAL_STATUSES = [VideoStatus.PROCESSED.value, VideoStatus.FAILED.value]
+INVALIDATION_RETRY_SECONDS = 5
+
+def is_terminal(task : dict) -> bool:
+    return task.get('status') in TERMINAL_STATUSES
+
+def json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+def to_cacheable(task : dict) -> dict:
+    # Same value whether it comes from Mongo, the process or Redis (ObjectId / datetime as strings)
+    return json.loads(json.dumps(task, default=json_default))
+
+class TaskCache:
+    def __init__(self, max_entries : int, terminal_ttl : int, active_ttl : int, use_redis : bool):
+        self.max_entries = max_entries
+        self.terminal_ttl = terminal_ttl
+        self.active_ttl = active_ttl
+        self.use_redis = use_redis
+        self.entries : "OrderedDict[str, tuple]" = OrderedDict()    # task_id : (expires_at, task)
+        self.listener : Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get_ttl(self, task : dict) -> int:
+        return self.terminal_ttl if is_terminal(task) else self.active_ttl
+
+    def get_local(self, task_id : str) -> Optional[dict]:
+        entry = self.entries.get(task_id)
+        if not entry:
+            return None
+        if entry[0] < time.monotonic():
+            self.entries.pop(task_id, None)
+            return None
+        self.entries.move_to_end(task_id)
+        return entry[1]
+
+    def set_local(self, task_id : str, task : dict):
+        self.entries[task_id] = (time.monotonic() + self.get_ttl(task), task)
+        self.entries.move_to_end(task_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    '''
+        Tasks by task_id, from the process, then Redis, then the loader (one call for all the misses)
+        load_tasks : missing task_ids -> {task_id : task document}, unknown tasks are left out and never cached
+    '''
+    async def get_many(self, task_ids : List[str], load_tasks : Callable[[List[str]], Awaitable[Dict[str, dict]]]) -> Dict[str, dict]:
+        if not self.enabled:
+            return {task_id : to_cacheable(task) for task_id, task in (await load_tasks(task_ids)).items()}
+
+        tasks = {}
+        missing = []
+        for task_id in dict.fromkeys(task_ids):
+            task = self.get_local(task_id)
+            if task is None:
+                missing.append(task_id)
+            else:
+                tasks[task_id] = task
+
+        if missing and self.use_redis:
+            try:
+                client = await redis_connection.get_client()
+                values = await client.mget([TASK_CACHE_KEY.format(task_id=task_id) for task_id in missing])
+                for task_id, value in zip(missing, values):
+                    if value is not None:
+                        tasks[task_id] = json.loads(value)
+                        self.set_local(task_id, tasks[task_id])
+                missing = [task_id for task_id in missing if task_id not in tasks]
+            except redis.RedisError as e:
+                logger.error(f"Task Cache Read Failed : {e}")
+
+        if missing:
+            loaded = {task_id : to_cacheable(task) for task_id, task in (await load_tasks(missing)).items()}
+            for task_id, task in loaded.items():
+                self.set_local(task_id, task)
+            tasks.update(loaded)
+            if loaded and self.use_redis:
+                try:
+                    client = await redis_connection.get_client()
+                    pipeline = client.pipeline()
+                    for task_id, task in loaded.items():
+                        pipeline.set(TASK_CACHE_KEY.format(task_id=task_id), json.dumps(task), ex=self.get_ttl(task))
+                    await pipeline.execute()
+                except redis.RedisError as e:
+                    logger.error(f"Task Cache Write Failed : {e}")
+        return tasks
+
+    async def get(self, task_id : str, load_tasks : Callable[[List[str]], Awaitable[Dict[str, dict]]]) -> Optional[dict]:
+        return (await self.get_many([task_id], load_tasks)).get(task_id)
+
+    async def invalidate(self, task_id : str):
+        self.entries.pop(task_id, None)
+        if not self.enabled:
+            return
+        try:
+            client = await redis_connection.get_client()
+            pipeline = client.pipeline()
+            pipeline.delete(TASK_CACHE_KEY.format(task_id=task_id))
+            pipeline.publish(TASK_CACHE_INVALIDATION_CHANNEL, task_id)
+            await pipeline.execute()
+        except redis.RedisError as e:
+            logger.error(f"Task Cache Invalidation Failed : {task_id}, {e}")
+
+    '''
+        Background task of every API worker, drops the in-process entries invalidated by other processes
+        Resubscribes after a Redis failure, entries may be stale for their TTL meanwhile
+    '''
+    async def listen_for_invalidations(self):
+        while True:
+            try:
+                client = await redis_connection.get_client()
+                pubsub = client.pubsub()
+                await pubsub.subscribe(TASK_CACHE_INVALIDATION_CHANNEL)
+                try:
+                    async for message in pubsub.listen():
+                        if message.get('type') == 'message':
+                            self.entries.pop(message.get('data'), None)
+                finally:
+                    await pubsub.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Task Cache Invalidation Listener Failed : {e}")
+                await asyncio.sleep(INVALIDATION_RETRY_SECONDS)
+
+    def start(self):
+        if self.enabled and not self.listener:
+            self.listener = asyncio.create_task(self.listen_for_invalidations())
+
+    async def stop(self):
+        if self.listener:
+            self.listener.cancel()
+            try:
+                await self.listener
+            except asyncio.CancelledError:
+                pass
+            self.listener = None
+
+task_cache = TaskCache(settings.TASK_CACHE_MAX_ENTRIES, settings.TASK_CACHE_TERMINAL_TTL, settings.TASK_CACHE_ACTIVE_TTL, settings.TASK_CACHE_REDIS)
+
+'''
+    Invalidation from the Celery worker (status / output writes), sync client like the progress publisher
+'''
+def invalidate_cached_task(task_id : str):
+    if not settings.TASK_CACHE_MAX_ENTRIES:
+        return
+    try:
+        client = get_sync_redis_client()
+        pipeline = client.pipeline()
+        pipeline.delete(TASK_CACHE_KEY.format(task_id=task_id))
+        pipeline.publish(TASK_CACHE_INVALIDATION_CHANNEL, task_id)
+        pipeline.execute()
+    except redis.RedisError as e:
+        # Best effort, the entry of a task in progress expires after TASK_CACHE_ACTIVE_TTL
+        logger.error(f"Task Cache Invalidation Failed : {task_id}, {e}")
@@ -0,0 +1,80 @@
+from typing import Dict, Optional
+import json
+import re
+import time
+import httpx
+
+'''
+    Benchmark Client, drives the public API the way a user would
+        upload : POST /api/video/upload (multipart, fields before the file)
+        wait   : GET /api/video/task/events (Server-Sent Events) until the task is processed / failed
+'''
+TERMINAL_STAGES = ("processed", "failed")
+
+async def upload_video(client : httpx.AsyncClient, api_url : str, media : dict, file_path : str, user_id : str, profile : str, encoding_profile : str) -> dict:
+    start_time = time.perf_counter()
+    with open(file_path, "rb") as f:
+        response = await client.post(
+            f"{api_url}/api/video/upload",
+            data={'user_id' : user_id, 'profile' : profile, 'encoding_profile' : encoding_profile},
+            files={'video_file' : (file_path.rsplit("/", 1)[-1], f, media.get('content_type'))},
+        )
+    upload_seconds = time.perf_counter() - start_time
+    body = response.json() if response.status_code == 200 else {}
+    return {
+        'task_id' : body.get('task_id'),
+        'upload_status' : body.get('status') or f"http {response.status_code}",
+        'internal_status_code' : body.get('internal_status_code'),
+        'upload_seconds' : upload_seconds,
+        'upload_started_at' : start_time,
+    }
+
+'''
+    Follows the progress events of a task, returns the final stage and the time each stage was first seen (seconds since started_at)
+'''
+async def wait_for_task(client : httpx.AsyncClient, api_url : str, task_id : str, started_at : float, timeout : float) -> dict:
+    stages = {}
+    final_stage = None
+    try:
+        async with client.stream("GET", f"{api_url}/api/video/task/events", params={'task_id' : task_id}, timeout=httpx.Timeout(timeout, connect=10)) as response:
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                event = json.loads(line[len("data:"):].strip())
+                stage = event.get('stage')
+                stages.setdefault(stage, time.perf_counter() - started_at)
+                if stage in TERMINAL_STAGES:
+                    final_stage = stage
+                    break
+    except httpx.HTTPError as e:
+        final_stage = f"error : {e.__class__.__name__}"
+    return {
+        'final_stage' : final_stage or "timeout",
+        'end_to_end_seconds' : time.perf_counter() - started_at,
+        'stages' : stages,
+    }
+
+'''
+    Prometheus text format -> {'name{labels}' : value}, comments and unparsable lines are skipped
+'''
+SAMPLE_PATTERN = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*(?:\{[^}]*\})?)\s+([-+0-9.eE]+|NaN|[+-]Inf)$')
+
+async def scrape_metrics(client : httpx.AsyncClient, metrics_url : str) -> Dict[str, float]:
+    response = await client.get(metrics_url)
+    response.raise_for_status()
+    samples = {}
+    for line in response.text.splitlines():
+        match = SAMPLE_PATTERN.match(line.strip())
+        if match:
+            samples[match.group(1)] = float(match.group(2))
+    return samples
+
+def get_sample(samples : Dict[str, float], name : str, labels : Optional[Dict[str, str]] = None) -> float:
+    # Sum of every sample of the metric carrying the labels (label order of the exposition is not guaranteed)
+    wanted = {f'{key}="{value}"' for key, value in (labels or {}).items()}
+    total = 0.0
+    for sample_key, value in samples.items():
+        sample_name, _, sample_labels = sample_key.partition("{")
+        if sample_name == name and wanted <= set(filter(None, sample_labels.rstrip("}").split(","))):
+            total += value
+    return total
@@ -0,0 +1,37 @@
+from benchmarks.report import compare_results, format_value
+
+import argparse
+import json
+import sys
+
+'''
+    Compares two benchmark runs (benchmarks/run.py results), exits with 1 when a metric regressed above the threshold
+    Meant as a gate before a rollout : run the baseline on the current release, the candidate on the new build, same matrix
+
+    python -m benchmarks.compare benchmarks/results/main_<timestamp>.json benchmarks/results/candidate_<timestamp>.json --threshold 0.1
+'''
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark runs")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change counted as a regression (0.1 = 10 %%)")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    rows = compare_results(baseline, candidate, args.threshold)
+    print(f"{'metric':<44}{'baseline':>12}{'candidate':>12}{'change':>10}")
+    for row in rows:
+        change = f"{row['change'] * 100:+.1f}%" if row['change'] is not None else "-"
+        flag = "  REGRESSION" if row['regression'] else ""
+        print(f"{row['metric']:<44}{format_value(row['baseline']):>12}{format_value(row['candidate']):>12}{change:>10}{flag}")
+
+    regressions = [row for row in rows if row['regression']]
+    print(f"\n{len(regressions)} regression(s) above {args.threshold * 100:.0f}% ({baseline.get('git_commit')} -> {candidate.get('git_commit')})")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+from typing import List
+import os
+import subprocess
+
+'''
+    Synthetic Test Videos, generated with ffmpeg's testsrc2 (moving pattern + counter) and a sine tone
+    Generated once per (duration, resolution, codec) and cached in the media directory
+    Every upload gets a copy with a unique comment tag (stream copy), so the content cache never deduplicates two uploads
+'''
+RESOLUTIONS = {
+    "360p" : "640x360",
+    "480p" : "854x480",
+    "720p" : "1280x720",
+    "1080p" : "1920x1080",
+}
+
+# codec : (ffmpeg arguments, container extension, upload content type)
+# h264 / mp4 is web compatible and only remuxed, the others are transcoded
+CODECS = {
+    "h264" : (['-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-movflags', '+faststart'], "mp4", "video/mp4"),
+    "hevc" : (['-c:v', 'libx265', '-preset', 'ultrafast', '-tag:v', 'hvc1', '-pix_fmt', 'yuv420p', '-c:a', 'aac'], "mp4", "video/mp4"),
+    "mpeg4" : (['-c:v', 'mpeg4', '-q:v', '5', '-c:a', 'pcm_s16le'], "avi", "video/x-msvideo"),
+}
+
+def get_scenario_name(duration : int, resolution : str, codec : str) -> str:
+    return f"{codec}_{resolution}_{duration}s"
+
+def generate_video(media_dir : str, duration : int, resolution : str, codec : str) -> dict:
+    codec_args, extension, content_type = CODECS[codec]
+    os.makedirs(media_dir, exist_ok=True)
+    path = os.path.join(media_dir, f"{get_scenario_name(duration, resolution, codec)}.{extension}")
+    if not os.path.isfile(path):
+        partial_path = f"{path}.partial.{extension}"
+        subprocess.run([
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'lavfi', '-i', f'testsrc2=size={RESOLUTIONS[resolution]}:rate=30:duration={duration}',
+            '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=48000:duration={duration}',
+            '-map', '0:v', '-map', '1:a',
+            *codec_args,
+            partial_path
+        ], check=True)
+        os.replace(partial_path, path)
+    return {
+        'scenario' : get_scenario_name(duration, resolution, codec),
+        'path' : path,
+        'content_type' : content_type,
+        'duration' : duration,
+        'size' : os.path.getsize(path),
+    }
+
+def generate_matrix(media_dir : str, durations : List[int], resolutions : List[str], codecs : List[str]) -> List[dict]:
+    return [
+        generate_video(media_dir, duration, resolution, codec)
+        for duration in durations for resolution in resolutions for codec in codecs
+    ]
+
+def make_unique_copy(source_path : str, output_path : str, tag : str):
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-i', source_path,
+        '-map', '0', '-c', 'copy',
+        '-metadata', f'comment={tag}',
+        output_path
+    ], check=True)
@@ -0,0 +1,113 @@
+from benchmarks.client import get_sample
+
+from typing import Dict, List, Optional
+import math
+
+'''
+    Benchmark Report, summary statistics of a run and the comparison of two runs
+'''
+PERCENTILES = (50, 90, 95, 99)
+TIMED_STAGES = ("download", "probe", "encode", "thumbnail", "upload", "db_update")
+
+def percentile(values : List[float], p : float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    lower, upper = math.floor(rank), math.ceil(rank)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+def summarize(values : List[float]) -> dict:
+    summary = {f"p{p}" : percentile(values, p) for p in PERCENTILES}
+    summary['mean'] = sum(values) / len(values) if values else None
+    summary['max'] = max(values) if values else None
+    return summary
+
+'''
+    Per scenario : upload throughput (MB/s), end-to-end latency (upload start -> processed) and the realtime factor
+    (media seconds processed per wall second at p50), failed uploads / tasks are counted but not timed
+'''
+def summarize_records(records : List[dict]) -> dict:
+    scenarios = {}
+    for record in records:
+        scenarios.setdefault(record.get('scenario'), []).append(record)
+
+    summary = {}
+    for scenario, scenario_records in sorted(scenarios.items()):
+        processed = [r for r in scenario_records if r.get('final_stage') == "processed"]
+        latencies = [r.get('end_to_end_seconds') for r in processed]
+        latency = summarize(latencies)
+        summary[scenario] = {
+            'uploads' : len(scenario_records),
+            'processed' : len(processed),
+            'failed' : len(scenario_records) - len(processed),
+            'upload_mbps' : summarize([r.get('size') / r.get('upload_seconds') / 1e6 for r in scenario_records if r.get('task_id') and r.get('upload_seconds')]),
+            'latency_seconds' : latency,
+            'realtime_factor_p50' : processed[0].get('duration') / latency.get('p50') if processed and latency.get('p50') else None,
+        }
+    return summary
+
+'''
+    Stage timings of the workers over the run, from the difference of two scrapes of pipeline_stage_duration_seconds
+'''
+def summarize_stage_metrics(before : List[Dict[str, float]], after : List[Dict[str, float]]) -> dict:
+    stages = {}
+    for stage in TIMED_STAGES:
+        labels = {'stage' : stage}
+        total = sum(get_sample(a, "pipeline_stage_duration_seconds_sum", labels) - get_sample(b, "pipeline_stage_duration_seconds_sum", labels) for b, a in zip(before, after))
+        count = sum(get_sample(a, "pipeline_stage_duration_seconds_count", labels) - get_sample(b, "pipeline_stage_duration_seconds_count", labels) for b, a in zip(before, after))
+        stages[stage] = {
+            'count' : int(count),
+            'total_seconds' : total,
+            'mean_seconds' : total / count if count else None,
+        }
+
+    transferred = {
+        direction : sum(get_sample(a, "s3_bytes_transferred_total", {'direction' : direction}) - get_sample(b, "s3_bytes_transferred_total", {'direction' : direction}) for b, a in zip(before, after))
+        for direction in ("download", "upload")
+    }
+    speed_sum = sum(get_sample(a, "encode_speed_ratio_sum") - get_sample(b, "encode_speed_ratio_sum") for b, a in zip(before, after))
+    speed_count = sum(get_sample(a, "encode_speed_ratio_count") - get_sample(b, "encode_speed_ratio_count") for b, a in zip(before, after))
+    return {
+        'stages' : stages,
+        's3_bytes_transferred' : transferred,
+        'encode_speed_ratio_mean' : speed_sum / speed_count if speed_count else None,
+    }
+
+'''
+    Metrics compared between two runs, (path in the result, True when higher is better)
+'''
+def get_comparable_metrics(result : dict) -> Dict[str, tuple]:
+    metrics = {}
+    for scenario, summary in result.get('scenarios', {}).items():
+        metrics[f"{scenario} latency p50"] = (summary['latency_seconds'].get('p50'), False)
+        metrics[f"{scenario} latency p95"] = (summary['latency_seconds'].get('p95'), False)
+        metrics[f"{scenario} upload MB/s p50"] = (summary['upload_mbps'].get('p50'), True)
+    for stage, timing in result.get('worker_metrics', {}).get('stages', {}).items():
+        metrics[f"stage {stage} mean"] = (timing.get('mean_seconds'), False)
+    metrics["tasks per minute"] = (result.get('overall', {}).get('tasks_per_minute'), True)
+    return metrics
+
+'''
+    Relative change per metric, regressions are changes for the worse above the threshold (0.1 = 10 %)
+'''
+def compare_results(baseline : dict, candidate : dict, threshold : float) -> List[dict]:
+    baseline_metrics, candidate_metrics = get_comparable_metrics(baseline), get_comparable_metrics(candidate)
+    rows = []
+    for name, (candidate_value, higher_is_better) in candidate_metrics.items():
+        baseline_value = (baseline_metrics.get(name) or (None, None))[0]
+        change = (candidate_value - baseline_value) / baseline_value if baseline_value and candidate_value is not None else None
+        worse = change is not None and (-change if higher_is_better else change) > threshold
+        rows.append({
+            'metric' : name,
+            'baseline' : baseline_value,
+            'candidate' : candidate_value,
+            'change' : change,
+            'regression' : worse,
+        })
+    return rows
+
+def format_value(value) -> str:
+    if value is None:
+        return "-"
+    return f"{value:.3f}" if isinstance(value, float) else str(value)
@@ -0,0 +1,130 @@
+from benchmarks.media import generate_matrix, make_unique_copy
+from benchmarks.client import upload_video, wait_for_task, scrape_metrics
+from benchmarks.report import summarize_records, summarize_stage_metrics, format_value
+
+from datetime import datetime
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import tempfile
+import time
+import uuid
+import httpx
+
+'''
+    Benchmark / Load Test of the Upload and Processing Pipeline
+    Runs offline against the stack of benchmarks/docker-compose.benchmark.yml (MinIO for S3, mongod, Redis broker) :
+        1. Generates the synthetic videos of the matrix (durations x resolutions x codecs), cached in --media-dir
+        2. Uploads every scenario --uploads times, at most --concurrency uploads / tasks in flight
+           every upload is a unique copy (no content cache hit) from a unique user (no per user rate limit)
+        3. Follows each task over Server-Sent Events until it is processed / failed
+        4. Scrapes the worker metrics before and after the run for the per-stage timings
+    Writes <output-dir>/<label>_<timestamp>.json, compare two runs with benchmarks/compare.py
+
+    python -m benchmarks.run --api http://localhost:8004 --worker-metrics http://localhost:9541/metrics,http://localhost:9542/metrics,http://localhost:9543/metrics
+'''
+def parse_args():
+    parser = argparse.ArgumentParser(description="Upload / processing pipeline benchmark")
+    parser.add_argument("--api", default="http://localhost:8004")
+    parser.add_argument("--worker-metrics", default="", help="Comma separated /metrics URLs of the workers")
+    parser.add_argument("--durations", default="10,60", help="Seconds, comma separated")
+    parser.add_argument("--resolutions", default="480p,720p", help="360p, 480p, 720p, 1080p")
+    parser.add_argument("--codecs", default="h264,hevc", help="h264 (remux), hevc, mpeg4 (transcode)")
+    parser.add_argument("--profile", default="mp4", help="mp4, hls, hls_dash")
+    parser.add_argument("--encoding-profile", default="standard")
+    parser.add_argument("--uploads", type=int, default=3, help="Uploads per scenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="Uploads / tasks in flight")
+    parser.add_argument("--timeout", type=float, default=1800, help="Seconds per task")
+    parser.add_argument("--media-dir", default=os.path.join(os.path.dirname(__file__), "media"))
+    parser.add_argument("--output-dir", default=os.path.join(os.path.dirname(__file__), "results"))
+    parser.add_argument("--label", default="run")
+    return parser.parse_args()
+
+async def run_upload(client : httpx.AsyncClient, args, media : dict, slots : asyncio.Semaphore, work_dir : str) -> dict:
+    async with slots:
+        tag = uuid.uuid4().hex
+        extension = os.path.splitext(media.get('path'))[1]
+        upload_path = os.path.join(work_dir, f"{media.get('scenario')}_{tag}{extension}")
+        await asyncio.to_thread(make_unique_copy, media.get('path'), upload_path, tag)
+        try:
+            upload = await upload_video(client, args.api, media, upload_path, f"benchmark-{tag}", args.profile, args.encoding_profile)
+        finally:
+            os.remove(upload_path)
+
+        record = {
+            'scenario' : media.get('scenario'),
+            'duration' : media.get('duration'),
+            'size' : media.get('size'),
+            **upload,
+        }
+        if not upload.get('task_id'):
+            record['final_stage'] = f"upload {upload.get('upload_status')} {upload.get('internal_status_code')}"
+            return record
+        record.update(await wait_for_task(client, args.api, upload.get('task_id'), upload.get('upload_started_at'), args.timeout))
+        print(f"{record['scenario']} {record['task_id']} {record['final_stage']} {record['end_to_end_seconds']:.1f}s", flush=True)
+        return record
+
+async def scrape_all(client : httpx.AsyncClient, metrics_urls):
+    return await asyncio.gather(*[scrape_metrics(client, url) for url in metrics_urls])
+
+def get_git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+async def main():
+    args = parse_args()
+    durations = [int(d) for d in args.durations.split(",")]
+    matrix = generate_matrix(args.media_dir, durations, args.resolutions.split(","), args.codecs.split(","))
+    metrics_urls = [url for url in args.worker_metrics.split(",") if url]
+
+    async with httpx.AsyncClient(timeout=httpx.Timeout(600, connect=10)) as client:
+        metrics_before = await scrape_all(client, metrics_urls)
+        slots = asyncio.Semaphore(args.concurrency)
+        started_at = time.perf_counter()
+        with tempfile.TemporaryDirectory() as work_dir:
+            records = await asyncio.gather(*[
+                run_upload(client, args, media, slots, work_dir) for media in matrix for _ in range(args.uploads)
+            ])
+        wall_seconds = time.perf_counter() - started_at
+        metrics_after = await scrape_all(client, metrics_urls)
+
+    processed = [r for r in records if r.get('final_stage') == "processed"]
+    result = {
+        'label' : args.label,
+        'started_at' : datetime.now().isoformat(),
+        'git_commit' : get_git_commit(),
+        'config' : {key : value for key, value in vars(args).items() if key not in ("media_dir", "output_dir")},
+        'overall' : {
+            'uploads' : len(records),
+            'processed' : len(processed),
+            'wall_seconds' : wall_seconds,
+            'tasks_per_minute' : len(processed) / wall_seconds * 60 if wall_seconds else None,
+            'media_seconds_per_second' : sum(r.get('duration') for r in processed) / wall_seconds if wall_seconds else None,
+            'uploaded_mbps' : sum(r.get('size') for r in records if r.get('task_id')) / wall_seconds / 1e6 if wall_seconds else None,
+        },
+        'scenarios' : summarize_records(records),
+        'worker_metrics' : summarize_stage_metrics(metrics_before, metrics_after) if metrics_urls else {},
+        'records' : [{key : value for key, value in r.items() if key != 'upload_started_at'} for r in records],
+    }
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_path = os.path.join(args.output_dir, f"{args.label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output_path, "w") as f:
+        json.dump(result, f, indent=2)
+
+    print(f"\n{'scenario':<28}{'ok/total':>10}{'upload MB/s':>13}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}")
+    for scenario, summary in result['scenarios'].items():
+        latency = summary['latency_seconds']
+        print(f"{scenario:<28}{summary['processed']:>5}/{summary['uploads']:<4}{format_value(summary['upload_mbps']['p50']):>13}"
+              f"{format_value(latency['p50']):>9}{format_value(latency['p95']):>9}{format_value(latency['p99']):>9}")
+    for stage, timing in result['worker_metrics'].get('stages', {}).items():
+        print(f"stage {stage:<12} count {timing['count']:>5}  mean {format_value(timing['mean_seconds'])} s")
+    print(f"tasks / minute : {format_value(result['overall']['tasks_per_minute'])}, media seconds / second : {format_value(result['overall']['media_seconds_per_second'])}")
+    print(f"Results : {output_path}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
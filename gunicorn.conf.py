@@ -0,0 +1,15 @@
+from app.utils.metrics import reset_multiprocess_dir, mark_process_dead
+
+'''
+    Gunicorn Configuration : gunicorn -c gunicorn.conf.py main:app
+    Prometheus multiprocess mode (PROMETHEUS_MULTIPROC_DIR) : samples of the previous run are cleared on start,
+    the live gauges of a worker are dropped when it exits
+'''
+bind = "0.0.0.0:8000"
+worker_class = "uvicorn.workers.UvicornWorker"
+
+def on_starting(server):
+    reset_multiprocess_dir()
+
+def child_exit(server, worker):
+    mark_process_dead(worker.pid)
@@ -1,15 +1,25 @@
+# First import : loads .env, PROMETHEUS_MULTIPROC_DIR has to be set before prometheus_client is imported
+from app.core.config import settings
+
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.docs import get_swagger_ui_html
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
 from fastapi.staticfiles import StaticFiles
+from prometheus_client import CONTENT_TYPE_LATEST
+import psutil
 import time
 
-from app.core.config import settings
 from app.utils.logger import get_logger
 from app.api.health import router as health_router
 from app.api.video_processing import router as video_processing_router
 from app.utils.db_connect import mongodb
+from app.utils.db_indexes import create_indexes
+from app.utils.s3_connect import s3
+from app.utils.redis_connect import redis_connection
+from app.utils.task_cache import task_cache
+from app.core.task_dispatcher import task_dispatcher
+from app.utils.metrics import HTTP_REQUEST_DURATION, generate_metrics, update_queue_depth, prepare_multiprocess_dir
 
 logger = get_logger("main")
 
@@ -51,6 +61,14 @@ async def log_requests(request: Request, call_next):
     # Calculate and log processing time
     process_time = time.time() - start_time
     logger.info(f"Request completed: {request.method} {request.url.path} - Status: {response.status_code} - Time: {process_time:.4f}s")
+
+    # Latency per route template (/api/video/task), not per path, so task ids do not blow up the label set
+    route = request.scope.get("route")
+    HTTP_REQUEST_DURATION.labels(
+        method=request.method,
+        route=route.path if route else "unmatched",
+        status=response.status_code
+    ).observe(process_time)
     
     # Add processing time header to response
     response.headers["X-Process-Time"] = str(process_time)
@@ -65,12 +83,24 @@ app.include_router(video_processing_router, prefix="/api/video")
 '''
 @app.on_event("startup")
 async def startup_event():
+    prepare_multiprocess_dir()
     await mongodb.connect()
     logger.info("Connected to MongoDB")
+    await create_indexes()
+    s3.connect()
+    await redis_connection.connect()
+    task_cache.start()
+    task_dispatcher.start()
+    # First call starts the CPU measurement, /analytics/system then reads it without blocking
+    psutil.cpu_percent(interval=None)
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await task_dispatcher.stop()
+    await task_cache.stop()
     await mongodb.close()
+    s3.close()
+    await redis_connection.close()
 
 @app.get("/")
 async def root():
@@ -84,6 +114,18 @@ async def root():
         "version": settings.APP_VERSION
     } 
 
+'''
+    Prometheus Metrics (see metrics.py), merged across the gunicorn workers in multiprocess mode
+    Queue depth is read from the broker on every scrape
+'''
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    try:
+        await update_queue_depth()
+    except Exception as e:
+        logger.error(f"Queue Depth Failed : {e}")
+    return Response(content=generate_metrics(), media_type=CONTENT_TYPE_LATEST)
+
 # Serve Swagger UI using custom openapi.yaml
 @app.get("/docs", include_in_schema=False)
 async def custom_swagger_ui():